@@ -1,101 +1,879 @@
-import yfinance as yf
-import requests
-import pandas as pd
+import data_manager as dm
+import metrics
+import ratelimit as rl
+import concurrent.futures
+import os
+import random
+import sqlite3
+import threading
+import time
+
+# yfinance / requests / pandas 載入很慢，一律在第一次用到時才 import
 
 
 EXCHANGE_RATE_API_KEY = "@@@"
 BASE_CURRENCY = "TWD"
 
+COINGECKO_API = "https://api.coingecko.com/api/v3"
+EXCHANGE_RATE_API = "https://v6.exchangerate-api.com/v6"
+YAHOO_CHART_API = "https://query1.finance.yahoo.com/v8/finance/chart"
+# CoinGecko simple/price 的 ids 參數長度上限 (保守估計，避免 URL 過長被拒)
+COINGECKO_MAX_IDS_CHARS = 1500
+COINGECKO_MAX_IDS_PER_CALL = 250
 
-def get_stock_price(symbol):
+# --- HTTP 連線池設定 ---
+HTTP_POOL_MAXSIZE = 16  # 每個 host 的最大連線數，同時也是抓價執行緒池的大小
+HTTP_POOL_HOSTS = 8  # 保留連線池的 host 數量
+HTTP_TIMEOUT = (3.05, 10)  # (連線逾時, 讀取逾時) 秒
+HTTP_MAX_RETRIES = 3
+HTTP_BACKOFF_BASE = 0.5
+HTTP_BACKOFF_MAX = 8.0
+HTTP_RETRY_STATUS = {429, 500, 502, 503, 504}
+
+# --- 各 provider 的請求速率上限: (每秒補充的 token, 桶容量) ---
+# 同一程序內所有執行緒與 Streamlit session 共用；0 表示不限制
+# 可用環境變數覆寫，例如 PYASSET_RATE_COINGECKO=0.5,5 或 PYASSET_RATE_YAHOO=0
+PROVIDER_RATE_LIMITS = {
+    'yahoo': (10.0, 20),
+    'coingecko': (0.5, 5),  # 免費方案約每分鐘 30 次
+    'exchangerate': (1.0, 2),
+}
+
+# --- 斷路器: 連續失敗次數達門檻後，該 provider 暫停呼叫的秒數 ---
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_RESET_SECONDS = 60
+
+# --- 舊報價 (stale-while-revalidate) ---
+# 快取過期或抓價失敗時，先回傳快取中最後一次成功的價格並標記為舊報價，同時在背景重新抓價
+# 超過 QUOTE_STALE_MAX_AGE 秒的舊價不再使用 (視為缺價)；PYASSET_SWR=0 關閉背景重抓 (仍會以舊價補失敗)
+QUOTE_STALE_MAX_AGE = 7 * 86400
+SWR_ENABLED = os.environ.get('PYASSET_SWR', '1') != '0'
+
+# 匯率 API 失敗時的預設值
+DEFAULT_USD_RATES = {"USD": 1.0, "TWD": 30.5}
+FX_MEMORY_TTL = 600  # 從 SQLite 載入的匯率表在記憶體中保留的秒數
+FX_RETRY_AFTER_FAILURE = 300
+
+# --- 報價快取 (SQLite，跨程序、重啟後仍有效) ---
+QUOTE_CACHE_FILE = 'market_cache.db'
+CACHE_TTL = {
+    'stock': 600,
+    'crypto': 300,
+    'fx': 3600,
+}
+
+_session = None
+_session_lock = threading.Lock()
+_http_stats = {"requests": 0, "retries": 0, "errors": 0}
+_http_stats_lock = threading.Lock()
+_fx_table = {"rates": None, "expires_at": 0.0}
+_fx_lock = threading.Lock()
+_buckets = {}
+_buckets_lock = threading.Lock()
+_http_flights = rl.SingleFlight('http')
+_yahoo_flights = rl.SingleFlight('yahoo')
+_breakers = {}
+_revalidating = set()  # {(kind, key)} 背景重抓中的代號
+_revalidate_lock = threading.Lock()
+
+
+# --- 共用 HTTP Session (keep-alive 連線池) ---
+def get_session():
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+                session = requests.Session()
+                # pool_block=True: 同一 host 的連線數達上限時排隊等待，而不是另開一次性連線
+                adapter = HTTPAdapter(pool_connections=HTTP_POOL_HOSTS, pool_maxsize=HTTP_POOL_MAXSIZE,
+                                      pool_block=True, max_retries=0)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _session = session
+    return _session
+
+
+def _count(key, n=1):
+    with _http_stats_lock:
+        _http_stats[key] += n
+
+
+def backoff_delay(attempt, retry_after=None):
+    """指數退避 + full jitter；若伺服器有給 Retry-After 則以其為準"""
+    if retry_after:
+        try:
+            return min(float(retry_after), HTTP_BACKOFF_MAX)
+        except ValueError:
+            pass
+    return random.uniform(0, min(HTTP_BACKOFF_MAX, HTTP_BACKOFF_BASE * (2 ** attempt)))
+
+
+# --- 速率限制 ---
+def _env_rate_limits():
+    limits = dict(PROVIDER_RATE_LIMITS)
+    for provider in limits:
+        value = os.environ.get(f"PYASSET_RATE_{provider.upper()}")
+        if value:
+            parts = [float(v) for v in value.split(',')]
+            limits[provider] = (parts[0], parts[1] if len(parts) > 1 else None)
+    return limits
+
+
+def rate_limiter(provider):
+    """回傳該 provider 共用的 TokenBucket (第一次使用時依設定建立)"""
+    bucket = _buckets.get(provider)
+    if bucket is None:
+        with _buckets_lock:
+            bucket = _buckets.get(provider)
+            if bucket is None:
+                rate, burst = _env_rate_limits().get(provider, (0, None))
+                bucket = _buckets[provider] = rl.TokenBucket(provider, rate, burst)
+    return bucket
+
+
+def set_rate_limit(provider, rate, burst=None):
+    """執行中調整速率 (例如 benchmark 改連本機假伺服器時傳 0 關閉限制)"""
+    PROVIDER_RATE_LIMITS[provider] = (rate, burst)
+    rate_limiter(provider).configure(rate, burst)
+
+
+def rate_limit_status():
+    """各 provider 的速率設定與統計，以及合併掉的重複請求數"""
+    rows = [rate_limiter(p).status() for p in sorted(set(PROVIDER_RATE_LIMITS) | set(_buckets))]
+    coalesced = {f.name: f.coalesced for f in (_http_flights, _yahoo_flights)}
+    return rows, coalesced
+
+
+# --- 斷路器 ---
+def circuit_breaker(provider):
+    breaker = _breakers.get(provider)
+    if breaker is None:
+        with _buckets_lock:
+            breaker = _breakers.get(provider)
+            if breaker is None:
+                breaker = _breakers[provider] = rl.CircuitBreaker(provider, CIRCUIT_FAILURE_THRESHOLD,
+                                                                  CIRCUIT_RESET_SECONDS)
+    return breaker
+
+
+def circuit_open(provider):
+    """該 provider 的斷路器是否開啟中 (尚未到試探時間)"""
+    breaker = _breakers.get(provider)
+    return breaker is not None and breaker.state == 'open' and breaker.retry_in() > 0
+
+
+def circuit_status():
+    return [circuit_breaker(p).status() for p in sorted(set(PROVIDER_RATE_LIMITS) | set(_breakers))]
+
+
+def _guarded(provider, func, *args, **kwargs):
+    """經過斷路器呼叫 func：斷路中直接丟出 CircuitOpenError；func 丟出例外算一次失敗"""
+    breaker = circuit_breaker(provider)
+    breaker.check()
     try:
-        stock = yf.Ticker(symbol)
-        # 嘗試多個可能的 key
-        price = stock.info.get('currentPrice') or stock.info.get('regularMarketPrice') or stock.info.get('ask')
-        if price:
-            return float(price)
+        result = func(*args, **kwargs)
+    except Exception as e:
+        breaker.record_failure(e)
+        raise
+    breaker.record_success()
+    return result
 
-        # 如果 info 抓不到，嘗試用 fast_info (某些版本 yfinance 較穩)
-        if hasattr(stock, 'fast_info'):
-            return float(stock.fast_info.last_price)
 
-        return 0.0
-    except Exception:
-        return 0.0
+def _provider_for(url):
+    for provider, base in (('coingecko', COINGECKO_API), ('exchangerate', EXCHANGE_RATE_API),
+                           ('yahoo', YAHOO_CHART_API)):
+        if url.startswith(base):
+            return provider
+    return None
 
 
-def get_crypto_price(crypto_id):
-    url = f"https://api.coingecko.com/api/v3/simple/price?ids={crypto_id}&vs_currencies={BASE_CURRENCY.lower()}"
+def http_get(url, params=None, timeout=None):
+    """
+    所有對外 GET 請求的統一入口
+    使用共用連線池、連線/讀取逾時，遇到 429/5xx 或連線錯誤時退避重試；每次送出 (含重試) 前先取 provider 的 token
+    同時有相同網址與參數的請求時只送一次，其餘呼叫端共用同一個 (已讀完內容的) response
+    """
+    key = (url, repr(sorted(params.items())) if params else None)
+    return _http_flights.do(key, _http_get, url, params, timeout)
+
+
+def _http_get(url, params=None, timeout=None):
+    provider = _provider_for(url)
+    if provider is None:
+        return _send_with_retries(url, params, timeout, provider)
+    return _guarded(provider, _send_checked, url, params, timeout, provider)
+
+
+def _send_checked(url, params, timeout, provider):
+    """重試用完仍是 5xx / 429 時丟出 HTTPError，讓斷路器把這次呼叫記為一次失敗 (而不是成功)"""
+    import requests
+    response = _send_with_retries(url, params, timeout, provider)
+    if response.status_code >= 500 or response.status_code == 429:
+        raise requests.HTTPError(f"{response.status_code} from {provider}: {url}", response=response)
+    return response
+
+
+def _send_with_retries(url, params, timeout, provider):
+    import requests
+    session = get_session()
+    host = url.split("/")[2] if "://" in url else url
+    for attempt in range(HTTP_MAX_RETRIES + 1):
+        if provider:
+            rate_limiter(provider).acquire()
+        _count("requests")
+        metrics.inc('http_requests_total', host=host)
+        try:
+            response = session.get(url, params=params, timeout=timeout or HTTP_TIMEOUT)
+        except (requests.ConnectionError, requests.Timeout):
+            _count("errors")
+            metrics.inc('http_errors_total', host=host)
+            if attempt >= HTTP_MAX_RETRIES:
+                raise
+            _count("retries")
+            time.sleep(backoff_delay(attempt))
+            continue
+
+        if response.status_code in HTTP_RETRY_STATUS and attempt < HTTP_MAX_RETRIES:
+            _count("retries")
+            metrics.inc('http_retries_total', host=host, status=response.status_code)
+            delay = backoff_delay(attempt, response.headers.get("Retry-After"))
+            response.close()
+            time.sleep(delay)
+            continue
+        response.content  # 先讀完內容，合併的等待者才能安全共用
+        return response
+
+
+def get_http_stats():
+    """
+    回傳連線池統計，reused_connections 即省下的 TCP+TLS 握手次數
+    """
+    with _http_stats_lock:
+        stats = dict(_http_stats)
+
+    new_connections = 0
+    pooled_requests = 0
+    if _session is not None:
+        for adapter in set(_session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                new_connections += pool.num_connections
+                pooled_requests += pool.num_requests
+
+    stats["new_connections"] = new_connections
+    stats["reused_connections"] = max(pooled_requests - new_connections, 0)
+    return stats
+
+
+def _cache_connect():
+    conn = sqlite3.connect(QUOTE_CACHE_FILE, timeout=10)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS quotes (
+            kind TEXT NOT NULL,
+            key TEXT NOT NULL,
+            value REAL NOT NULL,
+            as_of REAL NOT NULL,
+            expires_at REAL NOT NULL,
+            PRIMARY KEY (kind, key)
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS bars (
+            symbol TEXT NOT NULL,
+            interval TEXT NOT NULL,
+            ts INTEGER NOT NULL,
+            close REAL NOT NULL,
+            volume REAL,
+            PRIMARY KEY (symbol, interval, ts)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS bar_meta (
+            symbol TEXT NOT NULL,
+            interval TEXT NOT NULL,
+            last_ts INTEGER NOT NULL,
+            checked_at REAL NOT NULL,
+            tz TEXT,
+            PRIMARY KEY (symbol, interval)
+        )
+    """)
+    return conn
+
+
+def cache_get(kind, keys, include_expired=False):
+    """
+    讀取尚未過期的快取，回傳 {key: (value, as_of)}
+    include_expired=True 時連過期的也回傳 (最後一次成功的價格，供舊報價使用)
+    """
+    keys = list(keys)
+    if not keys:
+        return {}
+    now = float("-inf") if include_expired else time.time()
+    result = {}
     try:
-        response = requests.get(url)
-        response.raise_for_status()
-        data = response.json()
-        price = data.get(crypto_id, {}).get(BASE_CURRENCY.lower())
-        if price:
-            return float(price)
-        return 0.0
-    except Exception:
-        return 0.0
+        conn = _cache_connect()
+        try:
+            # 分批查詢，避免超過 SQLite 參數數量上限
+            for i in range(0, len(keys), 500):
+                batch = keys[i:i + 500]
+                marks = ",".join("?" * len(batch))
+                rows = conn.execute(
+                    f"SELECT key, value, as_of FROM quotes WHERE kind = ? AND expires_at > ? AND key IN ({marks})",
+                    [kind, now] + batch)
+                for key, value, as_of in rows:
+                    result[key] = (value, as_of)
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        print(f"Quote cache read failed: {e}")
+    return result
 
 
-def get_exchange_rates(base_currency="TWD"):
-    if EXCHANGE_RATE_API_KEY == "YOUR_API_KEY":
-        return None
-    url = f"https://v6.exchangerate-api.com/v6/{EXCHANGE_RATE_API_KEY}/latest/{base_currency}"
+def cache_put(kind, values, ttl=None, as_of=None, expires_at=None):
+    """
+    寫入快取，values: {key: value}
+    預設到期時間為 as_of + CACHE_TTL[kind]
+    """
+    if not values:
+        return
+    as_of = as_of or time.time()
+    expires_at = expires_at or as_of + (ttl if ttl is not None else CACHE_TTL.get(kind, 600))
+    rows = [(kind, key, float(value), as_of, expires_at) for key, value in values.items()]
     try:
-        response = requests.get(url)
-        response.raise_for_status()
-        data = response.json()
-        if data.get("result") == "success":
-            return data.get("conversion_rates")
-        return None
-    except Exception:
-        return None
+        conn = _cache_connect()
+        try:
+            with conn:
+                conn.executemany("INSERT OR REPLACE INTO quotes VALUES (?, ?, ?, ?, ?)", rows)
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        print(f"Quote cache write failed: {e}")
 
 
-def get_exchange_rates_usd_base():
-    if EXCHANGE_RATE_API_KEY == "YOUR_API_KEY":
+def clear_quote_cache(kind=None):
+    if kind in (None, 'fx'):
+        with _fx_lock:
+            _fx_table["rates"] = None
+    try:
+        conn = _cache_connect()
+        try:
+            with conn:
+                if kind:
+                    conn.execute("DELETE FROM quotes WHERE kind = ?", (kind,))
+                else:
+                    conn.execute("DELETE FROM quotes")
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        print(f"Quote cache clear failed: {e}")
+
+
+def get_stock_price(symbol):
+    """抓不到時回傳 0.0 (失敗原因記在 metrics)；批次函式會再以舊報價補上"""
+    return _yahoo_flights.do(('quote', symbol), _get_stock_price, symbol)
+
+
+def _get_stock_price(symbol):
+    with metrics.timer("yahoo.quote") as t:
+        try:
+            price, from_fast_info = _guarded('yahoo', _yahoo_quote, symbol)
+        except Exception as e:
+            t.fail(e)
+            return 0.0
+        if from_fast_info:
+            t.fallback()
+        if not price:
+            t.fail(LookupError(f"no price for {symbol}"))
+        return price
+
+
+def _yahoo_call(func, *args, **kwargs):
+    """
+    對 Yahoo 的每一次上游呼叫 (info、fast_info、history、download) 各取一個 token，
+    連線錯誤、逾時與 429 依 HTTP_MAX_RETRIES 退避重試；重試用完往外丟，交給斷路器計算
+    """
+    import requests
+    import yfinance as yf
+    exceptions = getattr(yf, 'exceptions', None)
+    retry_on = (requests.ConnectionError, requests.Timeout, ConnectionError, TimeoutError) + \
+        ((exceptions.YFRateLimitError,) if hasattr(exceptions, 'YFRateLimitError') else ())
+    for attempt in range(HTTP_MAX_RETRIES + 1):
+        rate_limiter('yahoo').acquire()
+        try:
+            return func(*args, **kwargs)
+        except retry_on:
+            if attempt >= HTTP_MAX_RETRIES:
+                raise
+            time.sleep(backoff_delay(attempt))
+
+
+def _yahoo_ticker(symbol):
+    """共用連線池 (get_session) 的 yf.Ticker"""
+    import yfinance as yf
+    return yf.Ticker(symbol, session=get_session())
+
+
+def _yahoo_quote(symbol):
+    """回傳 (價格, 是否改用 fast_info)；連線錯誤往外丟，交給斷路器計算"""
+    stock = _yahoo_ticker(symbol)
+    # 嘗試多個可能的 key
+    info = _yahoo_call(lambda: stock.info) or {}
+    price = info.get('currentPrice') or info.get('regularMarketPrice') or info.get('ask')
+    if price:
+        return float(price), False
+
+    # 如果 info 抓不到，嘗試用 fast_info (某些版本 yfinance 較穩)；這是另一次上游請求
+    if hasattr(stock, 'fast_info'):
+        return float(_yahoo_call(lambda: stock.fast_info.last_price) or 0.0), True
+    return 0.0, False
+
+
+def _download_quotes(symbols):
+    import yfinance as yf
+    # yfinance 批次下載內部自行併發，這裡整批只算一個 token
+    return _yahoo_call(yf.download, symbols, period='5d', interval='1d', group_by='ticker', auto_adjust=False,
+                       threads=True, progress=False, timeout=HTTP_TIMEOUT, session=get_session())
+
+
+# --- 舊報價 ---
+def empty_quote_report():
+    return {'batch': [], 'fallback': [], 'cached': [], 'stale': [], 'missing': [], 'as_of': {}, 'providers': {}}
+
+
+def fill_stale_prices(kind, prices, keys, report):
+    """
+    keys 中沒有價格的代號改用快取中最後一次成功的價格 (不超過 QUOTE_STALE_MAX_AGE)，記在 report['stale']
+    回傳補上的代號；仍然沒有價格的記在 report['missing']
+    """
+    keys = [k for k in keys if not prices.get(k)]
+    if not keys:
+        return []
+    now = time.time()
+    served = []
+    for key, (value, as_of) in cache_get(kind, keys, include_expired=True).items():
+        if value > 0 and now - as_of <= QUOTE_STALE_MAX_AGE:
+            prices[key] = value
+            report['as_of'][key] = as_of
+            served.append(key)
+    report['stale'].extend(served)
+    report['missing'].extend(k for k in keys if not prices.get(k))
+    metrics.inc('quote_symbols_total', len(served), provider='cache', source='stale')
+    return served
+
+
+def revalidate_in_background(kind, keys):
+    """在背景執行緒重抓舊報價 (use_cache=False，結果寫回快取)；已在重抓中的代號不重複送出"""
+    with _revalidate_lock:
+        keys = [k for k in keys if (kind, k) not in _revalidating]
+        _revalidating.update((kind, k) for k in keys)
+    if not keys:
         return None
-    url = f"https://v6.exchangerate-api.com/v6/{EXCHANGE_RATE_API_KEY}/latest/USD"
+
+    def run():
+        try:
+            if kind == 'stock':
+                get_stock_prices(keys, use_cache=False)
+            else:
+                get_crypto_prices(keys, use_cache=False)
+        except Exception as e:
+            metrics.record_error(f"{kind}.revalidate", e)
+        finally:
+            with _revalidate_lock:
+                _revalidating.difference_update((kind, k) for k in keys)
+
+    thread = threading.Thread(target=run, name=f"revalidate-{kind}", daemon=True)
+    thread.start()
+    return thread
+
+
+# --- 批次抓取多檔股票報價 ---
+def get_stock_prices(symbols, use_cache=True):
+    """
+    依 provider 鏈 (預設 Yahoo) 批次抓最新收盤價
+    回傳 (prices, report)
+    report: {'batch': [...批次取得], 'fallback': [...逐檔補抓], 'cached': [...快取], 'stale': [...舊報價],
+             'missing': [...完全沒有價格], 'as_of': {舊報價代號: 價格時間}, 'providers': {代號: provider}}
+    use_cache=False 時略過快取讀取 (仍會寫回)，供背景更新強制取得新價
+    快取過期但有舊價的代號直接回傳舊價並在背景重抓 (stale-while-revalidate)；抓價失敗的也以舊價補上
+    """
+    symbols = sorted(set(s for s in symbols if s))
+    prices = {}
+    report = empty_quote_report()
+    if not symbols:
+        return prices, report
+
+    # 快取內仍新鮮的代號直接使用，只抓新增或過期的
+    for symbol, (price, _) in (cache_get('stock', symbols) if use_cache else {}).items():
+        prices[symbol] = price
+        report['cached'].append(symbol)
+    missing = [s for s in symbols if s not in prices]
+    if use_cache:
+        metrics.cache_lookup('stock', hits=len(report['cached']), misses=len(missing))
+        if SWR_ENABLED:
+            revalidate_in_background('stock', fill_stale_prices('stock', prices, missing, report))
+            report['missing'].clear()
+            missing = [s for s in missing if s not in prices]
+    if not missing:
+        return prices, report
+    symbols = missing
+
+    import providers
+    fetched = providers.fetch_quotes('stock', symbols, report)
+    prices.update({s: fetched.get(s, 0.0) for s in symbols})
+    cache_put('stock', fetched)
+    fill_stale_prices('stock', prices, symbols, report)
+    metrics.inc('quote_symbols_total', len(report['missing']), provider='all', source='missing')
+    return prices, report
+
+
+def yahoo_quotes(symbols, report):
+    """一次下載一批代號的最新收盤價，批次抓不到的才逐檔補抓 (記在 report['fallback'])"""
+    import pandas as pd
+    prices = {}
+    batch = 0
+    with metrics.timer("yahoo.batch") as t:
+        try:
+            data = _yahoo_flights.do(('download', tuple(symbols)), _guarded, 'yahoo', _download_quotes, symbols)
+            for symbol in symbols:
+                try:
+                    if isinstance(data.columns, pd.MultiIndex):
+                        close = data[symbol]['Close']
+                    else:
+                        close = data['Close']
+                    close = close.dropna()
+                    if not close.empty and float(close.iloc[-1]) > 0:
+                        prices[symbol] = float(close.iloc[-1])
+                        batch += 1
+                except (KeyError, IndexError, TypeError, ValueError):
+                    continue
+        except Exception as e:
+            t.fail(e)
+            print(f"Batch quote download failed: {e}")
+        if t.outcome == 'success' and batch < len(symbols):
+            t.fallback()
+
+    # 批次沒拿到的代號改用單檔查詢補抓
+    for symbol in symbols:
+        if symbol not in prices:
+            prices[symbol] = get_stock_price(symbol)
+            report['fallback'].append(symbol)
+    return prices
+
+
+def get_crypto_price(crypto_id):
+    url = f"{COINGECKO_API}/simple/price?ids={crypto_id}&vs_currencies={BASE_CURRENCY.lower()}"
+    with metrics.timer("coingecko.quote") as t:
+        try:
+            response = http_get(url)
+            response.raise_for_status()
+            data = response.json()
+            price = data.get(crypto_id, {}).get(BASE_CURRENCY.lower())
+            if price:
+                return float(price)
+            t.fail(LookupError(f"no price for {crypto_id}"))
+            return 0.0
+        except Exception as e:
+            t.fail(e)
+            return 0.0
+
+
+def chunk_crypto_ids(ids):
+    """依 URL 長度與數量上限把 id 切成多組"""
+    chunks, current, length = [], [], 0
+    for crypto_id in ids:
+        extra = len(crypto_id) + (1 if current else 0)
+        if current and (length + extra > COINGECKO_MAX_IDS_CHARS or len(current) >= COINGECKO_MAX_IDS_PER_CALL):
+            chunks.append(current)
+            current, length = [], 0
+            extra = len(crypto_id)
+        current.append(crypto_id)
+        length += extra
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+@metrics.timed("coingecko.batch")
+def fetch_crypto_chunk(ids):
+    vs = BASE_CURRENCY.lower()
+    url = f"{COINGECKO_API}/simple/price?ids={','.join(ids)}&vs_currencies={vs}"
+    response = http_get(url)
+    response.raise_for_status()
+    data = response.json()
+    prices = {}
+    for crypto_id in ids:
+        price = data.get(crypto_id, {}).get(vs)
+        if price:
+            prices[crypto_id] = float(price)
+    return prices
+
+
+# --- 批次抓取加密貨幣報價 ---
+def get_crypto_prices(ids, use_cache=True, report=None):
+    """
+    依 provider 鏈 (預設 CoinGecko simple/price，逗號分隔 ids) 批次查多個幣種
+    超過 URL 上限時分組平行查詢，回傳 {id: 價格}，查不到的為 0.0
+    快取過期或查詢失敗時與股票相同以舊報價補上；傳入 report 時記下 'stale' / 'missing' / 'as_of'
+    """
+    ids = sorted(set(i for i in ids if i))
+    prices = {crypto_id: 0.0 for crypto_id in ids}
+    report = empty_quote_report() if report is None else report
+    if not ids:
+        return prices
+
+    for crypto_id, (price, _) in (cache_get('crypto', ids) if use_cache else {}).items():
+        prices[crypto_id] = price
+    hits = len(ids)
+    ids = [i for i in ids if not prices[i]]
+    if use_cache:
+        metrics.cache_lookup('crypto', hits=hits - len(ids), misses=len(ids))
+        if SWR_ENABLED:
+            missing = len(report['missing'])
+            revalidate_in_background('crypto', fill_stale_prices('crypto', prices, ids, report))
+            del report['missing'][missing:]
+            ids = [i for i in ids if not prices[i]]
+    if not ids:
+        return prices
+
+    import providers
+    fetched = providers.fetch_quotes('crypto', ids, report)
+    cache_put('crypto', fetched)
+    prices.update(fetched)
+    missing = len(report['missing'])
+    fill_stale_prices('crypto', prices, ids, report)
+    metrics.inc('quote_symbols_total', len(report['missing']) - missing, provider='all', source='missing')
+    return prices
+
+
+# --- 匯率服務 ---
+# 只向 API 要一張 USD 基準的匯率表，其他任意幣別的交叉匯率都由它換算
+# 匯率表依 API 回傳的下次更新時間 (每日) 快取於記憶體與 SQLite
+
+
+def get_cached_rates(base_currency, with_expiry=False):
+    """with_expiry=True 時回傳 (rates, 最早的到期時間)"""
+    rows = []
     try:
-        response = requests.get(url)
-        response.raise_for_status()
-        data = response.json()
-        if data.get("result") == "success":
-            return data.get("conversion_rates")
+        conn = _cache_connect()
+        try:
+            rows = conn.execute(
+                "SELECT key, value, expires_at FROM quotes WHERE kind = 'fx' AND expires_at > ? AND key LIKE ?",
+                (time.time(), f"{base_currency}/%")).fetchall()
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        pass
+    rates = {k.split("/", 1)[1]: v for k, v, _ in rows} or None
+    if with_expiry:
+        return rates, min((expires_at for _, _, expires_at in rows), default=0.0)
+    return rates
+
+
+def put_cached_rates(base_currency, rates, expires_at=None):
+    if rates:
+        cache_put('fx', {f"{base_currency}/{c}": r for c, r in rates.items()}, expires_at=expires_at)
+
+
+def store_fx_table(rates, next_update_unix=None):
+    """把 USD 基準匯率表放進記憶體與 SQLite 快取"""
+    expires_at = float(next_update_unix) if next_update_unix else time.time() + CACHE_TTL['fx']
+    with _fx_lock:
+        _fx_table["rates"] = dict(rates)
+        _fx_table["expires_at"] = expires_at
+    put_cached_rates("USD", rates, expires_at=expires_at)
+
+
+def download_fx_table():
+    url = f"{EXCHANGE_RATE_API}/{EXCHANGE_RATE_API_KEY}/latest/USD"
+    with metrics.timer("fx.download") as t:
+        try:
+            response = http_get(url)
+            response.raise_for_status()
+            data = response.json()
+            if data.get("result") == "success":
+                return data.get("conversion_rates"), data.get("time_next_update_unix")
+            t.fail(ValueError(f"exchange rate API returned {data.get('result')}: {data.get('error-type')}"))
+        except Exception as e:
+            t.fail(e)
+            print(f"Fetch exchange rates failed: {e}")
+    return None, None
+
+
+def get_cached_fx_table():
+    """只查記憶體與 SQLite，不發請求；都過期時回傳 None"""
+    now = time.time()
+    with _fx_lock:
+        if _fx_table["rates"] and _fx_table["expires_at"] > now:
+            return _fx_table["rates"]
+
+    cached, expires_at = get_cached_rates("USD", with_expiry=True)
+    if cached:
+        # 不超過 SQLite 內的到期時間 (API 的下次更新時間)，否則會晚一點才重新抓
+        with _fx_lock:
+            _fx_table["rates"] = cached
+            _fx_table["expires_at"] = min(now + FX_MEMORY_TTL, expires_at)
+    return cached
+
+
+def get_fx_table():
+    """
+    回傳 USD 基準匯率表 {幣別: 1 USD 可換多少該幣別}
+    依序查記憶體、SQLite，都過期才發一次 API 請求；失敗時回傳預設值
+    """
+    if EXCHANGE_RATE_API_KEY == "YOUR_API_KEY":
+        return dict(DEFAULT_USD_RATES)
+
+    cached = get_cached_fx_table()
+    metrics.cache_lookup('fx', hits=int(bool(cached)), misses=int(not cached))
+    if cached:
+        return cached
+
+    now = time.time()
+    import providers
+    rates, next_update = providers.fetch_fx_table()
+    if rates:
+        store_fx_table(rates, next_update)
+        return rates
+
+    # API 失敗時短暫記住預設值，避免每次重跑都再打一次失敗的請求
+    metrics.inc('op_total', op='fx.table', outcome='fallback')
+    fallback = dict(DEFAULT_USD_RATES)
+    with _fx_lock:
+        _fx_table["rates"] = fallback
+        _fx_table["expires_at"] = now + FX_RETRY_AFTER_FAILURE
+    return fallback
+
+
+def derive_rates(usd_table, base_currency):
+    """由 USD 基準表換算成以 base_currency 為基準: {幣別: 1 base 可換多少該幣別}"""
+    base_rate = usd_table.get(base_currency)
+    if not base_rate:
         return None
-    except Exception:
+    return {c: r / base_rate for c, r in usd_table.items() if r}
+
+
+def get_fx_rate(from_currency, to_currency):
+    """1 單位 from_currency 可換多少 to_currency"""
+    table = get_fx_table()
+    if from_currency == to_currency:
+        return 1.0
+    from_rate, to_rate = table.get(from_currency), table.get(to_currency)
+    if not from_rate or not to_rate:
         return None
+    return to_rate / from_rate
+
+
+def get_conversion_rates_to(target_currency="TWD"):
+    """回傳 {幣別: 1 單位該幣別折合多少 target_currency}，給支出圖換算用"""
+    table = get_fx_table()
+    target_rate = table.get(target_currency)
+    if not target_rate:
+        return {target_currency: 1.0}
+    rates = {c: target_rate / r for c, r in table.items() if r}
+    rates[target_currency] = 1.0
+    return rates
+
+
+def get_exchange_rates(base_currency="TWD"):
+    return derive_rates(get_fx_table(), base_currency)
+
+
+def get_exchange_rates_usd_base():
+    return get_exchange_rates("USD")
+
+
+# --- 一次抓齊匯率與所有資產報價 ---
+@metrics.timed("api.fetch_market_data")
+def fetch_market_data(stock_symbols, crypto_ids):
+    """
+    以執行緒池同時抓匯率、股票 (批次) 與加密貨幣 (批次) 報價
+    回傳 (usd_rates, twd_rates, asset_prices, quote_report)
+    quote_report 的 'stale' / 'missing' / 'as_of' 同時包含股票與加密貨幣
+    """
+    stock_symbols = set(stock_symbols)
+    crypto_ids = set(crypto_ids)
+    asset_prices = {}
+    quote_report = empty_quote_report()
+    crypto_report = empty_quote_report()
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=HTTP_POOL_MAXSIZE) as executor:
+        future_fx_table = executor.submit(get_fx_table)
+        future_stock_prices = executor.submit(get_stock_prices, stock_symbols)
+        future_crypto_prices = executor.submit(get_crypto_prices, crypto_ids, report=crypto_report)
+
+        try:
+            fx_table = future_fx_table.result()
+        except Exception:
+            fx_table = dict(DEFAULT_USD_RATES)
+        if not fx_table.get("TWD"):
+            fx_table = dict(DEFAULT_USD_RATES)
+        usd_rates = derive_rates(fx_table, "USD")
+        twd_rates = derive_rates(fx_table, "TWD")
+
+        try:
+            stock_prices, quote_report = future_stock_prices.result()
+            asset_prices.update(stock_prices)
+        except Exception:
+            for symbol in stock_symbols:
+                asset_prices[symbol] = 0.0
+
+        try:
+            asset_prices.update(future_crypto_prices.result())
+        except Exception:
+            for crypto_id in crypto_ids:
+                asset_prices[crypto_id] = 0.0
+
+    quote_report['stale'] += crypto_report['stale']
+    quote_report['missing'] += crypto_report['missing']
+    quote_report['as_of'].update(crypto_report['as_of'])
+    quote_report['providers'].update(crypto_report['providers'])
+    return usd_rates, twd_rates, asset_prices, quote_report
 
 
 # --- 驗證股票 ---
 def validate_stock_symbol(symbol):
-    try:
-        ticker = yf.Ticker(symbol)
-        # 透過抓取 history 來確認代號是否有效 (比 info 更快且穩)
-        hist = ticker.history(period="1d")
-        if hist.empty:
-            return None
+    return _yahoo_flights.do(('validate', symbol.upper()), _validate_stock_symbol, symbol)
 
-        info = ticker.info
-        current_price = info.get('currentPrice') or info.get('regularMarketPrice') or hist['Close'].iloc[-1]
 
-        return {
-            "name": info.get('longName') or info.get('shortName') or symbol,
-            "currency": info.get('currency', 'USD').upper(),
-            "price": float(current_price),
-            "symbol": symbol.upper()
-        }
+@metrics.timed("yahoo.validate")
+def _validate_stock_symbol(symbol):
+    try:
+        return _guarded('yahoo', _yahoo_validate, symbol)
     except Exception as e:
         print(f"Stock Validation Error: {e}")
         return None
 
 
+def _yahoo_validate(symbol):
+    ticker = _yahoo_ticker(symbol)
+    # 透過抓取 history 來確認代號是否有效 (比 info 更快且穩)
+    hist = _yahoo_call(ticker.history, period="1d", timeout=HTTP_TIMEOUT)
+    if hist.empty:
+        return None
+
+    info = _yahoo_call(lambda: ticker.info) or {}
+    current_price = info.get('currentPrice') or info.get('regularMarketPrice') or hist['Close'].iloc[-1]
+
+    return {
+        "name": info.get('longName') or info.get('shortName') or symbol,
+        "currency": info.get('currency', 'USD').upper(),
+        "price": float(current_price),
+        "symbol": symbol.upper()
+    }
+
+
 # --- 驗證加密貨幣 ---
+@metrics.timed("coingecko.validate")
 def validate_crypto_id(user_input):
-    search_url = f"https://api.coingecko.com/api/v3/search?query={user_input}"
+    search_url = f"{COINGECKO_API}/search?query={user_input}"
     try:
-        response = requests.get(search_url)
+        response = http_get(search_url)
         data = response.json()
         coins = data.get('coins', [])
         target_coin = None
@@ -116,8 +894,8 @@ def validate_crypto_id(user_input):
 
         if target_coin:
             real_id = target_coin['id']
-            detail_url = f"https://api.coingecko.com/api/v3/coins/{real_id}?localization=false&tickers=false&market_data=true&community_data=false&developer_data=false"
-            r = requests.get(detail_url)
+            detail_url = f"{COINGECKO_API}/coins/{real_id}?localization=false&tickers=false&market_data=true&community_data=false&developer_data=false"
+            r = http_get(detail_url)
             if r.status_code == 200:
                 d = r.json()
                 return {
@@ -132,47 +910,173 @@ def validate_crypto_id(user_input):
     return None
 
 
-# --- [本次報錯缺失的函式] 抓取歷史走勢 ---
+# --- 歷史 K 線本地儲存 ---
+# 每個 (代號, interval) 存一份 K 線，之後只抓最後一根之後的新資料
+# 第一次建立時回補的期間 (同 interval 的所有區間都能由這段資料切出)
+BAR_BACKFILL_PERIOD = {'5m': '5d', '1h': '1mo', '1d': '1y', '1wk': 'max'}
+# 距離上次檢查未超過此秒數就直接讀本地資料，不連網
+BAR_REFRESH_SECONDS = {'5m': 300, '1h': 1800, '1d': 3600, '1wk': 6 * 3600}
+# Yahoo 分鐘/小時線只提供最近一段期間，缺口超過就整段重抓，也不保留更舊的資料
+BAR_MAX_GAP_DAYS = {'5m': 55, '1h': 700}
+# K 線儲存位置: 'sqlite' (與報價快取同檔) 或 'parquet' (data_manager 欄式儲存，需安裝 pyarrow)
+BAR_STORE_BACKEND = os.environ.get('PYASSET_BAR_BACKEND', 'sqlite')
+# 讀取各區間時往回取的天數 (多取一些，再依交易日精確切出)
+RANGE_READ_DAYS = {'1D': 10, '1W': 21, '1M': 35, '1Y': 370}
+# 各區間使用的 K 線週期
+RANGE_INTERVALS = {
+    '1D': '5m',  # 1天看 5分鐘線
+    '1W': '1h',  # 1週看 1小時線
+    '1M': '1d',  # 1月看 日線
+    '1Y': '1d',  # 1年看 日線
+    'All': '1wk'  # 全部看 週線
+}
+
+
+def download_bars(symbol, interval, period=None, start=None):
+    return _yahoo_flights.do(('bars', symbol, interval, period, str(start)), _guarded, 'yahoo', _fetch_bars,
+                             symbol, interval, period, start)
+
+
+@metrics.timed("yahoo.history")
+def _fetch_bars(symbol, interval, period=None, start=None):
+    ticker = _yahoo_ticker(symbol)
+    if start is not None:
+        history = _yahoo_call(ticker.history, start=start, interval=interval, timeout=HTTP_TIMEOUT)
+    else:
+        history = _yahoo_call(ticker.history, period=period, interval=interval, timeout=HTTP_TIMEOUT)
+    if history is None or history.empty:
+        return None
+    return history
+
+
+def _get_bar_meta(conn, symbol, interval):
+    row = conn.execute("SELECT last_ts, checked_at, tz FROM bar_meta WHERE symbol = ? AND interval = ?",
+                       (symbol, interval)).fetchone()
+    if row is None:
+        return None
+    return {"last_ts": row[0], "checked_at": row[1], "tz": row[2]}
+
+
+def _use_parquet_bars():
+    return BAR_STORE_BACKEND == 'parquet' and dm.columnar_available()
+
+
+def _store_bars(conn, symbol, interval, history, meta):
+    """把新抓到的 K 線合併進本地資料 (同時間戳覆蓋，處理尚未收盤的最後一根)"""
+    import pandas as pd
+    index = pd.DatetimeIndex(history.index)
+    tz = str(index.tz) if index.tz is not None else "UTC"
+    if index.tz is None:
+        index = index.tz_localize("UTC")
+    bars = pd.DataFrame({
+        'ts': index.tz_convert("UTC").as_unit("s").asi8,
+        'Close': history['Close'].to_numpy(dtype=float),
+        'Volume': history['Volume'].to_numpy(dtype=float) if 'Volume' in history.columns else float('nan'),
+    }).dropna(subset=['Close'])
+    if bars.empty:
+        return meta
+
+    last_ts = max(int(bars['ts'].max()), meta["last_ts"] if meta else 0)
+    cutoff = last_ts - BAR_MAX_GAP_DAYS[interval] * 86400 if interval in BAR_MAX_GAP_DAYS else None
+
+    if _use_parquet_bars():
+        dm.upsert_price_bars(symbol, interval, bars, min_ts=cutoff)
+
+    with conn:
+        if not _use_parquet_bars():
+            rows = [(symbol, interval, int(t), float(c), None if v != v else float(v))
+                    for t, c, v in zip(bars['ts'], bars['Close'], bars['Volume'])]
+            conn.executemany("INSERT OR REPLACE INTO bars VALUES (?, ?, ?, ?, ?)", rows)
+            if cutoff is not None:
+                conn.execute("DELETE FROM bars WHERE symbol = ? AND interval = ? AND ts < ?",
+                             (symbol, interval, cutoff))
+        conn.execute("INSERT OR REPLACE INTO bar_meta VALUES (?, ?, ?, ?, ?)",
+                     (symbol, interval, last_ts, time.time(), tz))
+    return {"last_ts": last_ts, "checked_at": time.time(), "tz": tz}
+
+
+def _load_bars(conn, symbol, interval, since=None):
+    if _use_parquet_bars():
+        return dm.load_price_bars(symbol, interval, since)
+
+    query = "SELECT ts, close, volume FROM bars WHERE symbol = ? AND interval = ?"
+    params = [symbol, interval]
+    if since is not None:
+        query += " AND ts >= ?"
+        params.append(int(since))
+    rows = conn.execute(query + " ORDER BY ts", params).fetchall()
+    import pandas as pd
+    return pd.DataFrame(rows, columns=['ts', 'Close', 'Volume'])
+
+
+def _slice_range(df, time_range):
+    """依區間切出資料：1D/1W 以交易日計算，其餘以日曆期間計算 (皆相對於最後一根 K 線)"""
+    import pandas as pd
+    if df.empty or time_range not in RANGE_READ_DAYS:
+        return df
+    if time_range in ('1D', '1W'):
+        days = df['Datetime'].dt.normalize()
+        keep = days.drop_duplicates().iloc[-(1 if time_range == '1D' else 5):]
+        return df[days >= keep.iloc[0]].reset_index(drop=True)
+    offset = pd.DateOffset(months=1) if time_range == '1M' else pd.DateOffset(years=1)
+    start = df['Datetime'].iloc[-1] - offset
+    return df[df['Datetime'] >= start].reset_index(drop=True)
+
+
+# --- 抓取歷史走勢 ---
+@metrics.timed("api.get_historical_data")
 def get_historical_data(symbol, time_range):
     """
-    根據時間範圍抓取歷史股價
+    根據時間範圍取得歷史股價 (優先讀本地 K 線，只補抓缺少的尾段)
     time_range: '1D', '1W', '1M', '1Y', 'All'
     """
-    period_map = {
-        '1D': '1d',
-        '1W': '5d',
-        '1M': '1mo',
-        '1Y': '1y',
-        'All': 'max'
-    }
+    import pandas as pd
+    import providers
+    i = RANGE_INTERVALS.get(time_range, '1d')
 
-    interval_map = {
-        '1D': '5m',  # 1天看 5分鐘線
-        '1W': '1h',  # 1週看 1小時線
-        '1M': '1d',  # 1月看 日線
-        '1Y': '1d',  # 1年看 日線
-        'All': '1wk'  # 全部看 週線
-    }
+    try:
+        conn = _cache_connect()
+        try:
+            meta = _get_bar_meta(conn, symbol, i)
+            now = time.time()
+            history = None
+            try:
+                max_gap = BAR_MAX_GAP_DAYS.get(i)
+                stale = meta is None or (max_gap and now - meta["last_ts"] > max_gap * 86400)
+                due = stale or now - meta["checked_at"] > BAR_REFRESH_SECONDS[i]
+                metrics.cache_lookup('bars', hits=int(not due), misses=int(due))
+                if stale:
+                    history = providers.fetch_history(symbol, i, period=BAR_BACKFILL_PERIOD[i])
+                elif due:
+                    history = providers.fetch_history(symbol, i,
+                                                      start=pd.Timestamp(meta["last_ts"], unit='s', tz='UTC'))
+                    if history is None:
+                        # 沒有新資料 (休市)，記下檢查時間，避免每次開圖都連網
+                        with conn:
+                            conn.execute("UPDATE bar_meta SET checked_at = ? WHERE symbol = ? AND interval = ?",
+                                         (now, symbol, i))
+            except Exception as e:
+                print(f"Fetch history failed for {symbol}: {e}")
 
-    p = period_map.get(time_range, '1mo')
-    i = interval_map.get(time_range, '1d')
+            if history is not None:
+                meta = _store_bars(conn, symbol, i, history, meta)
+            if meta is None:
+                return None
 
-    try:
-        ticker = yf.Ticker(symbol)
-        history = ticker.history(period=p, interval=i)
+            days = RANGE_READ_DAYS.get(time_range)
+            since = meta["last_ts"] - days * 86400 if days else None
+            bars = _load_bars(conn, symbol, i, since)
+        finally:
+            conn.close()
 
-        if history.empty:
+        if bars.empty:
             return None
 
-        # 整理 DataFrame
-        history = history.reset_index()
-        # 統一欄位名稱 (yfinance 的 Date 有時有時區)
-        if 'Date' in history.columns:
-            history['Datetime'] = history['Date']
-
-        # 只要時間跟收盤價
-        return history[['Datetime', 'Close']]
+        # 只要時間跟收盤價 (另附成交量)
+        bars['Datetime'] = pd.to_datetime(bars['ts'], unit='s', utc=True).dt.tz_convert(meta["tz"] or "UTC")
+        return _slice_range(bars[['Datetime', 'Close', 'Volume']], time_range)
 
     except Exception as e:
-        print(f"Fetch history failed for {symbol}: {e}")
-        return None
\ No newline at end of file
+        metrics.record_error("api.get_historical_data", e)
+        print(f"Load history failed for {symbol}: {e}")
+        return None
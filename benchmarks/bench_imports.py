@@ -0,0 +1,117 @@
+"""
+量測各層的 import 時間 (python -X importtime)，並檢查重量級套件沒有被提前載入
+
+    python benchmarks/bench_imports.py              # 表格輸出，超出預算或提前載入時 exit code 1
+    python benchmarks/bench_imports.py --json out.json --repeat 9
+
+每個目標在新的子程序中 import，取多次的中位數；預算 (毫秒) 刻意放寬，
+用來攔下「又在模組頂層 import 了 yfinance / plotly」這類退步，而不是比較機器快慢
+tests/test_imports.py 以同一個 check() 把預算列入測試
+"""
+import argparse
+import ast
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 目標名稱: (要 import 的模組, 不該被載入的套件, 預算毫秒)
+TARGETS = {
+    'data': (['data_manager'], ['pandas', 'pyarrow', 'yfinance', 'requests', 'plotly'], 50),
+    'api': (['api_handler'], ['yfinance', 'requests', 'pandas', 'plotly'], 80),
+    'charts': (['chart_plotter'], ['plotly', 'pandas'], 30),
+    # None: 取 dashboard_app.py 頂層的 import；streamlit 本身就會載入 plotly，所以只檢查 yfinance
+    'dashboard': (None, ['yfinance'], 2500),
+}
+
+
+def dashboard_imports():
+    """dashboard_app.py 本身會執行整頁，這裡只 import 它頂層 import 的模組"""
+    with open(os.path.join(ROOT, 'dashboard_app.py'), encoding='utf-8') as f:
+        tree = ast.parse(f.read())
+    modules = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            modules.extend(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module:
+            modules.append(node.module)
+    return modules
+
+
+def parse_importtime(stderr):
+    """回傳 {頂層模組: 累計 us}"""
+    top = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not name.startswith("  ") and name.strip():
+            top[name.strip()] = int(cumulative)
+    return top
+
+
+def measure(modules, baseline=()):
+    """回傳 (扣除直譯器啟動後的 import 時間 us, {頂層模組: 累計 us}, 已載入的模組)"""
+    code = ("import json, sys\n" + "".join(f"import {m}\n" for m in modules)
+            + "print(json.dumps(sorted(sys.modules)))")
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=ROOT, capture_output=True,
+                          text=True, env=dict(os.environ, PYTHONDONTWRITEBYTECODE="0"))
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1] if proc.stderr else "import failed")
+    top = {k: v for k, v in parse_importtime(proc.stderr).items() if k not in baseline}
+    loaded = set(json.loads(proc.stdout.strip().splitlines()[-1]))
+    return sum(top.values()), top, loaded
+
+
+def check(name, repeat=5, budget_scale=1.0, baseline=None):
+    """量測單一目標，回傳結果 dict ("ok" 為是否在預算內且沒有提前載入)"""
+    modules, forbidden, budget = TARGETS[name]
+    modules = modules or dashboard_imports()
+    if baseline is None:
+        baseline = set(measure([])[1])  # 直譯器啟動本身 (site、encodings...) 不算在內
+    measure(modules, baseline)  # 先跑一次，讓 .pyc 就緒
+    runs = [measure(modules, baseline) for _ in range(repeat)]
+    median_ms = statistics.median(r[0] for r in runs) / 1000
+    _, top, loaded = runs[-1]
+    early = sorted(m for m in forbidden if m in loaded)
+    budget *= budget_scale
+    return {"modules": modules, "median_ms": median_ms, "runs_ms": [r[0] / 1000 for r in runs],
+            "budget_ms": budget, "early_imports": early, "top_ms": {k: v / 1000 for k, v in top.items()},
+            "ok": median_ms <= budget and not early}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("targets", nargs="*", help="、".join(TARGETS) + " (預設全部)")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=5, help="每個目標列出最慢的幾個頂層 import")
+    parser.add_argument("--budget-scale", type=float, default=1.0, help="放大 / 縮小所有預算 (慢機器用)")
+    parser.add_argument("--json", help="把結果寫成 JSON 檔")
+    args = parser.parse_args()
+    unknown = [t for t in args.targets if t not in TARGETS]
+    if unknown:
+        parser.error("未知的目標: " + ", ".join(unknown))
+
+    baseline = set(measure([])[1])
+    results, failed = {}, False
+    print(f"{'target':>10} {'median (ms)':>12} {'budget':>8}  status")
+    for name in args.targets or TARGETS:
+        result = results[name] = check(name, args.repeat, args.budget_scale, baseline)
+        failed |= not result["ok"]
+        early = result["early_imports"]
+        status = "ok" if result["ok"] else ("提前載入: " + ", ".join(early) if early else "超出預算")
+        print(f"{name:>10} {result['median_ms']:>12.1f} {result['budget_ms']:>8.0f}  {status}")
+        for module, ms in sorted(result["top_ms"].items(), key=lambda kv: -kv[1])[:args.top]:
+            print(f"{'':>12}{module:<28}{ms:>8.1f} ms")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,62 @@
+"""
+量測交易紀錄寫入延遲：追加式日誌 vs. 舊版整份 JSON 覆寫，帳本從小到大成長時的變化
+
+用法: python benchmarks/bench_journal.py [--sizes 1000 10000 100000 300000]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import data_manager as dm  # noqa: E402
+
+SAMPLE = {"date": "2026-01-01", "amount": 120.0, "currency": "TWD", "category": "食物"}
+
+
+def legacy_write(path, records):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(records, f, indent=4, ensure_ascii=False)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000, 300000])
+    parser.add_argument("--writes", type=int, default=20, help="每個大小量測的寫入次數")
+    parser.add_argument("--no-fsync", action="store_true")
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp())
+    dm.JOURNAL_FSYNC = not args.no_fsync
+    dm.JOURNAL_COMPACT_THRESHOLD = 10 ** 9  # 量測期間不觸發壓縮
+
+    print(f"{'ledger':>8} {'rewrite (ms)':>13} {'journal (ms)':>13} {'load (ms)':>10}")
+    for n in args.sizes:
+        records = [dict(SAMPLE, amount=float(i)) for i in range(n)]
+
+        start = time.perf_counter()
+        for _ in range(args.writes):
+            records.append(SAMPLE)
+            legacy_write('legacy.json', records)
+        t_rewrite = (time.perf_counter() - start) / args.writes
+
+        dm._journal_state.clear()
+        dm.save_transactions(records)
+        start = time.perf_counter()
+        for _ in range(args.writes):
+            dm.append_transaction(SAMPLE)
+        t_journal = (time.perf_counter() - start) / args.writes
+
+        start = time.perf_counter()
+        loaded = dm.load_transactions()
+        t_load = time.perf_counter() - start
+        assert len(loaded) == len(records) + args.writes
+
+        print(f"{n:>8} {t_rewrite * 1000:>13.2f} {t_journal * 1000:>13.3f} {t_load * 1000:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+比較 asyncio 抓價引擎與原本 ThreadPoolExecutor 逐檔 fan-out 的耗時
+
+用法: python benchmarks/bench_market_engine.py [--latency 0.05] [--sizes 10 100 1000]
+"""
+import argparse
+import concurrent.futures
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import api_handler as ah  # noqa: E402
+import market_engine as me  # noqa: E402
+from fake_market_server import point_api_handler_at, start_server  # noqa: E402
+
+
+def _thread_stock_price(symbol):
+    data = ah.http_get(f"{ah.YAHOO_CHART_API}/{symbol}", params={"range": "1d", "interval": "1d"}).json()
+    return float(data["chart"]["result"][0]["meta"]["regularMarketPrice"])
+
+
+def _thread_rates(base_currency):
+    url = f"{ah.EXCHANGE_RATE_API}/{ah.EXCHANGE_RATE_API_KEY}/latest/{base_currency}"
+    return ah.http_get(url).json().get("conversion_rates")
+
+
+def thread_fanout(stock_symbols, crypto_ids):
+    """重現原本 fetch_all_data 的做法: 每檔資產一個 future，另加兩個匯率 future"""
+    prices = {}
+    with concurrent.futures.ThreadPoolExecutor() as executor:
+        future_usd = executor.submit(_thread_rates, "USD")
+        future_twd = executor.submit(_thread_rates, "TWD")
+        futures = {s: executor.submit(_thread_stock_price, s) for s in stock_symbols}
+        futures.update({c: executor.submit(ah.get_crypto_price, c) for c in crypto_ids})
+        usd_rates, twd_rates = future_usd.result(), future_twd.result()
+        for key, future in futures.items():
+            prices[key] = future.result()
+    return usd_rates, twd_rates, prices
+
+
+def _client_threads():
+    # 排除假伺服器處理連線用的執行緒
+    return sum(1 for t in threading.enumerate() if "process_request" not in t.name)
+
+
+def _reset_caches():
+    # 每輪都從冷快取開始，量到的才是實際抓價時間
+    ah.clear_quote_cache()
+
+
+def _run(label, func, stocks, cryptos, repeat):
+    best = float("inf")
+    peak_threads = 0
+    for _ in range(repeat):
+        _reset_caches()
+        before = _client_threads()
+        stop = threading.Event()
+
+        def sample():
+            nonlocal peak_threads
+            while not stop.is_set():
+                peak_threads = max(peak_threads, _client_threads() - before - 1)
+                time.sleep(0.002)
+
+        sampler = threading.Thread(target=sample, daemon=True)
+        sampler.start()
+        start = time.perf_counter()
+        result = func(stocks, cryptos)
+        best = min(best, time.perf_counter() - start)
+        stop.set()
+        sampler.join()
+        assert len(result[2]) == len(stocks) + len(cryptos), f"{label}: missing prices"
+    return best, peak_threads
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--latency", type=float, default=0.05, help="假伺服器每個請求的延遲秒數")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    server, base_url = start_server(latency=args.latency)
+    point_api_handler_at(base_url)
+    ah.QUOTE_CACHE_FILE = os.path.join(tempfile.mkdtemp(), "bench_cache.db")
+
+    print(f"{'symbols':>8} {'threads (s)':>12} {'peak thr':>9} {'async (s)':>10} {'peak thr':>9} {'speedup':>8}")
+    for n in args.sizes:
+        stocks = [f"S{i:05d}" for i in range(n - n // 5)]
+        cryptos = [f"coin-{i:05d}" for i in range(n // 5)]
+        t_thread, thr_thread = _run("threads", thread_fanout, stocks, cryptos, args.repeat)
+        t_async, thr_async = _run("async", me.fetch_market_data, stocks, cryptos, args.repeat)
+        print(f"{n:>8} {t_thread:>12.3f} {thr_thread:>9} {t_async:>10.3f} {thr_async:>9} {t_thread / t_async:>7.1f}x")
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
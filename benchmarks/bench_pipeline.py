@@ -0,0 +1,299 @@
+"""
+離線量測儀表板整條流程: 抓價 (fetch_all_data)、估值、歷史 K 線、各圖表與 data_manager 讀寫
+
+    python benchmarks/bench_pipeline.py                                  # 10 ~ 100k 筆持倉
+    python benchmarks/bench_pipeline.py --sizes 10 1000 --latency 0.05 --error-rate 0.02 --json out.json
+    python benchmarks/bench_pipeline.py --json new.json --compare base.json   # 比基準慢超過容許倍數時 exit code 1
+    python benchmarks/bench_pipeline.py --providers local                 # 全部改由本機 provider 供價
+
+Yahoo 由回放版 yfinance 取代，CoinGecko / 匯率由本機假伺服器回應 (皆讀 fixtures/market_sample.json)；
+--providers local 時改把同一份 fixture 展開成 local_prices.json，量測不含網路的流程本身
+所有檔案寫在暫存目錄，不會動到目前的資料
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import api_handler as ah  # noqa: E402
+import chart_plotter as cp  # noqa: E402
+import data_manager as dm  # noqa: E402
+import price_refresher as pr  # noqa: E402
+import providers  # noqa: E402
+import valuation as val  # noqa: E402
+from bench_valuation import make_portfolio  # noqa: E402
+from fake_market_server import point_api_handler_at, start_server  # noqa: E402
+from market_fixtures import DEFAULT_FIXTURE, FaultInjector, Fixtures, replay_yfinance  # noqa: E402
+
+DEFAULT_SIZES = [10, 100, 1000, 10000, 100000]
+HISTORY_RANGES = ['1D', '1W', '1M', '1Y', 'All']
+CATEGORIES = ['食物', '交通', '娛樂', '居住', '其他']
+CURRENCIES = ['TWD', 'TWD', 'TWD', 'USD', 'JPY']
+# 基準太小的階段不列入退步判斷 (毫秒)，避免量測雜訊誤報
+COMPARE_MIN_MS = 1.0
+
+
+def make_transactions(n, seed=0):
+    rng = random.Random(seed)
+    today = datetime.date.today()
+    return [{"date": (today - datetime.timedelta(days=rng.randrange(730))).strftime("%Y-%m-%d"),
+             "amount": round(rng.uniform(10, 3000), 0), "category": rng.choice(CATEGORIES),
+             "currency": rng.choice(CURRENCIES), "note": f"tx{i}"} for i in range(n)]
+
+
+def write_history(n, seed=0):
+    """直接寫出 n 天的淨值歷史 (不計時)"""
+    rng = random.Random(seed)
+    today = datetime.date.today()
+    value = 1_000_000.0
+    with open(dm.HISTORY_FILE, 'w', encoding='utf-8', newline='') as f:
+        for i in range(n, 0, -1):
+            value *= 1 + rng.gauss(0, 0.01)
+            f.write(f"{today - datetime.timedelta(days=i)},{value:.2f}\n")
+
+
+def make_bars(n):
+    import numpy as np
+    import pandas as pd
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({
+        'Datetime': pd.date_range(end=pd.Timestamp.now(tz='UTC').floor('5min'), periods=n, freq='5min'),
+        'Close': 100 * np.exp(np.cumsum(rng.normal(0, 0.002, n))),
+        'Volume': rng.integers(100, 10000, n).astype(float),
+    })
+
+
+def clear_bars():
+    conn = ah._cache_connect()
+    try:
+        with conn:
+            conn.execute("DELETE FROM bars")
+            conn.execute("DELETE FROM bar_meta")
+    finally:
+        conn.close()
+
+
+def write_local_prices(fixtures, stocks, cryptos, history_symbols):
+    """把 fixture 展開成本機 provider 讀的 local_prices.json (不計時)"""
+    now = time.time()
+    bars = {}
+    for symbol in history_symbols:
+        for interval, period in ah.BAR_BACKFILL_PERIOD.items():
+            days = providers.PERIOD_DAYS.get(period) or 5 * 366
+            bars.setdefault(symbol, {})[interval] = [list(b) for b in
+                                                     fixtures.bars(symbol, interval, now - days * 86400, now)]
+    with open(providers.LOCAL_PROVIDER_FILE, 'w', encoding='utf-8') as f:
+        json.dump({"quotes": {k: fixtures.price(k) for k in stocks + cryptos}, "fx": fixtures.fx_rates() or {},
+                   "bars": bars}, f)
+
+
+def reset_snapshot():
+    shutil.rmtree(pr.SNAPSHOT_DIR, ignore_errors=True)
+    pr._snapshot_cache.update(mtime=None, data=None)
+
+
+def measure(func, repeat, setup=None):
+    runs, result = [], None
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        result = func()
+        runs.append((time.perf_counter() - start) * 1000)
+    return runs, result
+
+
+def bench_size(n, args, fetch, fixtures):
+    """回傳 {階段: {"median_ms", "min_ms", "runs_ms", "items"}}"""
+    results = {}
+
+    def run(stage, func, setup=None, items=n):
+        runs, result = measure(func, args.repeat, setup)
+        results[stage] = {"median_ms": statistics.median(runs), "min_ms": min(runs), "runs_ms": runs,
+                          "items": items}
+        return result
+
+    portfolio, _ = make_portfolio(n)
+    stocks = [s['symbol'] for s in portfolio['stocks']]
+    cryptos = [c['id'] for c in portfolio['crypto']]
+    transactions = make_transactions(n)
+    write_history(n)
+    history_symbols = stocks[:min(len(stocks), args.history_symbols)]
+    if args.providers == "local":
+        write_local_prices(fixtures, stocks, cryptos, history_symbols)
+
+    # --- data_manager ---
+    run("data.save_portfolio", lambda: dm.save_portfolio(portfolio))
+    run("data.load_portfolio", dm.load_portfolio)
+    run("data.save_transactions", lambda: dm.save_transactions(transactions))
+    run("data.load_transactions", dm.load_transactions)
+    run("data.append_transaction", lambda: dm.append_transaction(dict(transactions[0])), items=1)
+    run("data.load_expense_rollup", dm.load_expense_rollup, setup=dm._expense_rollup.clear)
+    run("data.load_history", dm.load_history)
+    run("data.update_history", lambda: dm.update_history(random.uniform(1e6, 2e6)), items=1)
+
+    # --- 抓價: live (冷快取) / quote_cache (SQLite 報價快取) / snapshot (背景更新發布的快照) ---
+    def fetch_and_publish():
+        data = fetch(stocks, cryptos)
+        pr.publish_market_data(stocks, cryptos, data)
+        return data
+
+    run("fetch_all_data.live", fetch_and_publish, setup=lambda: (ah.clear_quote_cache(), reset_snapshot()))
+    run("fetch_all_data.quote_cache", fetch_and_publish, setup=reset_snapshot)
+    data = run("fetch_all_data.snapshot",
+               lambda: pr.market_data_from_snapshot(pr.load_latest_snapshot(), stocks, cryptos),
+               setup=lambda: pr._snapshot_cache.update(mtime=None, data=None))
+    if data is None:
+        raise RuntimeError("snapshot is missing symbols")
+    usd_rates, twd_rates, asset_prices, quote_report = data
+    missing = sum(1 for k in stocks + cryptos if not asset_prices.get(k))
+    results["fetch_all_data.live"]["missing_prices"] = missing
+    results["fetch_all_data.live"]["fallback_symbols"] = len(quote_report.get('fallback', []))
+
+    # --- 估值 ---
+    usd_to_twd = usd_rates.get("TWD", ah.DEFAULT_USD_RATES["TWD"])
+    _, totals = run("valuation.value_portfolio", lambda: val.value_portfolio(portfolio, asset_prices, usd_to_twd))
+
+    # --- 歷史 K 線: 每檔走過所有區間；cold 需回補下載，warm 只讀本地 ---
+    def load_histories():
+        for symbol in history_symbols:
+            for time_range in HISTORY_RANGES:
+                ah.get_historical_data(symbol, time_range)
+
+    run("history.get_historical_data.cold", load_histories, setup=clear_bars, items=len(history_symbols))
+    run("history.get_historical_data.warm", load_histories, items=len(history_symbols))
+
+    # --- 圖表 ---
+    rates_to_twd = {c: 1 / r for c, r in (twd_rates or {}).items() if r}
+    rollup = dm.load_expense_rollup()
+    history_df = dm.load_history_df()
+    bars = make_bars(n)
+    run("charts.allocation_pie",
+        lambda: cp.plot_asset_allocation_pie(totals['stock_value_twd'], totals['crypto_value_twd']))
+    run("charts.expense_pie", lambda: cp.plot_expense_pie(rollup, rates_to_twd), items=len(rollup))
+    run("charts.net_worth_history", lambda: cp.plot_net_worth_history(history_df))
+    run("charts.price_history", lambda: cp.plot_price_history(bars, "BENCH", show_ma20=True))
+    return results
+
+
+def warm_up():
+    """先載入 pandas / plotly 並各畫一次小圖，避免第一個量測到的階段包含 import 時間"""
+    cp.plot_asset_allocation_pie(1, 1)
+    cp.plot_expense_pie([], {})
+    cp.plot_net_worth_history([{"Date": "2026-01-01", "NetWorth": 1.0}])
+    cp.plot_price_history(make_bars(100), "warmup", show_ma20=True)
+    val.value_portfolio(*make_portfolio(10), 30.0)
+
+
+def compare(results, baseline, tolerance):
+    """回傳 [(大小, 階段, 基準 ms, 本次 ms, 倍數)]，只列出超出容許倍數的"""
+    regressions = []
+    for size, stages in results.items():
+        for stage, r in stages.items():
+            base = baseline.get(size, {}).get(stage)
+            if not base or base["median_ms"] < COMPARE_MIN_MS:
+                continue
+            ratio = r["median_ms"] / base["median_ms"]
+            if ratio > tolerance:
+                regressions.append((size, stage, base["median_ms"], r["median_ms"], ratio))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="合成投資組合的持倉數")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--latency", type=float, default=0.02, help="每個 provider 請求注入的延遲秒數")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="每個請求 (與批次內每檔) 失敗的機率")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--fixtures", default=DEFAULT_FIXTURE)
+    parser.add_argument("--engine", choices=["thread", "async"], default="thread",
+                        help="抓價引擎 (async 同 PYASSET_ASYNC_ENGINE=1)")
+    parser.add_argument("--history-symbols", type=int, default=5, help="歷史 K 線量測的代號數")
+    parser.add_argument("--providers", choices=["replay", "local"], default="replay",
+                        help="replay: 回放版 yfinance + 假伺服器；local: 全部改用本機 provider")
+    parser.add_argument("--rate-limits", action="store_true",
+                        help="保留 api_handler 的 provider 速率上限 (預設對假伺服器關閉)")
+    parser.add_argument("--backoff-base", type=float, help="覆寫 HTTP 退避基數 (秒)，錯誤率高時可調小")
+    parser.add_argument("--json", help="把結果寫成 JSON 檔")
+    parser.add_argument("--compare", help="與先前 --json 的結果比較")
+    parser.add_argument("--tolerance", type=float, default=1.5, help="中位數超過基準幾倍視為退步")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)["results"]
+    out_path = os.path.abspath(args.json) if args.json else None
+
+    fixtures = Fixtures.load(args.fixtures)
+    faults = FaultInjector(args.latency, args.error_rate, args.seed)
+    server, base_url = start_server(latency=args.latency, error_rate=args.error_rate, fixtures=fixtures,
+                                    seed=args.seed)
+    rate_limits = dict(ah.PROVIDER_RATE_LIMITS)
+    point_api_handler_at(base_url)
+    if args.rate_limits:
+        for provider, (rate, burst) in rate_limits.items():
+            ah.set_rate_limit(provider, rate, burst)
+    if args.backoff_base is not None:
+        ah.HTTP_BACKOFF_BASE = args.backoff_base
+    if args.providers == "local":
+        for purpose in providers.PROVIDER_CHAINS:
+            providers.set_chain(purpose, ['local'])
+    if args.engine == "async":
+        import market_engine as me
+        fetch = me.fetch_market_data
+    else:
+        fetch = ah.fetch_market_data
+
+    workdir = tempfile.mkdtemp(prefix="pyasset-bench-")
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    results = {}
+    try:
+        with replay_yfinance(fixtures, faults):
+            warm_up()
+            for n in args.sizes:
+                results[str(n)] = bench_size(n, args, fetch, fixtures)
+                print(f"\n--- {n} holdings ---")
+                print(f"{'stage':<36} {'median (ms)':>12} {'min (ms)':>10}")
+                for stage, r in results[str(n)].items():
+                    print(f"{stage:<36} {r['median_ms']:>12.2f} {r['min_ms']:>10.2f}")
+    finally:
+        os.chdir(cwd)
+        server.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "meta": {"created_at": datetime.datetime.now().isoformat(timespec='seconds'),
+                 "python": platform.python_version(), "platform": platform.platform(),
+                 "fixtures": os.path.relpath(args.fixtures), "providers": args.providers, "engine": args.engine, "latency": args.latency,
+                 "error_rate": args.error_rate, "seed": args.seed, "repeat": args.repeat,
+                 "rate_limits": rate_limits if args.rate_limits else None,
+                 "injected": faults.stats},
+        "results": results,
+    }
+    if out_path:
+        with open(out_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.tolerance)
+        print(f"\n與 {args.compare} 比較 (容許 {args.tolerance}x): " + ("沒有退步" if not regressions else ""))
+        for size, stage, before, after, ratio in regressions:
+            print(f"  {size:>7} {stage:<36} {before:>10.2f} -> {after:>10.2f} ms ({ratio:.2f}x)")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
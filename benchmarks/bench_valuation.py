@@ -0,0 +1,111 @@
+"""
+比較向量化估值 (valuation.value_portfolio) 與原本儀表板逐筆迴圈的耗時
+
+用法: python benchmarks/bench_valuation.py [--sizes 10000 100000]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import valuation as val  # noqa: E402
+
+USD_TO_TWD = 30.5
+
+
+def make_portfolio(n, seed=0):
+    rng = random.Random(seed)
+    n_crypto = n // 5
+    stocks, cryptos, prices = [], [], {}
+    for i in range(n - n_crypto):
+        symbol = f"{i:04d}.TW" if i % 2 else f"US{i}"
+        stocks.append({"symbol": symbol, "name": symbol, "currency": "TWD" if i % 2 else "USD",
+                       "shares": rng.randint(1, 5000), "avg_cost": rng.uniform(5, 500)})
+        prices[symbol] = rng.uniform(5, 500)
+    for i in range(n_crypto):
+        coin = f"coin-{i}"
+        cryptos.append({"id": coin, "name": coin, "symbol": f"C{i}", "amount": rng.uniform(0.01, 10),
+                        "avg_cost": rng.uniform(1, 1000)})
+        prices[coin] = rng.uniform(30, 30000)
+    return {"stocks": stocks, "crypto": cryptos}, prices
+
+
+def legacy_loop(portfolio, asset_prices, usd_to_twd_rate):
+    """原本 dashboard_app.py 的逐筆估值迴圈"""
+    all_assets_data = []
+    total_stock_value_twd = total_crypto_value_twd = total_invested_twd_display = 0.0
+    for stock in portfolio['stocks']:
+        raw_price = asset_prices.get(stock['symbol'], 0.0)
+        avg_cost_unit = stock.get('avg_cost', 0.0)
+        is_tw_stock = ".TW" in stock['symbol'] or stock.get('currency') == 'TWD'
+        curr_code = "TWD" if is_tw_stock else "USD"
+        rate = 1.0 if is_tw_stock else usd_to_twd_rate
+        market_val_native = raw_price * stock['shares']
+        cost_total_native = avg_cost_unit * stock['shares']
+        total_stock_value_twd += market_val_native * rate
+        total_invested_twd_display += cost_total_native * rate
+        pnl_val_native = market_val_native - cost_total_native
+        pnl_pct = (pnl_val_native / cost_total_native * 100) if cost_total_native > 0 else 0.0
+        all_assets_data.append({
+            "Type": "Stock", "ID": stock['symbol'], "Name": stock.get('name', stock['symbol']),
+            "Qty": stock['shares'], "Currency": curr_code, "Price_Native": raw_price,
+            "Cost_Unit": avg_cost_unit, "Cost_Total": cost_total_native,
+            "Market_Val_Native": market_val_native, "PnL_Val": pnl_val_native, "PnL_Pct": pnl_pct,
+            "Market_Val_TWD": market_val_native * rate, "Chart_Ticker": stock['symbol']
+        })
+    for crypto in portfolio['crypto']:
+        price_usd = asset_prices.get(crypto['id'], 0.0) / usd_to_twd_rate
+        avg_cost_unit = crypto.get('avg_cost', 0.0)
+        market_val_native = price_usd * crypto['amount']
+        cost_total_native = avg_cost_unit * crypto['amount']
+        market_val_twd = market_val_native * usd_to_twd_rate
+        total_crypto_value_twd += market_val_twd
+        total_invested_twd_display += cost_total_native * usd_to_twd_rate
+        pnl_val_native = market_val_native - cost_total_native
+        pnl_pct = (pnl_val_native / cost_total_native * 100) if cost_total_native > 0 else 0.0
+        chart_ticker = f"{crypto.get('symbol', '').upper()}-USD" if crypto.get('symbol') else None
+        all_assets_data.append({
+            "Type": "Crypto", "ID": crypto['id'], "Name": crypto.get('name', crypto['id']).title(),
+            "Qty": crypto['amount'], "Currency": "USD", "Price_Native": price_usd,
+            "Cost_Unit": avg_cost_unit, "Cost_Total": cost_total_native,
+            "Market_Val_Native": market_val_native, "PnL_Val": pnl_val_native,
+            "PnL_Pct": pnl_pct, "Market_Val_TWD": market_val_twd, "Chart_Ticker": chart_ticker
+        })
+    return all_assets_data, total_stock_value_twd + total_crypto_value_twd, total_invested_twd_display
+
+
+def _best(func, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'positions':>10} {'loop (ms)':>10} {'vector (ms)':>12} {'core (ms)':>10}")
+    for n in args.sizes:
+        portfolio, prices = make_portfolio(n)
+        t_loop, (_, net_loop, _) = _best(lambda: legacy_loop(portfolio, prices, USD_TO_TWD), args.repeat)
+        t_vec, (_, totals) = _best(lambda: val.value_portfolio(portfolio, prices, USD_TO_TWD), args.repeat)
+        assert abs(net_loop - totals["net_worth_twd"]) <= 1e-6 * max(abs(net_loop), 1.0)
+
+        # 純陣列運算部分 (不含 dict 攤平與 DataFrame 組裝)
+        cols = val._holding_arrays(portfolio, prices, USD_TO_TWD)
+        fx = {"TWD": 1.0, "USD": USD_TO_TWD}
+        t_core, _ = _best(lambda: val.value_holdings(cols["Qty"], cols["Cost_Unit"], cols["Price_Native"],
+                                                     cols["Currency"], fx), args.repeat)
+        print(f"{n:>10} {t_loop * 1000:>10.1f} {t_vec * 1000:>12.1f} {t_core * 1000:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+本機假行情伺服器，模擬 Yahoo chart / CoinGecko simple/price / exchangerate-api 的回應格式
+供 benchmark 使用，不需要連網
+"""
+import json
+import random
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+def _fake_price(key):
+    # 依代號產生固定價格，讓每次執行結果一致
+    return round(10 + zlib.crc32(key.encode()) % 100000 / 100, 2)
+
+
+class FakeMarketHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    latency = 0.0
+    error_rate = 0.0  # 回 503 的機率 (api_handler 會退避重試)
+    fixtures = None  # market_fixtures.Fixtures；有錄製的報價 / 匯率就回放，其餘用 _fake_price
+    rng = random.Random(0)
+
+    def _price(self, key):
+        return self.fixtures.price(key) if self.fixtures else _fake_price(key)
+
+    def do_GET(self):
+        if self.latency:
+            time.sleep(self.latency)
+        if self.error_rate and self.rng.random() < self.error_rate:
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        parts = url.path.strip("/").split("/")
+
+        if "chart" in parts:
+            symbol = parts[-1]
+            body = {"chart": {"result": [{"meta": {"symbol": symbol, "regularMarketPrice": self._price(symbol)}}]}}
+        elif parts[-1] == "price":
+            vs = query.get("vs_currencies", ["twd"])[0]
+            ids = query.get("ids", [""])[0].split(",")
+            body = {i: {vs: self._price(i)} for i in ids if i}
+        elif "latest" in parts:
+            base = parts[-1]
+            rates = (self.fixtures.fx_rates() if self.fixtures else None) or {"USD": 1.0, "TWD": 30.5, "JPY": 150.0,
+                                                                              "EUR": 0.92}
+            conv = {c: r / rates.get(base, 1.0) for c, r in rates.items()}
+            body = {"result": "success", "base_code": base, "conversion_rates": conv,
+                    "time_next_update_unix": int(time.time()) + 86400}
+        else:
+            self.send_error(404)
+            return
+
+        payload = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_server(latency=0.0, error_rate=0.0, fixtures=None, seed=0):
+    """在背景執行緒啟動伺服器，回傳 (server, base_url)"""
+    handler = type("Handler", (FakeMarketHandler,), {"latency": latency, "error_rate": error_rate,
+                                                     "fixtures": fixtures, "rng": random.Random(seed)})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def point_api_handler_at(base_url):
+    """把 api_handler 的各 provider 網址改指到假伺服器 (本機伺服器沒有速率上限，一併關閉 rate limit)"""
+    import api_handler as ah
+    ah.YAHOO_CHART_API = f"{base_url}/v8/finance/chart"
+    ah.COINGECKO_API = f"{base_url}/api/v3"
+    ah.EXCHANGE_RATE_API = f"{base_url}/v6"
+    ah.EXCHANGE_RATE_API_KEY = "bench"
+    for provider in list(ah.PROVIDER_RATE_LIMITS):
+        ah.set_rate_limit(provider, 0)
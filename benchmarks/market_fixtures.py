@@ -0,0 +1,228 @@
+"""
+錄製 / 回放行情 fixture，讓 benchmark 不必連網也能走完整條抓價流程
+
+    python benchmarks/market_fixtures.py AAPL 2330.TW --crypto bitcoin -o benchmarks/fixtures/market_sample.json
+
+回放時 Yahoo (yfinance) 由 ReplayYFinance 取代，CoinGecko / exchangerate-api 由 fake_market_server 回應；
+沒有錄到的代號依名稱固定對應到某個錄製樣本並縮放價格，所以任意大小的合成投資組合都能回放
+"""
+import argparse
+import contextlib
+import datetime
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+import types
+import zlib
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'market_sample.json')
+
+# yfinance period / interval 換算成秒數 (回放 K 線用)
+PERIOD_DAYS = {'1d': 1, '5d': 5, '1mo': 31, '3mo': 92, '6mo': 183, '1y': 366, '2y': 731, '5y': 1827, 'max': 20 * 365}
+INTERVAL_SECONDS = {'5m': 300, '15m': 900, '1h': 3600, '1d': 86400, '1wk': 7 * 86400}
+
+
+def _crc(key):
+    return zlib.crc32(key.encode())
+
+
+class Fixtures:
+    """
+    fixture 檔格式:
+    {"recorded_at": ..., "quotes": {代號: 價格}, "fx": {幣別: 1 USD 可換多少},
+     "bars": {代號: {interval: [[ts, close, volume], ...]}}}
+    """
+
+    def __init__(self, data=None):
+        data = data or {}
+        self.recorded_at = data.get('recorded_at')
+        self.quotes = data.get('quotes', {})
+        self.fx = data.get('fx', {})
+        self.bars_data = data.get('bars', {})
+        self._templates = sorted(self.quotes)
+
+    @classmethod
+    def load(cls, path=DEFAULT_FIXTURE):
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls(json.load(f))
+
+    def template(self, key):
+        """沒有錄到的代號固定對應到一個錄製樣本"""
+        if key in self.quotes or not self._templates:
+            return key
+        return self._templates[_crc(key) % len(self._templates)]
+
+    def price(self, key):
+        if key in self.quotes:
+            return self.quotes[key]
+        if not self._templates:
+            return round(10 + _crc(key) % 100000 / 100, 2)
+        scale = 0.5 + _crc(key) % 1000 / 1000
+        return round(self.quotes[self.template(key)] * scale, 4)
+
+    def fx_rates(self):
+        return dict(self.fx) or None
+
+    def bars(self, symbol, interval, start_ts, end_ts):
+        """回傳 [(ts, close, volume)]；有錄製的就切出區間，否則以價格為中心產生固定的合成走勢"""
+        recorded = self.bars_data.get(symbol, {}).get(interval)
+        if recorded:
+            return [tuple(b) for b in recorded if start_ts <= b[0] <= end_ts]
+        step = INTERVAL_SECONDS.get(interval, 86400)
+        price = self.price(symbol)
+        phase = _crc(symbol) % 628 / 100
+        first = -(-int(start_ts) // step) * step
+        rows = []
+        for ts in range(first, int(end_ts) + 1, step):
+            # 只依時間戳計算，增量補抓與整段重抓會得到相同的值
+            wave = 0.08 * math.sin(ts / (86400 * 37) + phase) + 0.02 * math.sin(ts / (3600 * 29) + phase * 3)
+            rows.append((ts, round(price * math.exp(wave), 4), float(1000 + (ts // step) % 5000)))
+        return rows
+
+
+class FaultInjector:
+    """每次呼叫先等待 latency 秒，再以 error_rate 的機率丟出 ConnectionError"""
+
+    def __init__(self, latency=0.0, error_rate=0.0, seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.stats = {"calls": 0, "errors": 0}
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def roll(self):
+        with self._lock:
+            return self._rng.random() < self.error_rate
+
+    def call(self, name):
+        if self.latency:
+            time.sleep(self.latency)
+        failed = self.error_rate and self.roll()
+        with self._lock:
+            self.stats["calls"] += 1
+            self.stats["errors"] += bool(failed)
+        if failed:
+            raise ConnectionError(f"injected failure: {name}")
+
+
+# --- 回放用的 yfinance ---
+class _ReplayTicker:
+    def __init__(self, yf, symbol):
+        self._yf = yf
+        self.ticker = symbol
+
+    @property
+    def info(self):
+        self._yf.faults.call("yahoo.info")
+        price = self._yf.fixtures.price(self.ticker)
+        currency = 'TWD' if self.ticker.upper().endswith(('.TW', '.TWO')) else 'USD'
+        return {"currentPrice": price, "regularMarketPrice": price, "currency": currency,
+                "longName": self.ticker, "shortName": self.ticker}
+
+    @property
+    def fast_info(self):
+        return types.SimpleNamespace(last_price=self._yf.fixtures.price(self.ticker))
+
+    def history(self, period=None, interval='1d', start=None, **kwargs):
+        import pandas as pd
+        self._yf.faults.call("yahoo.history")
+        end_ts = time.time()
+        if start is not None:
+            start_ts = pd.Timestamp(start).timestamp()
+        else:
+            start_ts = end_ts - PERIOD_DAYS.get(period or '1mo', 31) * 86400
+        rows = self._yf.fixtures.bars(self.ticker, interval, start_ts, end_ts)
+        tz = 'Asia/Taipei' if self.ticker.upper().endswith(('.TW', '.TWO')) else 'America/New_York'
+        if not rows:
+            return pd.DataFrame(columns=['Open', 'High', 'Low', 'Close', 'Volume'])
+        ts, close, volume = zip(*rows)
+        index = pd.to_datetime(list(ts), unit='s', utc=True).tz_convert(tz)
+        return pd.DataFrame({'Open': close, 'High': close, 'Low': close, 'Close': close, 'Volume': volume},
+                            index=index)
+
+
+class ReplayYFinance(types.ModuleType):
+    """
+    只實作 api_handler 用到的 yf.download / yf.Ticker
+    batch 下載整批只算一次請求；每個代號另以 error_rate 的機率缺值，走逐檔補抓的路徑
+    """
+
+    def __init__(self, fixtures, faults=None):
+        super().__init__("yfinance")
+        self.fixtures = fixtures
+        self.faults = faults or FaultInjector()
+
+    def Ticker(self, symbol, session=None):  # noqa: N802 (沿用 yfinance 的名稱)
+        return _ReplayTicker(self, symbol)
+
+    def download(self, tickers, period='5d', interval='1d', **kwargs):
+        import numpy as np
+        import pandas as pd
+        self.faults.call("yahoo.download")
+        symbols = [tickers] if isinstance(tickers, str) else list(tickers)
+        days = min(PERIOD_DAYS.get(period, 5), 5)
+        index = pd.date_range(end=datetime.date.today(), periods=days, freq='D')
+        values = np.empty((days, len(symbols)))
+        for j, symbol in enumerate(symbols):
+            values[:, j] = np.nan if self.faults.error_rate and self.faults.roll() else self.fixtures.price(symbol)
+        columns = pd.MultiIndex.from_arrays([symbols, ['Close'] * len(symbols)])
+        return pd.DataFrame(values, index=index, columns=columns)
+
+
+@contextlib.contextmanager
+def replay_yfinance(fixtures, faults=None):
+    """在 with 區塊內讓 `import yfinance` 取得回放版 (api_handler 都是在函式內才 import)"""
+    previous = sys.modules.get("yfinance")
+    sys.modules["yfinance"] = ReplayYFinance(fixtures, faults)
+    try:
+        yield sys.modules["yfinance"]
+    finally:
+        if previous is None:
+            sys.modules.pop("yfinance", None)
+        else:
+            sys.modules["yfinance"] = previous
+
+
+# --- 錄製 (需連網) ---
+def record(stock_symbols, crypto_ids, intervals=('1d',)):
+    sys.path.insert(0, ROOT)
+    import api_handler as ah
+    quotes, _ = ah.get_stock_prices(stock_symbols, use_cache=False)
+    quotes.update(ah.get_crypto_prices(crypto_ids, use_cache=False))
+    fx, _ = ah.download_fx_table()
+    bars = {}
+    for symbol in stock_symbols:
+        for interval in intervals:
+            history = ah.download_bars(symbol, interval, period=ah.BAR_BACKFILL_PERIOD[interval])
+            if history is None:
+                continue
+            ts = history.index.tz_convert('UTC').as_unit('s').asi8 if history.index.tz is not None \
+                else history.index.as_unit('s').asi8
+            bars.setdefault(symbol, {})[interval] = [
+                [int(t), float(c), float(v) if v == v else 0.0]
+                for t, c, v in zip(ts, history['Close'], history.get('Volume', history['Close'] * 0))]
+    return {"recorded_at": datetime.datetime.now().isoformat(timespec='seconds'),
+            "quotes": {k: v for k, v in quotes.items() if v}, "fx": fx or {}, "bars": bars}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="從線上 API 錄製 benchmark 用的行情 fixture")
+    parser.add_argument("stocks", nargs="*")
+    parser.add_argument("--crypto", nargs="*", default=[])
+    parser.add_argument("--intervals", nargs="*", default=['1d'])
+    parser.add_argument("-o", "--output", default=DEFAULT_FIXTURE)
+    args = parser.parse_args()
+    data = record(args.stocks, args.crypto, args.intervals)
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=1)
+    print(f"已錄製 {len(data['quotes'])} 筆報價、{len(data['bars'])} 檔 K 線 -> {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,20 @@
-import plotly.express as px
-import plotly.graph_objects as go
-import pandas as pd
+import metrics
+
+# plotly / pandas / numpy 在第一次畫圖時才 import，只 import 本模組 (例如讀取常數) 不必付出載入成本
+
+# --- 走勢圖降採樣 ---
+# 點數超過畫面寬度能呈現的量時，以 LTTB 保留視覺形狀、減少送到瀏覽器的資料量
+CHART_DEFAULT_WIDTH_PX = 1200
+CHART_POINTS_PER_PX = 2  # 每個像素最多保留的點數
+CHART_MIN_POINTS = 200
+# 原始資料筆數超過此值改用 WebGL (Scattergl)；以降採樣前的筆數判斷，降採樣後的點數上限低於此值
+WEBGL_THRESHOLD = 5000
 
 
 # --- 資產配置圓餅圖 (維持不變) ---
+@metrics.timed("chart.asset_allocation_pie")
 def plot_asset_allocation_pie(stock_value, crypto_value):
+    import plotly.express as px
     labels = ['股票 (Stocks)', '加密貨幣 (Crypto)']
     values = [stock_value, crypto_value]
     if stock_value <= 0 and crypto_value <= 0:
@@ -18,16 +28,21 @@ def plot_asset_allocation_pie(stock_value, crypto_value):
     return fig
 
 
-# --- 支出分析圓餅圖 (維持不變) ---
-def plot_expense_pie(transactions_data, rates_twd_base):
+# --- 支出分析圓餅圖 ---
+@metrics.timed("chart.expense_pie")
+def plot_expense_pie(expense_rollup, rates_twd_base):
+    """
+    expense_rollup: dm.load_expense_rollup() 預先彙總的桶 (每個 月份/類別/幣別 一筆)
+    匯率換算只對每個幣別桶做一次，不逐筆交易換算
+    """
+    import pandas as pd
+    import plotly.express as px
     category_spending = {}
-    for tx in transactions_data:
-        amount = tx.get('amount', 0)
-        currency = tx.get('currency', 'TWD')
-        category = tx.get('category', '其他')
+    for bucket in expense_rollup:
+        currency = bucket.get('currency', 'TWD')
         rate = rates_twd_base.get(currency, 1.0) if currency != "TWD" else 1.0
-        amount_twd = amount * rate
-        category_spending[category] = category_spending.get(category, 0) + amount_twd
+        category = bucket.get('category', '其他')
+        category_spending[category] = category_spending.get(category, 0) + bucket['total'] * rate
 
     if not category_spending:
         return px.pie(names=["無支出"], values=[1], title="尚無支出資料")
@@ -41,13 +56,21 @@ def plot_expense_pie(transactions_data, rates_twd_base):
 
 
 # --- 總資產歷史走勢圖 (維持不變) ---
+@metrics.timed("chart.net_worth_history")
 def plot_net_worth_history(history_data):
-    if not history_data:
+    """history_data 可為 dm.load_history_df() 的 DataFrame 或舊版的 dict list"""
+    import pandas as pd
+    import plotly.express as px
+    import plotly.graph_objects as go
+    if history_data is None or len(history_data) == 0:
         fig = go.Figure();
         fig.update_layout(title="尚無歷史資料")
         return fig
-    df = pd.DataFrame(history_data)
-    df['Date'] = pd.to_datetime(df['Date'])
+    if isinstance(history_data, pd.DataFrame):
+        df = history_data
+    else:
+        df = pd.DataFrame(history_data)
+        df['Date'] = pd.to_datetime(df['Date'])
     df = df.sort_values('Date')
 
     min_val = df['NetWorth'].min()
@@ -63,11 +86,60 @@ def plot_net_worth_history(history_data):
     return fig
 
 
+# --- LTTB (Largest-Triangle-Three-Buckets) ---
+def point_budget(viewport_width=None):
+    """依圖表寬度 (像素) 決定要保留的點數"""
+    width = viewport_width or CHART_DEFAULT_WIDTH_PX
+    return max(CHART_MIN_POINTS, int(width * CHART_POINTS_PER_PX))
+
+
+def lttb_indices(x, y, threshold):
+    """
+    回傳要保留的資料索引 (含首尾兩點)
+    中間的點平均分成 threshold - 2 個桶，每桶挑出與前一個選中點、下一桶平均點構成最大三角形的點
+    """
+    import numpy as np
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    edges = np.linspace(1, n - 1, threshold - 1).astype(int)
+
+    out = np.empty(threshold, dtype=np.int64)
+    out[0], out[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            next_x, next_y = x[end:edges[i + 2]].mean(), y[end:edges[i + 2]].mean()
+        else:
+            next_x, next_y = x[-1], y[-1]
+        area = np.abs((x[a] - next_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (next_y - y[a]))
+        a = start + int(np.nanargmax(area)) if not np.all(np.isnan(area)) else start
+        out[i + 1] = a
+    return out
+
+
+def _time_axis(dates):
+    """把日期欄轉成秒數 (支援有時區與無時區)"""
+    import pandas as pd
+    dates = pd.to_datetime(dates)
+    return (dates - dates.iloc[0]).dt.total_seconds().to_numpy()
+
+
 # --- [重點修改] 個股走勢圖 (加入 MA 線功能) ---
-def plot_price_history(df, title, show_ma5=False, show_ma20=False, show_ma60=False):
+@metrics.timed("chart.price_history")
+def plot_price_history(df, title, show_ma5=False, show_ma20=False, show_ma60=False, viewport_width=None,
+                       downsample=True, indicators=None):
     """
     繪製個股歷史走勢，並疊加 MA 線
+    viewport_width: 圖表寬度 (像素)，用來決定降採樣的點數上限；downsample=False 則送出全部資料
+    indicators: indicators.get_indicators() 的結果 (與 df 同索引)；未提供時才就地計算一次
+    MA 一律以完整資料計算，降採樣只影響畫出來的點；不會修改傳入的 df
     """
+    import plotly.graph_objects as go
+    import indicators as ind
     if df is None or df.empty:
         fig = go.Figure()
         fig.update_layout(
@@ -77,14 +149,20 @@ def plot_price_history(df, title, show_ma5=False, show_ma20=False, show_ma60=Fal
         )
         return fig
 
-    # 1. 計算 MA 值 (使用 pandas rolling window)
+    # 1. 取得 MA 值 (由 indicators 模組計算並快取)
     # 注意：如果資料筆數少於 window 大小，前面會出現 NaN，Plotly 會自動不畫，這是正常的
-    if show_ma5:
-        df['MA5'] = df['Close'].rolling(window=5).mean()
-    if show_ma20:
-        df['MA20'] = df['Close'].rolling(window=20).mean()
-    if show_ma60:
-        df['MA60'] = df['Close'].rolling(window=60).mean()
+    ma_names = [name for name, on in (("SMA5", show_ma5), ("SMA20", show_ma20), ("SMA60", show_ma60)) if on]
+    if indicators is None and ma_names:
+        indicators = ind.compute_indicators(df, ma_names)
+
+    # 降採樣 (只挑要畫的列，Y 軸範圍仍以完整資料計算)
+    trace_cls = go.Scattergl if len(df) > WEBGL_THRESHOLD else go.Scatter
+    plot_df = df
+    if downsample and len(df) > point_budget(viewport_width):
+        keep = lttb_indices(_time_axis(df['Datetime']), df['Close'].to_numpy(), point_budget(viewport_width))
+        plot_df = df.iloc[keep]
+        if indicators is not None:
+            indicators = indicators.iloc[keep]
 
     # 2. 準備繪圖 (計算 Y 軸範圍)
     start_price = df['Close'].iloc[0]
@@ -101,28 +179,28 @@ def plot_price_history(df, title, show_ma5=False, show_ma20=False, show_ma60=Fal
     fig = go.Figure()
 
     # 加入收盤價主線
-    fig.add_trace(go.Scatter(
-        x=df['Datetime'], y=df['Close'],
+    fig.add_trace(trace_cls(
+        x=plot_df['Datetime'], y=plot_df['Close'],
         mode='lines', name='收盤價',
         line=dict(color=line_color, width=2)
     ))
 
     # 4. 疊加 MA 線 (如果使用者有勾選)
     if show_ma5:
-        fig.add_trace(go.Scatter(
-            x=df['Datetime'], y=df['MA5'],
+        fig.add_trace(trace_cls(
+            x=plot_df['Datetime'], y=indicators['SMA5'],
             mode='lines', name='MA5 (週線)',
             line=dict(color='orange', width=1.5), opacity=0.8
         ))
     if show_ma20:
-        fig.add_trace(go.Scatter(
-            x=df['Datetime'], y=df['MA20'],
+        fig.add_trace(trace_cls(
+            x=plot_df['Datetime'], y=indicators['SMA20'],
             mode='lines', name='MA20 (月線)',
             line=dict(color='royalblue', width=1.5), opacity=0.8
         ))
     if show_ma60:
-        fig.add_trace(go.Scatter(
-            x=df['Datetime'], y=df['MA60'],
+        fig.add_trace(trace_cls(
+            x=plot_df['Datetime'], y=indicators['SMA60'],
             mode='lines', name='MA60 (季線)',
             line=dict(color='purple', width=1.5), opacity=0.8
         ))
@@ -0,0 +1,129 @@
+"""
+命令列估值工具 (不需 Streamlit / Plotly，可放進 cron 排程)
+
+    python cli.py                               # 估值預設投資組合並記錄今天的淨值
+    python cli.py a.json b.json --format csv    # 一次處理多個 portfolio 檔
+    python cli.py --assets --no-history -o out.json
+"""
+import argparse
+import csv
+import datetime
+import json
+import os
+import sys
+
+import api_handler as ah
+import data_manager as dm
+import metrics
+import valuation as val
+
+TOTAL_FIELDS = ["stock_value_twd", "crypto_value_twd", "invested_twd", "net_worth_twd", "unrealized_pnl_twd",
+                "roi_pct"]
+ASSET_FIELDS = ["Type", "ID", "Name", "Qty", "Currency", "Price_Native", "Cost_Unit", "Market_Val_TWD", "PnL_Val",
+                "PnL_Pct"]
+
+
+def history_path_for(portfolio_file):
+    """
+    預設投資組合回傳 None (經 dm.update_history 寫入目前的儲存後端：CSV / Parquet / SQLite)，
+    其他檔案記在同目錄的 <名稱>.history.csv
+    """
+    if not portfolio_file or os.path.abspath(portfolio_file) == os.path.abspath(dm.PORTFOLIO_FILE):
+        return None
+    stem = os.path.splitext(portfolio_file)[0]
+    return f"{stem}.history.csv"
+
+
+def fetch_prices(portfolios, use_snapshot=False):
+    """所有投資組合的代號合併後只抓一次行情"""
+    stock_symbols = sorted({s['symbol'] for p in portfolios for s in p['stocks']})
+    crypto_ids = sorted({c['id'] for p in portfolios for c in p['crypto']})
+    if use_snapshot:
+        import price_refresher as pr
+        snapshot = pr.load_latest_snapshot()
+        # 背景更新停了 (有類別過期) 就直接抓即時行情
+        data = None if pr.stale_classes(snapshot, stock_symbols, crypto_ids) else \
+            pr.market_data_from_snapshot(snapshot, stock_symbols, crypto_ids)
+        if data is not None:
+            return data
+    return ah.fetch_market_data(stock_symbols, crypto_ids)
+
+
+def value_portfolios(files, record_history=True, use_snapshot=False, include_assets=False):
+    portfolios = [dm.load_portfolio_file(f) if f else dm.load_portfolio() for f in files]
+    usd_rates, _, asset_prices, _ = fetch_prices(portfolios, use_snapshot)
+    usd_to_twd = usd_rates.get("TWD", ah.DEFAULT_USD_RATES["TWD"])
+    today = datetime.date.today().strftime("%Y-%m-%d")
+
+    results = []
+    for path, portfolio in zip(files, portfolios):
+        assets_df, totals = val.value_portfolio(portfolio, asset_prices, usd_to_twd)
+        missing = val.missing_prices(portfolio, asset_prices)
+        if missing:
+            # 缺價時淨值偏低，寫進歷史會在走勢圖留下假的下跌
+            print(f"{path or dm.PORTFOLIO_FILE}: 沒有報價 {', '.join(missing)}，不寫入淨值歷史", file=sys.stderr)
+        elif record_history:
+            dm.update_history(totals['net_worth_twd'], history_file=history_path_for(path))
+        result = {"portfolio": path or dm.PORTFOLIO_FILE, "date": today, "usd_to_twd": usd_to_twd, **totals,
+                  "missing_prices": missing}
+        if include_assets:
+            result["assets"] = assets_df[ASSET_FIELDS].to_dict('records')
+        results.append(result)
+    return results
+
+
+def write_json(results, out):
+    json.dump(results, out, ensure_ascii=False, indent=2)
+    out.write("\n")
+
+
+def write_csv(results, out, include_assets=False):
+    if include_assets:
+        writer = csv.writer(out)
+        writer.writerow(["portfolio", "date"] + ASSET_FIELDS)
+        for r in results:
+            for asset in r.get("assets", []):
+                writer.writerow([r["portfolio"], r["date"]] + [asset[k] for k in ASSET_FIELDS])
+        return
+    writer = csv.DictWriter(out, fieldnames=["portfolio", "date", "usd_to_twd"] + TOTAL_FIELDS, extrasaction='ignore')
+    writer.writeheader()
+    writer.writerows(results)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="PyAsset 命令列估值 / 淨值快照")
+    parser.add_argument("portfolios", nargs="*",
+                        help="portfolio JSON 檔 (省略時使用目前儲存後端的預設投資組合)")
+    parser.add_argument("--format", choices=["json", "csv"], default="json")
+    parser.add_argument("-o", "--output", help="輸出檔案 (預設為標準輸出)")
+    parser.add_argument("--assets", action="store_true", help="一併輸出每筆持倉")
+    parser.add_argument("--no-history", action="store_true", help="不寫入淨值歷史")
+    parser.add_argument("--use-snapshot", action="store_true",
+                        help="優先使用背景更新的報價快照 (price_snapshots/latest.json)")
+    parser.add_argument("--metrics-file", default=metrics.METRICS_FILE,
+                        help="結束時把效能指標寫成 Prometheus 文字檔 (預設讀 PYASSET_METRICS_FILE)")
+    args = parser.parse_args(argv)
+
+    missing = [f for f in args.portfolios if not os.path.exists(f)]
+    if missing:
+        print("找不到檔案: " + ", ".join(missing), file=sys.stderr)
+        return 2
+
+    results = value_portfolios(args.portfolios or [None], record_history=not args.no_history,
+                               use_snapshot=args.use_snapshot, include_assets=args.assets)
+
+    out = open(args.output, 'w', encoding='utf-8', newline='') if args.output else sys.stdout
+    try:
+        if args.format == "csv":
+            write_csv(results, out, args.assets)
+        else:
+            write_json(results, out)
+    finally:
+        if args.output:
+            out.close()
+    metrics.write_prometheus_file(args.metrics_file)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
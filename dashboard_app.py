@@ -2,11 +2,30 @@ import streamlit as st
 import data_manager as dm
 import api_handler as ah
 import chart_plotter as cp
-import concurrent.futures
+import valuation as val
+import indicators as ind
+import price_refresher as pr
+import providers
+import lot_ledger as ll
+import metrics
+import os
 import time
 import datetime
+import hashlib
+import json
+import contextlib
 import pandas as pd
 
+_run_started = time.perf_counter()
+_timings = {}  # 本次重新執行各階段耗時 (毫秒)
+
+# 設定 PYASSET_ASYNC_ENGINE=1 改用 asyncio 版抓價引擎 (需安裝 aiohttp)
+USE_ASYNC_ENGINE = os.environ.get("PYASSET_ASYNC_ENGINE") == "1"
+# 背景報價更新: 'thread' (在本程序啟動背景執行緒，預設)、'external' (另行執行 python price_refresher.py)、'off'
+BACKGROUND_REFRESH = os.environ.get("PYASSET_BACKGROUND_REFRESH", "thread")
+# 走勢圖寬度 (像素)，決定降採樣後送到瀏覽器的點數
+PRICE_CHART_WIDTH_PX = int(os.environ.get("PYASSET_CHART_WIDTH", 1400))
+
 # --- 頁面配置 ---
 st.set_page_config(
     page_title="PyAsset Pro",
@@ -77,58 +96,111 @@ st.markdown("""
 
 
 # --- 核心資料抓取 ---
-@st.cache_data(ttl=600)
-def fetch_all_data():
-    global g_usd_rates, g_twd_rates, g_asset_prices
+# 只快取行情 (以代號集合為 key)；報價本身另有 api_handler 的 SQLite 快取，
+# 買賣或記帳後不需清除，新增的代號才會觸發抓取
+@st.cache_data(ttl=60)
+def fetch_live_data(stock_symbols, crypto_ids):
+    if USE_ASYNC_ENGINE:
+        import market_engine as me
+        return me.fetch_market_data(stock_symbols, crypto_ids)
+    return ah.fetch_market_data(stock_symbols, crypto_ids)
+
+
+@st.cache_resource
+def get_price_refresher():
+    """每個 Streamlit 程序只啟動一個背景更新執行緒"""
+    return pr.PriceRefresher().start()
+
+
+def fetch_all_data(stock_symbols, crypto_ids):
+    """
+    優先讀背景更新發布的最新快照 (不連網)；
+    尚無快照、快照缺少新代號或有類別過期 (背景更新停了) 時才同步抓一次，並把結果發布成快照
+    """
+    if BACKGROUND_REFRESH == 'off':
+        return fetch_live_data(stock_symbols, crypto_ids)
+    snapshot = pr.load_latest_snapshot()
+    data = None if pr.stale_classes(snapshot, stock_symbols, crypto_ids) else \
+        pr.market_data_from_snapshot(snapshot, stock_symbols, crypto_ids)
+    metrics.cache_lookup('snapshot', hits=int(data is not None), misses=int(data is None))
+    if data is None:
+        data = fetch_live_data(stock_symbols, crypto_ids)
+        pr.publish_market_data(stock_symbols, crypto_ids, data)
+    if BACKGROUND_REFRESH == 'thread':
+        get_price_refresher()
+    return data
+
+
+# --- 衍生狀態 (依內容雜湊快取) ---
+# 只切換 MA 勾選等小互動時，持倉、報價、匯率沒變，估值與合計直接取快取結果
+def content_hash(*parts):
+    payload = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def derive_state(state_key, _portfolio, _asset_prices, _usd_to_twd, _realized_pnl):
+    """以 state_key 為快取 key；底線開頭的參數不參與 Streamlit 的雜湊"""
+    assets_df, totals = val.value_portfolio(_portfolio, _asset_prices, _usd_to_twd)
+    return {
+        "assets": assets_df.to_dict('records'),
+        "totals": totals,
+        "realized_total_twd": val.realized_pnl_total_twd(_realized_pnl, _usd_to_twd),
+    }
 
-    portfolio = dm.load_portfolio()
-    g_usd_rates = {}
-    g_twd_rates = {}
-    g_asset_prices = {}
-
-    unique_stocks = set(s['symbol'] for s in portfolio['stocks'])
-    unique_cryptos = set(c['id'] for c in portfolio['crypto'])
-
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        future_usd_rates = executor.submit(ah.get_exchange_rates_usd_base)
-        future_twd_rates = executor.submit(ah.get_exchange_rates)
-
-        asset_futures = {}
-        for symbol in unique_stocks:
-            asset_futures[symbol] = executor.submit(ah.get_stock_price, symbol)
-
-        for crypto_id in unique_cryptos:
-            time.sleep(0.1)
-            asset_futures[crypto_id] = executor.submit(ah.get_crypto_price, crypto_id)
-
-        try:
-            g_usd_rates = future_usd_rates.result() or {"TWD": 30.5}
-        except:
-            g_usd_rates = {"TWD": 30.5}
-
-        try:
-            g_twd_rates = future_twd_rates.result() or {"USD": 0.032}
-        except:
-            g_twd_rates = {"USD": 0.032}
-
-        for key, future in asset_futures.items():
-            try:
-                price = future.result()
-                g_asset_prices[key] = price
-            except:
-                g_asset_prices[key] = 0.0
 
-    transactions = dm.load_transactions()
-    realized_pnl = dm.load_realized_pnl()
-    return g_usd_rates, g_twd_rates, g_asset_prices, portfolio, transactions, realized_pnl
+@st.cache_data(max_entries=16, show_spinner=False)
+def allocation_figure(stock_value, crypto_value):
+    return cp.plot_asset_allocation_pie(stock_value, crypto_value)
+
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def expense_figure(expense_rollup, rates_twd_base):
+    return cp.plot_expense_pie(expense_rollup, rates_twd_base)
+
+
+# --- 執行時間統計 ---
+@contextlib.contextmanager
+def timed(stage, store=None):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - t0
+        store = _timings if store is None else store
+        store[stage] = store.get(stage, 0.0) + elapsed * 1000
+        metrics.observe('rerun_stage_seconds', elapsed, stage=stage)
 
 
 # --- 輔助函式 ---
-def calculate_new_avg_cost(old_shares, old_avg_unit_cost, new_shares, new_total_cost):
-    total_shares = old_shares + new_shares
-    if total_shares == 0: return 0.0
-    total_cost_value = (old_shares * old_avg_unit_cost) + new_total_cost
-    return total_cost_value / total_shares
+SELL_METHODS = {"平均成本": ll.AVERAGE, "先進先出 (FIFO)": ll.FIFO, "後進先出 (LIFO)": ll.LIFO}
+
+
+def load_ledger(holding, asset_id, qty_field):
+    return ll.LotLedger.from_holding(asset_id, holding, qty_field, state=dm.load_lots(holding.get('lot_ref')))
+
+
+def save_ledger(ledger, holding, kind, asset_id, qty_field):
+    """更新持倉的數量與平均成本，批次只寫回這個資產自己的批次檔"""
+    holding['lot_ref'] = ref = dm.lot_ref(kind, asset_id)
+    dm.save_lots(ref, ledger.write_holding(asset_id, holding, qty_field))
+
+
+def buy_into_lots(holding, kind, asset_id, qty_field, qty, price):
+    today = datetime.date.today().strftime("%Y-%m-%d")
+    ledger = load_ledger(holding, asset_id, qty_field)
+    ledger.buy(asset_id, qty, price, today)
+    save_ledger(ledger, holding, kind, asset_id, qty_field)
+
+
+def sell_from_lots(holding, kind, asset_id, qty_field, qty, price, method):
+    """依批次配對賣出，更新持倉並回傳 (平均成本, 損益, 報酬率%)"""
+    today = datetime.date.today().strftime("%Y-%m-%d")
+    ledger = load_ledger(holding, asset_id, qty_field)
+    matches = ledger.sell(asset_id, qty, price, today, method=method)
+    save_ledger(ledger, holding, kind, asset_id, qty_field)
+    _, avg, pnl, roi = ll.summarize_matches(matches)
+    return avg, pnl, roi
 
 
 def format_currency(value, currency):
@@ -150,6 +222,88 @@ def format_qty_display(qty, asset_type, currency):
         return f"{qty:,.6f}" if asset_type == "Crypto" else f"{qty:,.0f} 股"
 
 
+# --- 可獨立重跑的區塊 (st.fragment) ---
+@st.fragment
+def render_asset_detail(idx, asset):
+    timings = {}
+    with timed("個股詳情", timings):
+        cc = asset['Currency']
+
+        st.markdown(" ")
+        st.subheader(f"📌 {asset['Name']} 持倉分析")
+
+        with st.container(border=True):
+            row1_a, row1_b, row1_c = st.columns(3)
+            with row1_a: st.metric("個人報酬率", f"{asset['PnL_Pct']:.2f}%")
+            with row1_b: st.metric(f"未實現損益 ({cc})", format_currency(asset['PnL_Val'], cc))
+            with row1_c: st.metric(f"總投入成本 ({cc})", format_currency(asset['Cost_Total'], cc))
+            st.divider()
+            row2_d, row2_e, row2_f, row2_g = st.columns(4)
+            with row2_d:
+                st.write("**持有數量**");
+                st.markdown(f"#### {format_qty_display(asset['Qty'], asset['Type'], cc)}")
+            with row2_e:
+                st.write(f"**平均單價 ({cc})**");
+                st.markdown(f"#### {format_currency(asset['Cost_Unit'], cc)}")
+            with row2_f:
+                st.write(f"**目前市價 ({cc})**");
+                st.markdown(f"#### {format_currency(asset['Price_Native'], cc)}")
+            with row2_g:
+                st.write("**庫存現值 (折合台幣)**");
+                st.markdown(f"#### NT$ {asset['Market_Val_TWD']:,.0f}")
+
+        st.markdown("### 📉 歷史股價走勢")
+        c_ma1, c_ma2, c_ma3, c_range = st.columns([1, 1, 1, 4])
+        with c_ma1:
+            show_ma5 = st.checkbox("MA5 (週)", value=True, key=f"ma5_{idx}")
+        with c_ma2:
+            show_ma20 = st.checkbox("MA20 (月)", value=False, key=f"ma20_{idx}")
+        with c_ma3:
+            show_ma60 = st.checkbox("MA60 (季)", value=False, key=f"ma60_{idx}")
+        with c_range:
+            range_opts = ['1D', '1W', '1M', '1Y', 'All']
+            selected_range = st.radio("選擇區間", range_opts, index=2, horizontal=True, key=f"range_sel_{idx}",
+                                      label_visibility="collapsed")
+
+        if asset['Chart_Ticker']:
+            with st.spinner(f"正在載入 {selected_range} 走勢圖..."):
+                df_hist = ah.get_historical_data(asset['Chart_Ticker'], selected_range)
+                if df_hist is not None:
+                    ma_names = [n for n, on in (("SMA5", show_ma5), ("SMA20", show_ma20), ("SMA60", show_ma60)) if on]
+                    df_ind = ind.get_indicators(df_hist, asset['Chart_Ticker'],
+                                                ah.RANGE_INTERVALS.get(selected_range, '1d'), ma_names)
+                    fig_price = cp.plot_price_history(df_hist, f"{asset['Name']} ({selected_range})", show_ma5,
+                                                      show_ma20, show_ma60, viewport_width=PRICE_CHART_WIDTH_PX,
+                                                      indicators=df_ind)
+                    st.plotly_chart(fig_price, use_container_width=True)
+                else:
+                    st.warning("⚠️ 無法取得此資產的歷史數據")
+        else:
+            st.info("此資產暫不支援走勢圖功能")
+    st.session_state.fragment_timings = timings
+
+
+@st.fragment
+def render_expense_panel(transactions):
+    """切換月份只重跑支出圖與明細表"""
+    timings = {}
+    with timed("支出分析", timings):
+        st.subheader("支出分析")
+        month_opts = ['-- 全部 --'] + dm.expense_months()
+        if st.session_state.filters['month'] not in month_opts:
+            st.session_state.filters['month'] = '-- 全部 --'
+        sel_month = st.selectbox("月份", month_opts, index=month_opts.index(st.session_state.filters['month']))
+        st.session_state.filters['month'] = sel_month
+        all_months = sel_month == '-- 全部 --'
+        # 只讀選定月份的彙總桶與交易 (SQLite 後端走索引)
+        expense_rollup = dm.load_expense_rollup(None if all_months else sel_month)
+        exp_rates = ah.get_conversion_rates_to("TWD")
+        st.plotly_chart(expense_figure(expense_rollup, exp_rates), use_container_width=True)
+        tx_filtered = transactions if all_months else dm.query_transactions(month=sel_month)
+        st.dataframe(pd.DataFrame(tx_filtered), use_container_width=True)
+    st.session_state.fragment_timings = timings
+
+
 # --- 主程式 ---
 st.title("📈 PyAsset Pro 投資管家")
 
@@ -159,90 +313,43 @@ if 'filters' not in st.session_state:
 if 'selected_asset_idx' not in st.session_state:
     st.session_state.selected_asset_idx = None
 
-with st.spinner("正在同步數據..."):
-    usd_rates, twd_rates, asset_prices, portfolio, transactions, realized_pnl_data = fetch_all_data()
+with timed("讀取資料"):
+    portfolio = dm.load_portfolio()
+    transactions = dm.load_transactions()
+    realized_pnl_data = dm.load_realized_pnl()
+
+with timed("抓取行情"), st.spinner("正在同步數據..."):
+    usd_rates, twd_rates, asset_prices, quote_report = fetch_all_data(
+        tuple(sorted(set(s['symbol'] for s in portfolio['stocks']))),
+        tuple(sorted(set(c['id'] for c in portfolio['crypto']))))
 
 usd_to_twd_rate = usd_rates.get("TWD", 30.5)
 
 # --- 資料運算 ---
-all_assets_data = []
-total_stock_value_twd = 0.0
-total_crypto_value_twd = 0.0
-total_invested_twd_display = 0.0
-
-# 1. 股票
-for stock in portfolio['stocks']:
-    raw_price = asset_prices.get(stock['symbol'], 0.0)
-    avg_cost_unit = stock.get('avg_cost', 0.0)
-    is_tw_stock = ".TW" in stock['symbol'] or stock.get('currency') == 'TWD'
-
-    if is_tw_stock:
-        curr_code = "TWD"
-        market_val_native = raw_price * stock['shares']
-        cost_total_native = avg_cost_unit * stock['shares']
-        total_stock_value_twd += market_val_native
-        total_invested_twd_display += cost_total_native
-        pnl_val_native = market_val_native - cost_total_native
-    else:
-        curr_code = "USD"
-        market_val_native = raw_price * stock['shares']
-        cost_total_native = avg_cost_unit * stock['shares']
-        total_stock_value_twd += (market_val_native * usd_to_twd_rate)
-        total_invested_twd_display += (cost_total_native * usd_to_twd_rate)
-        pnl_val_native = market_val_native - cost_total_native
-
-    pnl_pct = (pnl_val_native / cost_total_native * 100) if cost_total_native > 0 else 0.0
-
-    all_assets_data.append({
-        "Type": "Stock", "ID": stock['symbol'], "Name": stock.get('name', stock['symbol']),
-        "Qty": stock['shares'], "Currency": curr_code, "Price_Native": raw_price,
-        "Cost_Unit": avg_cost_unit, "Cost_Total": cost_total_native,
-        "Market_Val_Native": market_val_native, "PnL_Val": pnl_val_native, "PnL_Pct": pnl_pct,
-        "Market_Val_TWD": market_val_native if curr_code == "TWD" else market_val_native * usd_to_twd_rate,
-        "Chart_Ticker": stock['symbol']
-    })
-
-# 2. 加密貨幣
-for crypto in portfolio['crypto']:
-    price_twd_raw = asset_prices.get(crypto['id'], 0.0)
-    price_usd = price_twd_raw / usd_to_twd_rate
-    avg_cost_unit = crypto.get('avg_cost', 0.0)
-
-    market_val_native = price_usd * crypto['amount']
-    cost_total_native = avg_cost_unit * crypto['amount']
-    market_val_twd = market_val_native * usd_to_twd_rate
-
-    total_crypto_value_twd += market_val_twd
-    total_invested_twd_display += (cost_total_native * usd_to_twd_rate)
-
-    pnl_val_native = market_val_native - cost_total_native
-    pnl_pct = (pnl_val_native / cost_total_native * 100) if cost_total_native > 0 else 0.0
-
-    chart_ticker = f"{crypto.get('symbol', '').upper()}-USD" if crypto.get('symbol') else None
-
-    all_assets_data.append({
-        "Type": "Crypto", "ID": crypto['id'], "Name": crypto.get('name', crypto['id']).title(),
-        "Qty": crypto['amount'], "Currency": "USD", "Price_Native": price_usd,
-        "Cost_Unit": avg_cost_unit, "Cost_Total": cost_total_native,
-        "Market_Val_Native": market_val_native, "PnL_Val": pnl_val_native,
-        "PnL_Pct": pnl_pct, "Market_Val_TWD": market_val_twd,
-        "Chart_Ticker": chart_ticker
-    })
-
-total_net_worth = total_stock_value_twd + total_crypto_value_twd
-unrealized_pnl_twd = total_net_worth - total_invested_twd_display
-total_roi = (unrealized_pnl_twd / total_invested_twd_display * 100) if total_invested_twd_display > 0 else 0.0
-
-realized_pnl_total_twd = 0.0
-for r in realized_pnl_data:
-    pnl = r.get('pnl', 0.0)
-    c = r.get('currency', 'USD')
-    if c == 'TWD':
-        realized_pnl_total_twd += pnl
-    else:
-        realized_pnl_total_twd += pnl * usd_to_twd_rate
-
-dm.update_history(total_net_worth)
+with timed("估值運算"):
+    state_key = content_hash(portfolio, asset_prices, usd_to_twd_rate, realized_pnl_data)
+    derived = derive_state(state_key, portfolio, asset_prices, usd_to_twd_rate, realized_pnl_data)
+all_assets_data = derived['assets']
+totals = derived['totals']
+total_stock_value_twd = totals['stock_value_twd']
+total_crypto_value_twd = totals['crypto_value_twd']
+total_invested_twd_display = totals['invested_twd']
+
+total_net_worth = totals['net_worth_twd']
+unrealized_pnl_twd = totals['unrealized_pnl_twd']
+total_roi = totals['roi_pct']
+
+realized_pnl_total_twd = derived['realized_total_twd']
+
+# 同一天內淨值沒變就不必再碰 history 檔；有持倉拿不到任何報價 (連舊價都沒有) 時淨值偏低，不寫入歷史
+missing_prices = val.missing_prices(portfolio, asset_prices)
+history_key = (datetime.date.today().isoformat(), round(total_net_worth, 2))
+if missing_prices:
+    st.warning("以下資產暫時沒有報價，本次淨值不寫入歷史: " + ", ".join(missing_prices))
+elif st.session_state.get('history_key') != history_key:
+    with timed("寫入歷史"):
+        dm.update_history(total_net_worth)
+    st.session_state.history_key = history_key
 
 # --------------------------
 # 前端介面
@@ -285,65 +392,16 @@ with tabs[0]:
 
             st.markdown("<hr style='margin: 0px; opacity: 0.2;'>", unsafe_allow_html=True)
 
-        # 詳細資訊
+        # 詳細資訊 (fragment: 切換 MA / 區間時只重跑這一塊)
         if st.session_state.selected_asset_idx is not None:
             if st.session_state.selected_asset_idx < len(all_assets_data):
                 idx = st.session_state.selected_asset_idx
-                asset = all_assets_data[idx]
-                cc = asset['Currency']
-
-                st.markdown(" ")
-                st.subheader(f"📌 {asset['Name']} 持倉分析")
-
-                with st.container(border=True):
-                    row1_a, row1_b, row1_c = st.columns(3)
-                    with row1_a: st.metric("個人報酬率", f"{asset['PnL_Pct']:.2f}%")
-                    with row1_b: st.metric(f"未實現損益 ({cc})", format_currency(asset['PnL_Val'], cc))
-                    with row1_c: st.metric(f"總投入成本 ({cc})", format_currency(asset['Cost_Total'], cc))
-                    st.divider()
-                    row2_d, row2_e, row2_f, row2_g = st.columns(4)
-                    with row2_d:
-                        st.write("**持有數量**");
-                        st.markdown(f"#### {format_qty_display(asset['Qty'], asset['Type'], cc)}")
-                    with row2_e:
-                        st.write(f"**平均單價 ({cc})**");
-                        st.markdown(f"#### {format_currency(asset['Cost_Unit'], cc)}")
-                    with row2_f:
-                        st.write(f"**目前市價 ({cc})**");
-                        st.markdown(f"#### {format_currency(asset['Price_Native'], cc)}")
-                    with row2_g:
-                        st.write("**庫存現值 (折合台幣)**");
-                        st.markdown(f"#### NT$ {asset['Market_Val_TWD']:,.0f}")
-
-                st.markdown("### 📉 歷史股價走勢")
-                c_ma1, c_ma2, c_ma3, c_range = st.columns([1, 1, 1, 4])
-                with c_ma1:
-                    show_ma5 = st.checkbox("MA5 (週)", value=True, key=f"ma5_{idx}")
-                with c_ma2:
-                    show_ma20 = st.checkbox("MA20 (月)", value=False, key=f"ma20_{idx}")
-                with c_ma3:
-                    show_ma60 = st.checkbox("MA60 (季)", value=False, key=f"ma60_{idx}")
-                with c_range:
-                    range_opts = ['1D', '1W', '1M', '1Y', 'All']
-                    selected_range = st.radio("選擇區間", range_opts, index=2, horizontal=True, key=f"range_sel_{idx}",
-                                              label_visibility="collapsed")
-
-                if asset['Chart_Ticker']:
-                    with st.spinner(f"正在載入 {selected_range} 走勢圖..."):
-                        df_hist = ah.get_historical_data(asset['Chart_Ticker'], selected_range)
-                        if df_hist is not None:
-                            fig_price = cp.plot_price_history(df_hist, f"{asset['Name']} ({selected_range})", show_ma5,
-                                                              show_ma20, show_ma60)
-                            st.plotly_chart(fig_price, use_container_width=True)
-                        else:
-                            st.warning("⚠️ 無法取得此資產的歷史數據")
-                else:
-                    st.info("此資產暫不支援走勢圖功能")
+                render_asset_detail(idx, all_assets_data[idx])
             else:
                 st.session_state.selected_asset_idx = None
 
-with tabs[1]:
-    history_data = dm.load_history()
+with tabs[1], timed("歷史走勢"):
+    history_data = dm.load_history_df()
     fig_hist = cp.plot_net_worth_history(history_data)
     st.plotly_chart(fig_hist, use_container_width=True)
 
@@ -353,37 +411,44 @@ with tabs[2]:
     else:
         df_real = pd.DataFrame(realized_pnl_data)
         st.dataframe(df_real, use_container_width=True, column_config={
-            "date": "日期", "name": "名稱", "type": "類型", "currency": "幣別",
+            "date": "日期", "name": "名稱", "asset_id": "代號", "type": "類型", "currency": "幣別",
             "sell_price": st.column_config.NumberColumn("賣出價", format="%.2f"),
             "buy_cost": st.column_config.NumberColumn("成本價", format="%.2f"),
             "pnl": st.column_config.NumberColumn("獲利金額", format="%.2f"),
             "roi": st.column_config.NumberColumn("報酬率", format="%.2f%%")
         })
 
-with tabs[3]:
+with tabs[3], timed("分布與記帳"):
     c1, c2 = st.columns(2)
     with c1:
         st.subheader("資產配置")
-        st.plotly_chart(cp.plot_asset_allocation_pie(total_stock_value_twd, total_crypto_value_twd),
-                        use_container_width=True)
+        st.plotly_chart(allocation_figure(total_stock_value_twd, total_crypto_value_twd), use_container_width=True)
     with c2:
-        st.subheader("支出分析")
-        tx_filtered = [tx for tx in transactions if (
-                    st.session_state.filters['month'] == '-- 全部 --' or tx.get('date', '').startswith(
-                st.session_state.filters['month']))]
-        exp_rates = {"TWD": 1.0}
-        for c, r in twd_rates.items():
-            if r > 0:
-                exp_rates[c] = 1 / r
-        st.plotly_chart(cp.plot_expense_pie(tx_filtered, exp_rates), use_container_width=True)
-    st.divider()
-    st.dataframe(pd.DataFrame(transactions), use_container_width=True)
+        render_expense_panel(transactions)
 
 # ==========================================
 # 側邊欄 (Sidebar)
 # ==========================================
 st.sidebar.header("資產管理")
-if st.sidebar.button("🔄 強制刷新"): st.cache_data.clear(); st.rerun()
+if st.sidebar.button("🔄 強制刷新"):
+    ah.clear_quote_cache(); st.cache_data.clear()
+    if BACKGROUND_REFRESH != 'off': pr.PriceRefresher().refresh()
+    st.rerun()
+if BACKGROUND_REFRESH != 'off':
+    snap = pr.load_latest_snapshot()
+    snap_age, class_ages = pr.snapshot_age(snap)
+    if snap_age is not None:
+        class_labels = {'tw_stock': '台股', 'us_stock': '美股', 'crypto': '加密貨幣', 'fx': '匯率'}
+        st.sidebar.caption(f"報價快照 v{snap['version']} · {snap_age:,.0f} 秒前更新",
+                           help=" / ".join(f"{class_labels.get(k, k)} {v:,.0f} 秒前" for k, v in class_ages.items()))
+st.sidebar.caption(f"股票報價: 快取 {len(quote_report['cached'])} 檔 / 批次 {len(quote_report['batch'])} 檔 / "
+                   f"個別補抓 {len(quote_report['fallback'])} 檔",
+                   help="個別補抓: " + (", ".join(quote_report['fallback']) or "無"))
+if quote_report.get('stale'):
+    stale_as_of = quote_report.get('as_of', {})
+    st.sidebar.caption(f"⏳ 使用舊報價 {len(quote_report['stale'])} 檔 (背景更新中)",
+                       help=", ".join(f"{k} ({time.strftime('%m-%d %H:%M', time.localtime(stale_as_of[k]))})"
+                                      if k in stale_as_of else k for k in quote_report['stale']))
 
 action_mode = st.sidebar.radio("模式", ["新增資產 (買入)", "賣出資產 (獲利結算)"], horizontal=True)
 
@@ -411,20 +476,14 @@ if action_mode == "新增資產 (買入)":
                         info = ah.validate_stock_symbol(final_ticker)
                     if info:
                         shares = int(s_qty * multiplier)
-                        total_cost = shares * s_price
                         portfolio = dm.load_portfolio()
                         exist = next((s for s in portfolio['stocks'] if s['symbol'] == info['symbol']), None)
-                        if exist:
-                            new_avg = calculate_new_avg_cost(exist['shares'], exist.get('avg_cost', 0), shares,
-                                                             total_cost)
-                            exist['shares'] += shares
-                            exist['avg_cost'] = new_avg
-                        else:
-                            portfolio['stocks'].append(
-                                {"symbol": info['symbol'], "name": info['name'], "currency": cost_curr,
-                                 "shares": shares, "avg_cost": s_price})
+                        if not exist:
+                            exist = {"symbol": info['symbol'], "name": info['name'], "currency": cost_curr,
+                                     "shares": 0, "avg_cost": 0.0}
+                            portfolio['stocks'].append(exist)
+                        buy_into_lots(exist, 'stocks', exist['symbol'], 'shares', shares, s_price)
                         dm.save_portfolio(portfolio)
-                        st.cache_data.clear();
                         st.success(f"已買入 {info['name']}");
                         time.sleep(1);
                         st.rerun()
@@ -445,18 +504,12 @@ if action_mode == "新增資產 (買入)":
                     if info:
                         portfolio = dm.load_portfolio()
                         exist = next((c for c in portfolio['crypto'] if c['id'] == info['id']), None)
-                        total_cost = c_qty * c_price
-                        if exist:
-                            new_avg = calculate_new_avg_cost(exist['amount'], exist.get('avg_cost', 0), c_qty,
-                                                             total_cost)
-                            exist['amount'] += c_qty
-                            exist['avg_cost'] = new_avg
-                        else:
-                            portfolio['crypto'].append(
-                                {"id": info['id'], "name": info['name'], "symbol": info['symbol'], "amount": c_qty,
-                                 "avg_cost": c_price})
+                        if not exist:
+                            exist = {"id": info['id'], "name": info['name'], "symbol": info['symbol'], "amount": 0,
+                                     "avg_cost": 0.0}
+                            portfolio['crypto'].append(exist)
+                        buy_into_lots(exist, 'crypto', exist['id'], 'amount', c_qty, c_price)
                         dm.save_portfolio(portfolio)
-                        st.cache_data.clear();
                         st.success(f"已買入 {info['name']}");
                         time.sleep(1);
                         st.rerun()
@@ -480,7 +533,8 @@ else:  # 賣出模式
             idx, asset_data = stock_map[sel_stock]
             curr = asset_data.get('currency', 'TWD')
             max_qty = asset_data['shares']
-            st.info(f"持有: {max_qty} 股 | 成本: {asset_data.get('avg_cost', 0)}")
+            st.info(f"持有: {max_qty} 股 | 成本: {asset_data.get('avg_cost', 0)} | "
+                    f"批次: {ll.open_lot_count(dm.load_lots(asset_data.get('lot_ref')))}")
 
             sell_mult = 1;
             sell_label = "股"
@@ -492,22 +546,21 @@ else:  # 賣出模式
             with st.form("sell_stock_form"):
                 sq = st.number_input(f"賣出數量 ({sell_label})", min_value=0.0, max_value=float(max_qty) / sell_mult)
                 sp = st.number_input(f"賣出單價 ({curr})", min_value=0.0, format="%.2f")
+                method_label = st.selectbox("成本計算", list(SELL_METHODS), key="sell_method_stock")
                 if st.form_submit_button("確認賣出"):
                     real_q = sq * sell_mult
                     if real_q > 0 and sp > 0:
-                        avg = asset_data.get('avg_cost', 0)
-                        pnl = (sp - avg) * real_q
-                        roi = (pnl / (avg * real_q) * 100) if avg > 0 else 0
-                        realized_pnl_data.append({
+                        method = SELL_METHODS[method_label]
+                        avg, pnl, roi = sell_from_lots(asset_data, 'stocks', asset_data['symbol'], 'shares',
+                                                       real_q, sp, method)
+                        dm.append_realized_pnl({
                             "date": datetime.date.today().strftime("%Y-%m-%d"),
-                            "name": asset_data.get('name', ''), "type": "Stock", "currency": curr,
+                            "name": asset_data.get('name', ''), "asset_id": asset_data['symbol'], "type": "Stock",
+                            "currency": curr, "method": method,
                             "sell_qty": real_q, "sell_price": sp, "buy_cost": avg, "pnl": pnl, "roi": roi
                         })
-                        dm.save_realized_pnl(realized_pnl_data)
-                        portfolio['stocks'][idx]['shares'] -= real_q
                         if portfolio['stocks'][idx]['shares'] <= 0: portfolio['stocks'].pop(idx)
                         dm.save_portfolio(portfolio);
-                        st.cache_data.clear();
                         st.rerun()
 
     with st.sidebar.expander("📉 賣出加密貨幣", expanded=False):
@@ -524,26 +577,26 @@ else:  # 賣出模式
             idx, asset_data = crypto_map[sel_crypto]
             curr = "USD"
             max_qty = asset_data['amount']
-            st.info(f"持有: {max_qty} | 成本: {asset_data.get('avg_cost', 0)}")
+            st.info(f"持有: {max_qty} | 成本: {asset_data.get('avg_cost', 0)} | "
+                    f"批次: {ll.open_lot_count(dm.load_lots(asset_data.get('lot_ref')))}")
 
             with st.form("sell_crypto_form"):
                 cq = st.number_input("賣出數量", min_value=0.0, max_value=float(max_qty))
                 cp_price = st.number_input("賣出單價 (USD)", min_value=0.0, format="%.6f")
+                method_label = st.selectbox("成本計算", list(SELL_METHODS), key="sell_method_crypto")
                 if st.form_submit_button("確認賣出"):
                     if cq > 0 and cp_price > 0:
-                        avg = asset_data.get('avg_cost', 0)
-                        pnl = (cp_price - avg) * cq
-                        roi = (pnl / (avg * cq) * 100) if avg > 0 else 0
-                        realized_pnl_data.append({
+                        method = SELL_METHODS[method_label]
+                        avg, pnl, roi = sell_from_lots(asset_data, 'crypto', asset_data['id'], 'amount',
+                                                       cq, cp_price, method)
+                        dm.append_realized_pnl({
                             "date": datetime.date.today().strftime("%Y-%m-%d"),
-                            "name": asset_data.get('name', ''), "type": "Crypto", "currency": curr,
+                            "name": asset_data.get('name', ''), "asset_id": asset_data['id'], "type": "Crypto",
+                            "currency": curr, "method": method,
                             "sell_qty": cq, "sell_price": cp_price, "buy_cost": avg, "pnl": pnl, "roi": roi
                         })
-                        dm.save_realized_pnl(realized_pnl_data)
-                        portfolio['crypto'][idx]['amount'] -= cq
                         if portfolio['crypto'][idx]['amount'] <= 0: portfolio['crypto'].pop(idx)
                         dm.save_portfolio(portfolio);
-                        st.cache_data.clear();
                         st.rerun()
 
 st.sidebar.divider()
@@ -558,9 +611,7 @@ with st.sidebar.expander("📒 記帳管理"):
             tc = st.text_input("幣別", "TWD")
             tcat = st.selectbox("類別", ['食物', '交通', '娛樂', '購物', '其他'])
             if st.form_submit_button("新增支出"):
-                transactions.append({"date": str(td), "amount": ta, "currency": tc, "category": tcat})
-                dm.save_transactions(transactions)
-                st.cache_data.clear();
+                dm.append_transaction({"date": str(td), "amount": ta, "currency": tc, "category": tcat})
                 st.rerun()
 
     with t_del:
@@ -575,9 +626,44 @@ with st.sidebar.expander("📒 記帳管理"):
                 if sel_opt:
                     idx_to_del = int(sel_opt.split(".")[0])
                     if 0 <= idx_to_del < len(transactions):
-                        transactions.pop(idx_to_del)
-                        dm.save_transactions(transactions)
-                        st.cache_data.clear()
+                        dm.delete_transaction(idx_to_del, transactions[idx_to_del])
                         st.success("已刪除！");
                         time.sleep(0.5);
-                        st.rerun()
\ No newline at end of file
+                        st.rerun()
+
+# --- 重新執行耗時 ---
+_timings["整頁合計"] = (time.perf_counter() - _run_started) * 1000
+metrics.observe('rerun_stage_seconds', _timings["整頁合計"] / 1000, stage="整頁合計")
+with st.sidebar.expander("⏱️ 重新執行耗時"):
+    st.caption(f"衍生狀態 key: {state_key[:10]}")
+    st.dataframe(pd.DataFrame({"階段": list(_timings), "毫秒": [round(v, 1) for v in _timings.values()]}),
+                 hide_index=True, use_container_width=True)
+    if st.session_state.get('fragment_timings'):
+        st.caption("最近一次局部重跑: " + ", ".join(f"{k} {v:.1f} ms"
+                                                for k, v in st.session_state.fragment_timings.items()))
+
+# --- 效能指標 (各 provider / 讀寫 / 圖表的耗時、失敗與快取命中率) ---
+metrics.serve()  # 有設定 PYASSET_METRICS_PORT 時提供 /metrics
+metrics.write_prometheus_file()  # 有設定 PYASSET_METRICS_FILE 時寫出
+with st.sidebar.expander("🩺 效能指標"):
+    report = metrics.summary()
+    if report["ops"]:
+        st.dataframe(pd.DataFrame(report["ops"]).round({"avg_ms": 1, "p95_ms": 1, "max_ms": 1}),
+                     hide_index=True, use_container_width=True)
+    if report["caches"]:
+        st.dataframe(pd.DataFrame(report["caches"]).round({"hit_ratio": 3}), hide_index=True,
+                     use_container_width=True)
+    limits, coalesced = ah.rate_limit_status()
+    st.dataframe(pd.DataFrame(limits).round({"tokens": 2, "waited_s": 2}), hide_index=True,
+                 use_container_width=True)
+    st.caption("合併的重複請求: " + ", ".join(f"{k} {v}" for k, v in coalesced.items()))
+    st.dataframe(pd.DataFrame(ah.circuit_status()).round({"retry_in_s": 0}), hide_index=True,
+                 use_container_width=True)
+    st.dataframe(pd.DataFrame(providers.provider_status()), hide_index=True, use_container_width=True)
+    for err in report["errors"]:
+        st.caption(f"⚠️ {err['op']} ({time.strftime('%H:%M:%S', time.localtime(err['time']))}): {err['error']}")
+    st.download_button("下載 Prometheus 格式", metrics.render_prometheus(), file_name="pyasset.prom",
+                       mime="text/plain")
+    if st.button("重設指標"):
+        metrics.reset()
+        st.rerun()
@@ -2,18 +2,71 @@ import json
 import os
 import csv
 import datetime
+import sqlite3
+import threading
+
+import metrics
 
 # 定義檔案名稱常數
 PORTFOLIO_FILE = 'portfolio.json'
 TRANSACTIONS_FILE = 'transactions.json'
 REALIZED_PNL_FILE = 'realized_pnl.json'
 HISTORY_FILE = 'history.csv'
+EXPENSE_ROLLUP_FILE = 'transactions.rollup.json'
+
+# --- 儲存後端 ---
+# 'file': JSON / CSV 檔案 (預設)；'sqlite': 存在 STORAGE_DB_FILE (先執行 python storage_sqlite.py migrate 匯入現有資料)
+STORAGE_BACKEND = os.environ.get('PYASSET_STORAGE', 'file')
+STORAGE_DB_FILE = 'pyasset.db'
+
+# --- 欄式儲存 (Parquet) ---
+# 設定 PYASSET_HISTORY_BACKEND=parquet 改用 Parquet 存淨值歷史 (需安裝 pyarrow)
+HISTORY_BACKEND = os.environ.get('PYASSET_HISTORY_BACKEND', 'csv')
+HISTORY_PARQUET_DIR = 'history_parquet'  # 依年份分區: history_parquet/year=2026/part-0.parquet
+PRICE_BARS_DIR = 'price_bars'  # 個股 K 線: price_bars/<interval>/<symbol>.parquet
+
+# --- 買入批次 ---
+# 批次與帳本狀態不放在 portfolio.json，每個資產一個檔案: lots/stocks/<symbol>.json、lots/crypto/<id>.json
+# (SQLite 後端存在 lots 表)；持倉只保留數量、平均成本與指向批次的 lot_ref
+LOTS_DIR = 'lots'
+LOT_ASSET_KEYS = {'stocks': 'symbol', 'crypto': 'id'}
+
+# --- 追加式日誌 (交易紀錄 / 已實現損益) ---
+# 新增與刪除只在 <名稱>.journal.jsonl 追加一行，累積超過門檻後由背景執行緒併回快照檔
+JOURNAL_COMPACT_THRESHOLD = 1000
+JOURNAL_FSYNC = True  # 每筆寫入後 fsync，斷電也不會遺失已回報成功的紀錄
+
+_columnar_ok = None
+_journal_lock = threading.RLock()
+_journal_state = {}  # {快照檔路徑: {"seq": 最後序號, "lines": 日誌行數}}
+_compacting = set()
+_expense_rollup = {}  # {"seq": 對應的日誌序號, "buckets": {(月份, 類別, 幣別): [金額合計, 筆數]}}
+
+
+def _db():
+    """目前使用 SQLite 後端時回傳 storage_sqlite 模組，否則回傳 None"""
+    if STORAGE_BACKEND == 'sqlite':
+        import storage_sqlite
+        return storage_sqlite
+    return None
 
 
 # --- 讀取與儲存投資組合 (Portfolio) ---
+@metrics.timed("data.load_portfolio")
 def load_portfolio():
+    data = _db().load_portfolio() if _db() else _read_portfolio_file()
+    moved = split_legacy_lots(data)
+    if moved:
+        # 舊版把批次存在持倉內，第一次讀到時搬到各資產的批次檔
+        for ref, state in moved.items():
+            save_lots(ref, state)
+        save_portfolio(data)
+    return data
+
+
+def _read_portfolio_file(path=None):
     try:
-        with open(PORTFOLIO_FILE, 'r', encoding='utf-8') as f:
+        with open(path or PORTFOLIO_FILE, 'r', encoding='utf-8') as f:
             data = json.load(f)
             # 確保基本的 key 存在，避免後續報錯
             if 'stocks' not in data: data['stocks'] = []
@@ -24,85 +77,673 @@ def load_portfolio():
         return {"stocks": [], "crypto": []}
 
 
+def load_portfolio_file(path):
+    """直接讀取指定的 portfolio JSON 檔 (不經儲存後端)，供批次處理多個投資組合"""
+    return _read_portfolio_file(path)
+
+
 def save_portfolio(data):
-    try:
-        with open(PORTFOLIO_FILE, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=4, ensure_ascii=False)
-    except IOError as e:
-        print(f"儲存 Portfolio 失敗: {e}")
+    with metrics.timer("data.save_portfolio") as t:
+        try:
+            if _db():
+                _db().save_portfolio(data)
+                return
+            with open(PORTFOLIO_FILE, 'w', encoding='utf-8') as f:
+                json.dump(data, f, indent=4, ensure_ascii=False)
+        except (IOError, sqlite3.Error) as e:
+            t.fail(e)
+            print(f"儲存 Portfolio 失敗: {e}")
 
 
-# --- 讀取與儲存交易紀錄 (Transactions) ---
-def load_transactions():
+# --- 買入批次 (每個資產獨立儲存) ---
+# 批次狀態格式: {"lots": [{"date", "qty", "price"}], "head": 已賣完的批次數, "scale": 成本倍率, "raw_cost": 原始總成本}
+def lot_ref(kind, asset_id):
+    """持倉的 lot_ref，例如 'stocks/2330.TW'"""
+    return f"{kind}/{str(asset_id).replace('/', '_')}"
+
+
+def _lots_path(ref):
+    return os.path.join(LOTS_DIR, *ref.split('/', 1)) + '.json'
+
+
+def _read_lots_file(ref):
     try:
-        with open(TRANSACTIONS_FILE, 'r', encoding='utf-8') as f:
+        with open(_lots_path(ref), 'r', encoding='utf-8') as f:
             return json.load(f)
     except (FileNotFoundError, json.JSONDecodeError):
-        return []
+        return None
+
+
+def load_lots(ref):
+    """讀取單一資產的批次狀態，沒有資料時回傳 None"""
+    if not ref:
+        return None
+    if _db():
+        return _db().load_lots(ref)
+    return _read_lots_file(ref)
+
+
+def save_lots(ref, state):
+    """只重寫這個資產的批次；已全部賣完 (沒有批次) 時刪除"""
+    with metrics.timer("data.save_lots") as t:
+        try:
+            if _db():
+                _db().save_lots(ref, state)
+                return
+            path = _lots_path(ref)
+            if not state or not state.get('lots'):
+                if os.path.exists(path):
+                    os.remove(path)
+                return
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(state, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except (IOError, sqlite3.Error) as e:
+            t.fail(e)
+            print(f"儲存批次失敗: {e}")
+
+
+def split_legacy_lots(portfolio):
+    """把舊版存在持倉內的 lots / lot_state 移出持倉並改記 lot_ref，回傳 {lot_ref: 批次狀態}"""
+    moved = {}
+    for kind, key in LOT_ASSET_KEYS.items():
+        for holding in portfolio.get(kind, []):
+            if 'lots' not in holding and 'lot_state' not in holding:
+                continue
+            lots = holding.pop('lots', None) or []
+            state = holding.pop('lot_state', None)
+            if not state:
+                # 沒有 lot_state 的舊資料 price 就是實際成本，不含已賣完的批次
+                lots = [{"date": lot.get("date"), "qty": lot["qty"], "price": lot["price"]}
+                        for lot in lots if lot["qty"] > 0]
+                state = {"raw_cost": sum(lot["qty"] * lot["price"] for lot in lots)}
+            ref = holding['lot_ref'] = lot_ref(kind, holding[key])
+            moved[ref] = {"lots": lots, "head": state.get('head', 0), "scale": state.get('scale', 1.0) or 1.0,
+                          "raw_cost": state.get('raw_cost', 0.0)}
+    return moved
+
+
+def _read_lot_files():
+    lots = {}
+    for kind in LOT_ASSET_KEYS:
+        folder = os.path.join(LOTS_DIR, kind)
+        if not os.path.isdir(folder):
+            continue
+        for name in sorted(os.listdir(folder)):
+            if name.endswith('.json'):
+                ref = f"{kind}/{name[:-len('.json')]}"
+                state = _read_lots_file(ref)
+                if state:
+                    lots[ref] = state
+    return lots
+
+
+# --- 追加式日誌 ---
+# 快照檔格式: {"journal_seq": n, "records": [...]}，舊版純 list 視為 journal_seq = 0
+# 日誌每行: {"seq": n, "op": "add", "record": {...}} 或 {"seq": n, "op": "del", "index": i}
+# 重播時略過 seq <= journal_seq 的行，所以壓縮中途當機也不會重複套用
+def _journal_path(snapshot_file):
+    return os.path.splitext(snapshot_file)[0] + '.journal.jsonl'
+
+
+def _read_snapshot(snapshot_file):
+    try:
+        with open(snapshot_file, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return 0, []
+    if isinstance(data, dict):
+        return data.get('journal_seq', 0), data.get('records', [])
+    return 0, data
+
+
+def _write_snapshot(snapshot_file, seq, records):
+    tmp_path = snapshot_file + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({"journal_seq": seq, "records": records}, f, indent=4, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, snapshot_file)
+
+
+def _read_journal(snapshot_file, limit=None):
+    """回傳日誌中的操作列表；最後一行若寫到一半 (當機) 則忽略"""
+    entries = []
+    try:
+        with open(_journal_path(snapshot_file), 'rb') as f:
+            data = f.read() if limit is None else f.read(limit)
+    except FileNotFoundError:
+        return entries
+    for line in data.splitlines():
+        try:
+            entries.append(json.loads(line))
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            continue
+    return entries
+
+
+def _replay(records, entries, after_seq):
+    records = list(records)
+    last_seq = after_seq
+    for entry in entries:
+        if entry.get('seq', 0) <= after_seq:
+            continue
+        if entry.get('op') == 'add':
+            records.append(entry['record'])
+        elif entry.get('op') == 'del' and 0 <= entry.get('index', -1) < len(records):
+            records.pop(entry['index'])
+        last_seq = max(last_seq, entry['seq'])
+    return records, last_seq
+
+
+def _journal_load(snapshot_file):
+    with _journal_lock:
+        snap_seq, records = _read_snapshot(snapshot_file)
+        entries = _read_journal(snapshot_file)
+    records, _ = _replay(records, entries, snap_seq)
+    return records
+
+
+def _state(snapshot_file):
+    """第一次使用時掃描一次日誌，之後序號與行數都在記憶體中遞增"""
+    state = _journal_state.get(snapshot_file)
+    if state is None:
+        snap_seq, _ = _read_snapshot(snapshot_file)
+        entries = _read_journal(snapshot_file)
+        seq = max([snap_seq] + [e.get('seq', 0) for e in entries])
+        state = {"seq": seq, "lines": len(entries)}
+        _journal_state[snapshot_file] = state
+    return state
+
+
+def _journal_append(snapshot_file, entry):
+    """O(1) 寫入：只在日誌尾端追加一行，回傳這一行的序號"""
+    with _journal_lock:
+        state = _state(snapshot_file)
+        state["seq"] += 1
+        line = json.dumps(dict(entry, seq=state["seq"]), ensure_ascii=False) + "\n"
+        with open(_journal_path(snapshot_file), 'a', encoding='utf-8') as f:
+            f.write(line)
+            f.flush()
+            if JOURNAL_FSYNC:
+                os.fsync(f.fileno())
+        state["lines"] += 1
+        need_compact = state["lines"] >= JOURNAL_COMPACT_THRESHOLD and snapshot_file not in _compacting
+        if need_compact:
+            _compacting.add(snapshot_file)
+    if need_compact:
+        threading.Thread(target=_compact_in_background, args=(snapshot_file,), daemon=True).start()
+    return state["seq"]
+
+
+def _compact_in_background(snapshot_file):
+    try:
+        compact_journal(snapshot_file)
+    except (IOError, OSError) as e:
+        print(f"日誌壓縮失敗: {e}")
+    finally:
+        with _journal_lock:
+            _compacting.discard(snapshot_file)
+
+
+@metrics.timed("data.compact_journal")
+def compact_journal(snapshot_file):
+    """
+    把日誌併回快照檔
+    重播在鎖外進行，只有最後替換檔案時短暫持鎖，不會卡住新的寫入
+    """
+    journal_file = _journal_path(snapshot_file)
+    with _journal_lock:
+        try:
+            size = os.path.getsize(journal_file)
+        except FileNotFoundError:
+            return
+        snap_seq, records = _read_snapshot(snapshot_file)
+
+    entries = _read_journal(snapshot_file, limit=size)
+    records, last_seq = _replay(records, entries, snap_seq)
+
+    with _journal_lock:
+        # 期間若有人整份覆寫過 (save_*)，這次的結果已過時，直接放棄
+        if _read_snapshot(snapshot_file)[0] != snap_seq or os.path.getsize(journal_file) < size:
+            return
+        _write_snapshot(snapshot_file, last_seq, records)
+        # 保留壓縮期間新追加的部分
+        with open(journal_file, 'rb') as f:
+            f.seek(size)
+            tail = f.read()
+        tmp_path = journal_file + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(tail)
+        os.replace(tmp_path, journal_file)
+        state = _state(snapshot_file)
+        state["lines"] = len(tail.splitlines())
+
+
+def _journal_save_all(snapshot_file, data):
+    """整份覆寫 (舊版 save_* 介面)：寫入新快照並清空日誌"""
+    with _journal_lock:
+        state = _state(snapshot_file)
+        _write_snapshot(snapshot_file, state["seq"], data)
+        open(_journal_path(snapshot_file), 'w').close()
+        state["lines"] = 0
+
+
+# --- 讀取與儲存交易紀錄 (Transactions) ---
+@metrics.timed("data.load_transactions")
+def load_transactions():
+    if _db():
+        return _db().load_transactions()
+    return _journal_load(TRANSACTIONS_FILE)
 
 
 def save_transactions(data):
+    with metrics.timer("data.save_transactions") as t:
+        try:
+            if _db():
+                _db().save_transactions(data)
+                return
+            with _journal_lock:
+                _journal_save_all(TRANSACTIONS_FILE, data)
+                _rebuild_expense_rollup(data)
+        except (IOError, sqlite3.Error) as e:
+            t.fail(e)
+            print(f"儲存 Transactions 失敗: {e}")
+
+
+def append_transaction(record):
+    with metrics.timer("data.append_transaction") as t:
+        try:
+            if _db():
+                _db().append_transaction(record)
+                return
+            with _journal_lock:
+                _load_expense_rollup_file()
+                prev_seq = _state(TRANSACTIONS_FILE)["seq"]
+                seq = _journal_append(TRANSACTIONS_FILE, {"op": "add", "record": record})
+                _rollup_apply(prev_seq, seq, record, 1)
+        except (IOError, sqlite3.Error) as e:
+            t.fail(e)
+            print(f"儲存 Transactions 失敗: {e}")
+
+
+def delete_transaction(index, record=None):
+    """record: 被刪除的那筆紀錄；有提供時直接從彙總索引扣除，否則下次讀取時重建索引"""
+    with metrics.timer("data.delete_transaction") as t:
+        try:
+            if _db():
+                _db().delete_transaction(index)
+                return
+            with _journal_lock:
+                _load_expense_rollup_file()
+                prev_seq = _state(TRANSACTIONS_FILE)["seq"]
+                seq = _journal_append(TRANSACTIONS_FILE, {"op": "del", "index": index})
+                _rollup_apply(prev_seq, seq, record, -1)
+        except (IOError, sqlite3.Error) as e:
+            t.fail(e)
+            print(f"儲存 Transactions 失敗: {e}")
+
+
+# --- 支出彙總索引 (月份 x 類別 x 幣別) ---
+# 新增 / 刪除支出時就地加減對應的桶，圖表與月份篩選直接讀合計值，不必每次掃描全部交易
+# 索引記錄自己對應的日誌序號，與日誌對不上時 (例如外部改過檔案) 會整份重建
+def _rollup_key(tx):
+    return tx.get('date', '')[:7], tx.get('category', '其他'), tx.get('currency', 'TWD')
+
+
+def _write_expense_rollup():
+    data = {"journal_seq": _expense_rollup["seq"],
+            "buckets": [list(key) + value for key, value in _expense_rollup["buckets"].items()]}
+    tmp_path = EXPENSE_ROLLUP_FILE + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, EXPENSE_ROLLUP_FILE)
+
+
+def _rebuild_expense_rollup(records=None):
+    if records is None:
+        records = _journal_load(TRANSACTIONS_FILE)
+    buckets = {}
+    for tx in records:
+        bucket = buckets.setdefault(_rollup_key(tx), [0.0, 0])
+        bucket[0] += float(tx.get('amount', 0) or 0)
+        bucket[1] += 1
+    _expense_rollup.update(seq=_state(TRANSACTIONS_FILE)["seq"], buckets=buckets)
+    _write_expense_rollup()
+
+
+def _load_expense_rollup_file():
+    """讀入索引檔；與目前日誌序號對不上就重建"""
+    seq = _state(TRANSACTIONS_FILE)["seq"]
+    if _expense_rollup.get("seq") == seq:
+        return
     try:
-        with open(TRANSACTIONS_FILE, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=4, ensure_ascii=False)
-    except IOError as e:
-        print(f"儲存 Transactions 失敗: {e}")
+        with open(EXPENSE_ROLLUP_FILE, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get("journal_seq") == seq:
+            _expense_rollup.update(seq=seq, buckets={tuple(b[:3]): [b[3], b[4]] for b in data["buckets"]})
+            return
+    except (FileNotFoundError, json.JSONDecodeError, KeyError, IndexError):
+        pass
+    _rebuild_expense_rollup()
+
+
+def _rollup_apply(prev_seq, seq, record, sign):
+    """把一筆新增 (sign=1) 或刪除 (sign=-1) 套用到索引；索引原本就過期或缺少紀錄時留待下次重建"""
+    if _expense_rollup.get("seq") != prev_seq or record is None:
+        _expense_rollup.clear()
+        return
+    key = _rollup_key(record)
+    bucket = _expense_rollup["buckets"].setdefault(key, [0.0, 0])
+    bucket[0] += sign * float(record.get('amount', 0) or 0)
+    bucket[1] += sign
+    if bucket[1] <= 0:
+        del _expense_rollup["buckets"][key]
+    _expense_rollup["seq"] = seq
+    _write_expense_rollup()
+
+
+@metrics.timed("data.load_expense_rollup")
+def load_expense_rollup(month=None):
+    """
+    回傳預先彙總好的支出 [{'month':..., 'category':..., 'currency':..., 'total':..., 'count':...}]
+    month: 'YYYY-MM'，只取該月份的桶
+    """
+    if _db():
+        return _db().load_expense_rollup(month)
+    with _journal_lock:
+        _load_expense_rollup_file()
+        buckets = list(_expense_rollup["buckets"].items())
+    return [{'month': m, 'category': c, 'currency': cur, 'total': total, 'count': count}
+            for (m, c, cur), (total, count) in buckets if not month or m == month]
+
+
+def expense_months():
+    """有支出紀錄的月份 ('YYYY-MM')，新到舊；直接讀彙總索引的桶，不掃描交易"""
+    if _db():
+        return _db().expense_months()
+    with _journal_lock:
+        _load_expense_rollup_file()
+        months = {m for m, _, _ in _expense_rollup["buckets"]}
+    return sorted(months, reverse=True)
 
 
 # --- 讀取與儲存已實現損益 (Realized PnL) ---
+@metrics.timed("data.load_realized_pnl")
 def load_realized_pnl():
-    try:
-        with open(REALIZED_PNL_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
-        return []
+    if _db():
+        return _db().load_realized_pnl()
+    return _journal_load(REALIZED_PNL_FILE)
 
 
 def save_realized_pnl(data):
-    try:
-        with open(REALIZED_PNL_FILE, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=4, ensure_ascii=False)
-    except IOError as e:
-        print(f"儲存損益失敗: {e}")
+    with metrics.timer("data.save_realized_pnl") as t:
+        try:
+            if _db():
+                _db().save_realized_pnl(data)
+                return
+            _journal_save_all(REALIZED_PNL_FILE, data)
+        except (IOError, sqlite3.Error) as e:
+            t.fail(e)
+            print(f"儲存損益失敗: {e}")
+
+
+def append_realized_pnl(record):
+    with metrics.timer("data.append_realized_pnl") as t:
+        try:
+            if _db():
+                _db().append_realized_pnl(record)
+                return
+            _journal_append(REALIZED_PNL_FILE, {"op": "add", "record": record})
+        except (IOError, sqlite3.Error) as e:
+            t.fail(e)
+            print(f"儲存損益失敗: {e}")
+
+
+def delete_realized_pnl(index):
+    with metrics.timer("data.delete_realized_pnl") as t:
+        try:
+            if _db():
+                _db().delete_realized_pnl(index)
+                return
+            _journal_append(REALIZED_PNL_FILE, {"op": "del", "index": index})
+        except (IOError, sqlite3.Error) as e:
+            t.fail(e)
+            print(f"儲存損益失敗: {e}")
+
+
+# --- 欄式儲存工具 ---
+def columnar_available():
+    """檢查 pyarrow 是否可用 (只檢查一次)"""
+    global _columnar_ok
+    if _columnar_ok is None:
+        try:
+            import pyarrow  # noqa: F401
+            _columnar_ok = True
+        except ImportError:
+            print("未安裝 pyarrow，改用 CSV 儲存歷史資料")
+            _columnar_ok = False
+    return _columnar_ok
+
+
+def _use_parquet_history():
+    return HISTORY_BACKEND == 'parquet' and columnar_available()
+
+
+def _write_parquet(df, path):
+    """先寫暫存檔再取代，避免寫到一半中斷留下壞檔"""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = path + '.tmp'
+    df.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+
+def _history_partition(year):
+    return os.path.join(HISTORY_PARQUET_DIR, f"year={year}", "part-0.parquet")
+
+
+def _read_history_csv():
+    import pandas as pd
+    if not os.path.exists(HISTORY_FILE):
+        return pd.DataFrame({'Date': pd.Series(dtype='datetime64[ns]'), 'NetWorth': pd.Series(dtype='float64')})
+    df = pd.read_csv(HISTORY_FILE, header=None, names=['Date', 'NetWorth'], usecols=[0, 1],
+                     dtype={'NetWorth': 'float64'}, parse_dates=['Date'])
+    return df.dropna()
+
+
+@metrics.timed("data.migrate_history_to_parquet")
+def migrate_history_to_parquet():
+    """把現有的 history.csv 轉成依年份分區的 Parquet"""
+    df = _read_history_csv()
+    for year, part in df.groupby(df['Date'].dt.year):
+        _write_parquet(part.sort_values('Date').reset_index(drop=True), _history_partition(int(year)))
+
+
+def _upsert_history_parquet(today, total_net_worth):
+    """只重寫今年的分區 (最多 366 筆)，與歷史總長度無關"""
+    import pandas as pd
+    if not os.path.isdir(HISTORY_PARQUET_DIR):
+        migrate_history_to_parquet()
+    path = _history_partition(today.year)
+    today_ts = pd.Timestamp(today)
+    if os.path.exists(path):
+        part = pd.read_parquet(path)
+        same_day = part['Date'] == today_ts
+        if same_day.any() and float(part.loc[same_day, 'NetWorth'].iloc[-1]) == float(total_net_worth):
+            return  # 數值沒變，不寫檔
+        part = part[~same_day]
+    else:
+        part = pd.DataFrame({'Date': pd.Series(dtype='datetime64[ns]'), 'NetWorth': pd.Series(dtype='float64')})
+    row = pd.DataFrame({'Date': [today_ts], 'NetWorth': [float(total_net_worth)]})
+    part = pd.concat([part, row], ignore_index=True).sort_values('Date')
+    _write_parquet(part, path)
+
+
+@metrics.timed("data.load_history_df")
+def load_history_df(start=None, end=None):
+    """
+    直接讀成型別正確的 DataFrame (Date: datetime64, NetWorth: float64)
+    start/end 可給日期字串，Parquet 模式下會下推到分區與 row group 篩選
+    """
+    import pandas as pd
+    if _db():
+        rows = _db().load_history_rows(start, end)
+        return pd.DataFrame({'Date': pd.to_datetime([r[0] for r in rows]),
+                             'NetWorth': pd.Series([r[1] for r in rows], dtype='float64')})
+    return _load_history_file_df(start, end)
+
+
+def _load_history_file_df(start=None, end=None):
+    import pandas as pd
+    start = pd.Timestamp(start) if start is not None else None
+    end = pd.Timestamp(end) if end is not None else None
+
+    if _use_parquet_history():
+        if not os.path.isdir(HISTORY_PARQUET_DIR):
+            migrate_history_to_parquet()
+        filters = []
+        if start is not None:
+            filters += [('year', '>=', start.year), ('Date', '>=', start)]
+        if end is not None:
+            filters += [('year', '<=', end.year), ('Date', '<=', end)]
+        try:
+            df = pd.read_parquet(HISTORY_PARQUET_DIR, columns=['Date', 'NetWorth'], filters=filters or None)
+        except (FileNotFoundError, OSError, ValueError):
+            df = _read_history_csv().iloc[0:0]
+    else:
+        df = _read_history_csv()
+        if start is not None:
+            df = df[df['Date'] >= start]
+        if end is not None:
+            df = df[df['Date'] <= end]
+    return df.sort_values('Date').reset_index(drop=True)
+
+
+# --- 個股 K 線欄式儲存 ---
+def _bars_path(symbol, interval):
+    safe_symbol = symbol.replace('/', '_')
+    return os.path.join(PRICE_BARS_DIR, interval, f"{safe_symbol}.parquet")
+
+
+def load_price_bars(symbol, interval, since=None):
+    """讀取 K 線 (ts 為 UTC 秒)，since 會下推成 Parquet 篩選條件"""
+    import pandas as pd
+    path = _bars_path(symbol, interval)
+    if not os.path.exists(path):
+        return pd.DataFrame({'ts': pd.Series(dtype='int64'), 'Close': pd.Series(dtype='float64'),
+                             'Volume': pd.Series(dtype='float64')})
+    filters = [('ts', '>=', int(since))] if since is not None else None
+    return pd.read_parquet(path, columns=['ts', 'Close', 'Volume'], filters=filters)
+
+
+def upsert_price_bars(symbol, interval, bars, min_ts=None):
+    """合併新的 K 線 (相同 ts 以新資料為準)，min_ts 之前的舊資料一併捨棄"""
+    import pandas as pd
+    merged = pd.concat([load_price_bars(symbol, interval), bars[['ts', 'Close', 'Volume']]], ignore_index=True)
+    merged = merged.drop_duplicates('ts', keep='last').sort_values('ts')
+    if min_ts is not None:
+        merged = merged[merged['ts'] >= min_ts]
+    _write_parquet(merged.astype({'ts': 'int64', 'Close': 'float64', 'Volume': 'float64'}),
+                   _bars_path(symbol, interval))
 
 
 # --- 更新與讀取歷史淨值 (History CSV) ---
-def update_history(total_net_worth):
+def update_history(total_net_worth, history_file=None):
     """
     每天只記錄一筆最新的總資產
+    history_file: 指定 CSV 路徑時一律寫入該檔 (不經儲存後端)
     """
-    today_str = datetime.date.today().strftime("%Y-%m-%d")
-    history_data = []
+    with metrics.timer("data.update_history") as t:
+        if history_file:
+            _upsert_history_csv(history_file, total_net_worth)
+            return
 
-    # 1. 讀取現有紀錄
-    if os.path.exists(HISTORY_FILE):
-        try:
-            with open(HISTORY_FILE, 'r', encoding='utf-8', newline='') as f:
-                reader = csv.reader(f)
-                history_data = list(reader)
-        except Exception:
-            history_data = []
+        if _db():
+            try:
+                _db().update_history(datetime.date.today().strftime("%Y-%m-%d"), total_net_worth)
+            except sqlite3.Error as e:
+                t.fail(e)
+                print(f"寫入歷史失敗: {e}")
+            return
 
-    # 2. 檢查今天是否已經記過 (若有，則更新最後一筆；若無，則新增)
-    # 格式: [Date, NetWorth]
-    new_entry = [today_str, str(total_net_worth)]
+        if _use_parquet_history():
+            try:
+                _upsert_history_parquet(datetime.date.today(), total_net_worth)
+            except (IOError, OSError) as e:
+                t.fail(e)
+                print(f"寫入歷史失敗: {e}")
+            return
 
-    if history_data and history_data[-1][0] == today_str:
-        history_data[-1] = new_entry  # 更新今日數據
-    else:
-        history_data.append(new_entry)  # 新增今日數據
+        _upsert_history_csv(HISTORY_FILE, total_net_worth)
+
+
+def _upsert_history_csv(path, total_net_worth):
+    today_str = datetime.date.today().strftime("%Y-%m-%d")
+    new_line = f"{today_str},{total_net_worth}\n"
 
-    # 3. 寫回檔案
     try:
-        with open(HISTORY_FILE, 'w', encoding='utf-8', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerows(history_data)
+        # 1. 只讀檔尾最後一筆，不論歷史多長都是固定成本
+        last = _read_last_history_row(path) if os.path.exists(path) else None
+
+        # 2. 檢查今天是否已經記過 (若有，則原地改寫最後一筆；若無，則新增)
+        # 格式: [Date, NetWorth]
+        if last is None:
+            with open(path, 'a', encoding='utf-8', newline='') as f:
+                f.write(new_line)
+            return
+
+        row, line_start, ends_with_newline = last
+        if row and row[0] == today_str:
+            try:
+                if float(row[1]) == float(total_net_worth):
+                    return  # 數值沒變，不寫檔
+            except (IndexError, ValueError):
+                pass
+            with open(path, 'r+b') as f:
+                f.seek(line_start)
+                f.write(new_line.encode('utf-8'))
+                f.truncate()
+        else:
+            with open(path, 'a', encoding='utf-8', newline='') as f:
+                f.write(new_line if ends_with_newline else "\n" + new_line)
     except IOError as e:
+        metrics.record_error("data.update_history", e)
         print(f"寫入歷史失敗: {e}")
 
 
+def _read_last_history_row(path=None):
+    """
+    從檔尾往回讀出最後一列
+    回傳 (row, 該列起始位置, 檔案是否以換行結尾)；空檔回傳 None
+    """
+    with open(path or HISTORY_FILE, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        block = 1024
+        while True:
+            start = max(size - block, 0)
+            f.seek(start)
+            tail = f.read(size - start)
+            body = tail.rstrip(b'\r\n')
+            if not body and start == 0:
+                return None
+            nl = body.rfind(b'\n')
+            if nl >= 0 or start == 0:
+                line = body[nl + 1:].decode('utf-8')
+                row = next(csv.reader([line]), [])
+                return row, start + nl + 1, tail.endswith(b'\n')
+            block *= 4
+
+
+@metrics.timed("data.load_history")
 def load_history():
     """回傳 DataFrame 所需的 dict list"""
+    if _db() or _use_parquet_history():
+        df = load_history_df()
+        return [{"Date": d.strftime("%Y-%m-%d"), "NetWorth": float(v)} for d, v in zip(df['Date'], df['NetWorth'])]
+
     data = []
     if os.path.exists(HISTORY_FILE):
         try:
@@ -113,4 +754,67 @@ def load_history():
                         data.append({"Date": row[0], "NetWorth": float(row[1])})
         except Exception:
             pass
-    return data
\ No newline at end of file
+    return data
+
+
+# --- 查詢 (日期區間 / 類別篩選 / 分組加總) ---
+def query_transactions(start=None, end=None, month=None, category=None, currency=None):
+    """
+    依條件篩選交易紀錄；SQLite 後端走索引查詢
+    start/end: 'YYYY-MM-DD'；month: 'YYYY-MM'
+    """
+    if _db():
+        return _db().query_transactions(start, end, month, category, currency)
+
+    def keep(tx):
+        date = tx.get('date', '')
+        return ((not start or date >= str(start)) and (not end or date <= str(end))
+                and (not month or date.startswith(month))
+                and (not category or tx.get('category', '其他') == category)
+                and (not currency or tx.get('currency', 'TWD') == currency))
+
+    return [tx for tx in load_transactions() if keep(tx)]
+
+
+def rollup_transactions(by=('month', 'category', 'currency'), start=None, end=None, month=None, category=None,
+                        currency=None):
+    """
+    依欄位分組加總金額，回傳 [{'month':..., 'category':..., 'currency':..., 'total':..., 'count':...}]
+    可用欄位: date, month, category, currency
+    """
+    if _db():
+        return _db().rollup_transactions(by, start, end, month, category, currency)
+
+    groups = {}
+    for tx in query_transactions(start, end, month, category, currency):
+        fields = {'date': tx.get('date', ''), 'month': tx.get('date', '')[:7],
+                  'category': tx.get('category', '其他'), 'currency': tx.get('currency', 'TWD')}
+        key = tuple(fields[c] for c in by)
+        bucket = groups.setdefault(key, [0.0, 0])
+        bucket[0] += float(tx.get('amount', 0) or 0)
+        bucket[1] += 1
+    return [dict(zip(by, key), total=total, count=count) for key, (total, count) in groups.items()]
+
+
+def query_realized_pnl(start=None, end=None, asset_id=None, currency=None):
+    if _db():
+        return _db().query_realized_pnl(start, end, asset_id, currency)
+    return [r for r in load_realized_pnl()
+            if (not start or r.get('date', '') >= str(start)) and (not end or r.get('date', '') <= str(end))
+            and (not asset_id or (r.get('asset_id') or r.get('name')) == asset_id)
+            and (not currency or r.get('currency', 'USD') == currency)]
+
+
+def export_file_data():
+    """讀出 JSON / CSV (或 Parquet) 檔案中的全部資料，不論目前使用哪個後端；供遷移至 SQLite 使用"""
+    history = _load_history_file_df()
+    portfolio = _read_portfolio_file()
+    lots = _read_lot_files()
+    lots.update(split_legacy_lots(portfolio))
+    return {
+        'portfolio': portfolio,
+        'lots': lots,
+        'transactions': _journal_load(TRANSACTIONS_FILE),
+        'realized_pnl': _journal_load(REALIZED_PNL_FILE),
+        'history': [(d.strftime("%Y-%m-%d"), float(v)) for d, v in zip(history['Date'], history['NetWorth'])],
+    }
@@ -0,0 +1,335 @@
+import re
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+import metrics
+
+# --- 技術指標 ---
+# 名稱格式: SMA<n>、EMA<n>、BB<n> (布林通道, 2 倍標準差)、RSI<n>、MACD (12/26/9)、VWAP
+# 結果依 (代號, K 線週期, 第一根 K 線時間) 快取，並以最後一根 K 線判斷是否仍有效；
+# 新 K 線到來 (或最後一根盤中更新) 時只往後推算新增的部分，不整段重算
+# EMA / RSI / MACD / VWAP 是遞迴的，結果取決於起始點，所以起點不同的區間各自計算，
+# 輸出只由傳入的資料決定 (與 compute_indicators 相同)，不受先前快取了什麼影響
+INDICATOR_CACHE_SIZE = 32
+BB_STD_MULT = 2.0
+MACD_FAST, MACD_SLOW, MACD_SIGNAL = 12, 26, 9
+
+_NAME_RE = re.compile(r"^(SMA|EMA|BB|RSI)(\d+)$")
+
+_cache = OrderedDict()  # {(symbol, interval, 第一根 K 線的 ns 時間): _Entry}
+_lock = threading.Lock()
+
+
+# --- 向量化計算 (整段) ---
+def sma(close, windows):
+    """一次 cumsum 算出多個視窗的簡單移動平均，回傳 {視窗: 陣列}"""
+    close = np.asarray(close, dtype=float)
+    cs = np.concatenate(([0.0], np.cumsum(close)))
+    out = {}
+    for w in windows:
+        values = np.full(len(close), np.nan)
+        if len(close) >= w:
+            values[w - 1:] = (cs[w:] - cs[:-w]) / w
+        out[w] = values
+    return out
+
+
+def ema(close, span):
+    """指數移動平均 (alpha = 2 / (span + 1)，以第一筆為起點)"""
+    return pd.Series(np.asarray(close, dtype=float)).ewm(span=span, adjust=False).mean().to_numpy()
+
+
+def bollinger(close, windows, mult=BB_STD_MULT):
+    """以 cumsum / 平方和 cumsum 算出各視窗的 (中線, 上軌, 下軌)"""
+    close = np.asarray(close, dtype=float)
+    mids = sma(close, windows)
+    cs2 = np.concatenate(([0.0], np.cumsum(close * close)))
+    out = {}
+    for w in windows:
+        var = np.full(len(close), np.nan)
+        if len(close) >= w:
+            var[w - 1:] = (cs2[w:] - cs2[:-w]) / w - mids[w][w - 1:] ** 2
+        std = np.sqrt(np.clip(var, 0.0, None))
+        out[w] = (mids[w], mids[w] + mult * std, mids[w] - mult * std)
+    return out
+
+
+def _rsi_from_averages(avg_gain, avg_loss):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rsi = 100 - 100 / (1 + avg_gain / avg_loss)
+    return np.where(avg_loss == 0, np.where(avg_gain > 0, 100.0, 50.0), rsi)
+
+
+def _ema_step(values, alpha, prev):
+    """串流版 EMA：從前一個值接著往後算"""
+    out = np.empty(len(values))
+    for i, x in enumerate(values):
+        prev = x if prev is None or np.isnan(prev) else prev + alpha * (x - prev)
+        out[i] = prev
+    return out
+
+
+# --- 各指標的整段計算與增量延伸 ---
+# compute(close, volume) 回傳 {欄位: 陣列}；extend(arrays, close, volume, p) 回傳第 p 筆之後的新值
+# 底線開頭的欄位是遞迴型指標的中間狀態，保留在快取內供下次延伸使用
+class _SMA:
+    def __init__(self, windows):
+        self.windows = sorted(windows)
+        self.columns = [f"SMA{w}" for w in self.windows]
+
+    def compute(self, close, volume):
+        return {f"SMA{w}": v for w, v in sma(close, self.windows).items()}
+
+    def extend(self, arrays, close, volume, p):
+        lo = max(0, p - self.windows[-1] + 1)
+        return {f"SMA{w}": v[p - lo:] for w, v in sma(close[lo:], self.windows).items()}
+
+
+class _BB:
+    def __init__(self, windows):
+        self.windows = sorted(windows)
+        self.columns = [f"BB{w}_{part}" for w in self.windows for part in ("MID", "UPPER", "LOWER")]
+
+    def _named(self, bands, offset=0):
+        out = {}
+        for w, (mid, upper, lower) in bands.items():
+            out.update({f"BB{w}_MID": mid[offset:], f"BB{w}_UPPER": upper[offset:], f"BB{w}_LOWER": lower[offset:]})
+        return out
+
+    def compute(self, close, volume):
+        return self._named(bollinger(close, self.windows))
+
+    def extend(self, arrays, close, volume, p):
+        lo = max(0, p - self.windows[-1] + 1)
+        return self._named(bollinger(close[lo:], self.windows), p - lo)
+
+
+class _EMA:
+    def __init__(self, spans):
+        self.spans = sorted(spans)
+        self.columns = [f"EMA{s}" for s in self.spans]
+
+    def compute(self, close, volume):
+        return {f"EMA{s}": ema(close, s) for s in self.spans}
+
+    def extend(self, arrays, close, volume, p):
+        return {f"EMA{s}": _ema_step(close[p:], 2 / (s + 1), arrays[f"EMA{s}"][p - 1] if p else None)
+                for s in self.spans}
+
+
+class _RSI:
+    """Wilder 平滑 (alpha = 1 / period)，前 period 筆為 NaN"""
+
+    def __init__(self, period):
+        self.period = period
+        self.columns = [f"RSI{period}"]
+        self._gain, self._loss = f"_RSI{period}_GAIN", f"_RSI{period}_LOSS"
+
+    def _finish(self, avg_gain, avg_loss, start):
+        rsi = _rsi_from_averages(avg_gain, avg_loss)
+        rsi[:max(0, self.period - start)] = np.nan
+        return {self.columns[0]: rsi, self._gain: avg_gain, self._loss: avg_loss}
+
+    def compute(self, close, volume):
+        delta = np.diff(np.asarray(close, dtype=float), prepend=np.nan)
+        alpha = 1 / self.period
+        avg_gain = np.full(len(delta), np.nan)
+        avg_loss = np.full(len(delta), np.nan)
+        if len(delta) > 1:
+            avg_gain[1:] = pd.Series(np.clip(delta[1:], 0, None)).ewm(alpha=alpha, adjust=False).mean().to_numpy()
+            avg_loss[1:] = pd.Series(np.clip(-delta[1:], 0, None)).ewm(alpha=alpha, adjust=False).mean().to_numpy()
+        return self._finish(avg_gain, avg_loss, 0)
+
+    def extend(self, arrays, close, volume, p):
+        alpha = 1 / self.period
+        start = max(p, 1)
+        delta = np.diff(close[start - 1:])
+        prev_gain = arrays[self._gain][start - 1] if start > 1 else None
+        prev_loss = arrays[self._loss][start - 1] if start > 1 else None
+        avg_gain = _ema_step(np.clip(delta, 0, None), alpha, prev_gain)
+        avg_loss = _ema_step(np.clip(-delta, 0, None), alpha, prev_loss)
+        if p == 0:
+            avg_gain = np.concatenate(([np.nan], avg_gain))
+            avg_loss = np.concatenate(([np.nan], avg_loss))
+        return self._finish(avg_gain, avg_loss, p)
+
+
+class _MACD:
+    columns = ["MACD", "MACD_SIGNAL", "MACD_HIST"]
+
+    def _finish(self, fast, slow, signal):
+        macd = fast - slow
+        return {"MACD": macd, "MACD_SIGNAL": signal, "MACD_HIST": macd - signal, "_MACD_FAST": fast,
+                "_MACD_SLOW": slow}
+
+    def compute(self, close, volume):
+        fast, slow = ema(close, MACD_FAST), ema(close, MACD_SLOW)
+        return self._finish(fast, slow, ema(fast - slow, MACD_SIGNAL))
+
+    def extend(self, arrays, close, volume, p):
+        prev = (lambda col: arrays[col][p - 1] if p else None)
+        fast = _ema_step(close[p:], 2 / (MACD_FAST + 1), prev("_MACD_FAST"))
+        slow = _ema_step(close[p:], 2 / (MACD_SLOW + 1), prev("_MACD_SLOW"))
+        signal = _ema_step(fast - slow, 2 / (MACD_SIGNAL + 1), prev("MACD_SIGNAL"))
+        return self._finish(fast, slow, signal)
+
+
+class _VWAP:
+    """以收盤價近似成交均價，從資料起點累計 (只有收盤價與成交量可用)"""
+    columns = ["VWAP"]
+
+    def _finish(self, cum_pv, cum_v):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            vwap = np.where(cum_v > 0, cum_pv / cum_v, np.nan)
+        return {"VWAP": vwap, "_VWAP_PV": cum_pv, "_VWAP_V": cum_v}
+
+    def compute(self, close, volume):
+        return self._finish(np.cumsum(close * volume), np.cumsum(volume))
+
+    def extend(self, arrays, close, volume, p):
+        base_pv = arrays["_VWAP_PV"][p - 1] if p else 0.0
+        base_v = arrays["_VWAP_V"][p - 1] if p else 0.0
+        return self._finish(base_pv + np.cumsum(close[p:] * volume[p:]), base_v + np.cumsum(volume[p:]))
+
+
+def parse_names(names):
+    """把 ['SMA5', 'SMA20', 'RSI14', 'MACD'] 轉成 {('SMA', 5), ('RSI', 14), ('MACD', 0)}"""
+    specs = set()
+    for name in names:
+        name = name.upper()
+        match = _NAME_RE.match(name)
+        if match:
+            specs.add((match.group(1), int(match.group(2))))
+        elif name in ("MACD", "VWAP"):
+            specs.add((name, 0))
+        else:
+            raise ValueError(f"未知的指標: {name}")
+    return specs
+
+
+def _calculators(specs):
+    """同類的指標合併成一個計算器，例如 SMA5/20/60 共用一次 cumsum"""
+    grouped = {}
+    for kind, n in sorted(specs):
+        grouped.setdefault(kind, []).append(n)
+    calcs = []
+    for kind, ns in grouped.items():
+        if kind == "SMA":
+            calcs.append(_SMA(ns))
+        elif kind == "EMA":
+            calcs.append(_EMA(ns))
+        elif kind == "BB":
+            calcs.append(_BB(ns))
+        elif kind == "RSI":
+            calcs.extend(_RSI(n) for n in ns)
+        elif kind == "MACD":
+            calcs.append(_MACD())
+        elif kind == "VWAP":
+            calcs.append(_VWAP())
+    return calcs
+
+
+def _columns(specs):
+    return [col for calc in _calculators(specs) for col in calc.columns]
+
+
+def _series(df):
+    dates = df['Datetime']
+    dates = pd.DatetimeIndex(dates if isinstance(dates.dtype, pd.DatetimeTZDtype) or dates.dtype.kind == 'M'
+                             else pd.to_datetime(dates))
+    ts = dates.as_unit('ns').asi8
+    close = df['Close'].to_numpy(dtype=float)
+    volume = df['Volume'].to_numpy(dtype=float) if 'Volume' in df else np.zeros(len(df))
+    return ts, close, np.nan_to_num(volume)
+
+
+# --- 快取項目 ---
+class _Entry:
+    def __init__(self, ts, close, volume):
+        self.ts, self.close, self.volume = ts, close, volume
+        self.specs = set()
+        self.calcs = []
+        self.arrays = {}
+
+    def add(self, specs):
+        for calc in _calculators(specs):
+            self.arrays.update(calc.compute(self.close, self.volume))
+            self.calcs.append(calc)
+        self.specs |= specs
+
+    def extend(self, p, ts, close, volume):
+        """第 p 筆之後換成新資料，各指標從第 p - 1 筆的狀態往後推算"""
+        self.ts, self.close, self.volume = ts, close, volume
+        truncated = {col: values[:p] for col, values in self.arrays.items()}
+        for calc in self.calcs:
+            for col, values in calc.extend(truncated, close, volume, p).items():
+                self.arrays[col] = np.concatenate((truncated[col], values))
+
+    def sync(self, ts, close, volume):
+        """
+        讓快取涵蓋傳入的資料；傳入資料須與快取從同一根 K 線開始且重疊部分一致
+        (最後一根允許被更新)。成功回傳 True，無法接續則回傳 False
+        """
+        n = len(self.ts)
+        m = min(n, len(ts))
+        if not np.array_equal(self.ts[:m], ts[:m]):
+            return False
+        same = np.isclose(self.close[:m], close[:m]) & np.isclose(self.volume[:m], volume[:m])
+        p = m
+        if not same.all():
+            first_diff = int(np.argmin(same))
+            if first_diff != n - 1:
+                return False
+            p = first_diff
+        if p < n or len(ts) > m:
+            self.extend(p, np.concatenate((self.ts[:p], ts[p:])), np.concatenate((self.close[:p], close[p:])),
+                        np.concatenate((self.volume[:p], volume[p:])))
+        return True
+
+
+def compute_indicators(df, names):
+    """不經快取直接計算，回傳與 df 同索引的 DataFrame"""
+    specs = parse_names(names)
+    ts, close, volume = _series(df)
+    entry = _Entry(ts, close, volume)
+    entry.add(specs)
+    return pd.DataFrame({col: entry.arrays[col] for col in _columns(specs)}, index=df.index)
+
+
+@metrics.timed("indicators.get")
+def get_indicators(df, symbol, interval, names):
+    """
+    取得 df (需有 Datetime / Close，可選 Volume) 對應的指標，回傳與 df 同索引的 DataFrame
+    同一 (symbol, interval, 起點) 的快取若最後一根 K 線相同就直接切出結果；
+    df 延續快取 (新 K 線或最後一根更新) 時只增量推算新的部分；其餘情況整段重算
+    結果與 compute_indicators(df, names) 相同
+    """
+    specs = parse_names(names)
+    columns = _columns(specs)
+    if df is None or df.empty:
+        return pd.DataFrame(columns=columns)
+    ts, close, volume = _series(df)
+    key = (symbol, interval, int(ts[0]))
+
+    with _lock:
+        entry = _cache.get(key)
+        hit = entry is not None and entry.sync(ts, close, volume)
+        metrics.cache_lookup('indicators', hits=int(hit), misses=int(not hit))
+        if not hit:
+            entry = _Entry(ts, close, volume)
+            _cache[key] = entry
+        missing = specs - entry.specs
+        if missing:
+            entry.add(missing)
+        _cache.move_to_end(key)
+        while len(_cache) > INDICATOR_CACHE_SIZE:
+            _cache.popitem(last=False)
+        return pd.DataFrame({col: entry.arrays[col][:len(ts)] for col in columns}, index=df.index)
+
+
+def clear_cache():
+    with _lock:
+        _cache.clear()
@@ -0,0 +1,192 @@
+FIFO = 'FIFO'
+LIFO = 'LIFO'
+AVERAGE = 'AVERAGE'
+METHODS = (FIFO, LIFO, AVERAGE)
+
+# 剩餘數量低於此值視為已全部賣出 (避免浮點誤差留下極小的零碎部位)
+QTY_EPSILON = 1e-9
+
+
+class _Position:
+    """
+    單一資產的買入批次佇列
+    lots 內存 {'date', 'qty', 'price': 原始單位成本}，lots[:head] 是已賣完的批次 (FIFO 只前移 head)；
+    實際單位成本 = 原始單位成本 * scale，以平均成本法賣出時只調整 scale，不必逐批改寫成本
+    lots 直接沿用批次狀態內的 list，讀入與寫回都不必複製，賣出維持 O(消耗批次數)
+    """
+    __slots__ = ("lots", "head", "qty", "raw_cost", "scale")
+
+    def __init__(self, lots=None, head=0, qty=0.0, raw_cost=0.0, scale=1.0):
+        self.lots = [] if lots is None else lots
+        self.head = head
+        self.qty = qty
+        self.raw_cost = raw_cost
+        self.scale = scale
+
+    @property
+    def cost(self):
+        return self.raw_cost * self.scale
+
+    def live(self):
+        return self.lots[self.head:]
+
+    def rebase(self, unit_cost):
+        """剩餘批次的成本無法以 scale 表示時 (原始成本為 0)，把每批改寫成 unit_cost，scale 回到 1"""
+        for lot in self.live():
+            lot["price"] = unit_cost
+        self.raw_cost = unit_cost * self.qty
+        self.scale = 1.0
+
+    def compact(self):
+        """已賣完的批次超過一半才真正刪除，均攤下來每批只搬移 O(1) 次"""
+        if self.head and self.head * 2 >= len(self.lots):
+            del self.lots[:self.head]
+            self.head = 0
+
+    def reset_if_empty(self):
+        if self.qty <= QTY_EPSILON:
+            self.lots.clear()
+            self.head = 0
+            self.qty = self.raw_cost = 0.0
+            self.scale = 1.0
+
+
+class LotLedger:
+    """
+    批次成本帳本：每個資產一條買入批次佇列，賣出時依 FIFO / LIFO / 平均成本法配對
+    配對成本只與被消耗的批次數有關，不會每次賣出都重掃整個部位
+    """
+
+    def __init__(self, method=FIFO):
+        if method not in METHODS:
+            raise ValueError(f"未知的成本計算方式: {method}")
+        self.method = method
+        self._positions = {}
+
+    # --- 買入 ---
+    def buy(self, asset_id, qty, price, date=None):
+        if qty <= 0:
+            raise ValueError("買入數量必須大於 0")
+        pos = self._positions.setdefault(asset_id, _Position())
+        pos.reset_if_empty()
+        raw_unit = price / pos.scale
+        pos.lots.append({"date": date, "qty": float(qty), "price": raw_unit})
+        pos.qty += qty
+        pos.raw_cost += qty * raw_unit
+
+    # --- 賣出配對 ---
+    def sell(self, asset_id, qty, price, date=None, method=None):
+        """
+        賣出並回傳每一筆配對結果:
+        [{'buy_date', 'sell_date', 'qty', 'unit_cost', 'sell_price', 'pnl'}, ...]
+        """
+        method = method or self.method
+        if method not in METHODS:
+            raise ValueError(f"未知的成本計算方式: {method}")
+        pos = self._positions.get(asset_id)
+        if pos is None or qty > pos.qty + QTY_EPSILON:
+            raise ValueError(f"{asset_id} 持有數量不足")
+
+        avg_unit = pos.cost / pos.qty if method == AVERAGE else None
+        take_right = method == LIFO
+        matches = []
+        remaining = float(qty)
+        consumed_raw = 0.0
+
+        lots = pos.lots
+        while remaining > QTY_EPSILON and pos.head < len(lots):
+            lot = lots[-1] if take_right else lots[pos.head]
+            used = min(lot["qty"], remaining)
+            unit_cost = avg_unit if avg_unit is not None else lot["price"] * pos.scale
+            matches.append({
+                "buy_date": lot["date"], "sell_date": date, "qty": used, "unit_cost": unit_cost,
+                "sell_price": price, "pnl": (price - unit_cost) * used,
+            })
+            consumed_raw += used * lot["price"]
+            lot["qty"] -= used
+            remaining -= used
+            if lot["qty"] <= QTY_EPSILON:
+                if take_right:
+                    lots.pop()
+                else:
+                    pos.head += 1
+
+        remaining_cost = pos.cost - avg_unit * qty if avg_unit is not None else None
+        pos.raw_cost -= consumed_raw
+        pos.qty -= qty
+        if pos.qty <= QTY_EPSILON:
+            pos.reset_if_empty()
+        elif remaining_cost is not None:
+            # 平均成本法: 剩餘部位的平均成本不變，把差額反映在 scale 上；scale 不能為 0 (買入時要除)
+            if pos.raw_cost > QTY_EPSILON and remaining_cost > 0:
+                pos.scale = remaining_cost / pos.raw_cost
+            else:
+                pos.rebase(max(remaining_cost, 0.0) / pos.qty)
+        pos.compact()
+        return matches
+
+    # --- 查詢 ---
+    def position(self, asset_id):
+        """回傳 (持有數量, 平均單位成本)"""
+        pos = self._positions.get(asset_id)
+        if pos is None or pos.qty <= QTY_EPSILON:
+            return 0.0, 0.0
+        return pos.qty, pos.cost / pos.qty
+
+    def lots(self, asset_id):
+        pos = self._positions.get(asset_id)
+        if pos is None:
+            return []
+        return [{"date": lot["date"], "qty": lot["qty"], "price": lot["price"] * pos.scale} for lot in pos.live()]
+
+    def unrealized(self, asset_id, price):
+        """每一批的未實現損益"""
+        return [dict(lot, pnl=(price - lot["price"]) * lot["qty"]) for lot in self.lots(asset_id)]
+
+    # --- 與持倉、批次狀態互轉 ---
+    # 持倉只存數量與平均成本；批次狀態 (data_manager.load_lots / save_lots) 為
+    # {'lots': [{'date', 'qty', 'price'}], 'head', 'scale', 'raw_cost'}，lots[:head] 是已賣完的批次、
+    # price 是原始單位成本 (實際成本要乘上 scale)
+    def load_holding(self, asset_id, holding, qty_field, state=None):
+        """
+        從持倉與批次狀態讀入 (直接沿用狀態，不重播每一批)；
+        沒有批次狀態的舊持倉以現有數量與平均成本建立一筆起始批次
+        """
+        if state and state.get('lots'):
+            self._positions[asset_id] = _Position(state['lots'], state.get('head', 0), float(holding.get(qty_field, 0)),
+                                                  state.get('raw_cost', 0.0), state.get('scale', 1.0) or 1.0)
+            return
+        qty = holding.get(qty_field, 0)
+        if qty > 0:
+            self.buy(asset_id, qty, holding.get('avg_cost', 0.0))
+
+    def write_holding(self, asset_id, holding, qty_field):
+        """把數量與平均成本寫回持倉 dict，回傳要另外儲存的批次狀態 (lots 與帳本共用同一個 list)"""
+        qty, avg_cost = self.position(asset_id)
+        pos = self._positions.setdefault(asset_id, _Position())
+        holding[qty_field] = qty
+        holding['avg_cost'] = avg_cost
+        return {"lots": pos.lots, "head": pos.head, "scale": pos.scale, "raw_cost": pos.raw_cost}
+
+    @classmethod
+    def from_holding(cls, asset_id, holding, qty_field, method=FIFO, state=None):
+        ledger = cls(method)
+        ledger.load_holding(asset_id, holding, qty_field, state)
+        return ledger
+
+
+def open_lot_count(state):
+    """批次狀態中尚未賣完的批次數"""
+    if not state:
+        return 0
+    return len(state.get('lots') or []) - state.get('head', 0)
+
+
+def summarize_matches(matches):
+    """把配對結果彙總成一筆已實現損益所需的數值: (數量, 平均成本, 損益, 報酬率%)"""
+    qty = sum(m["qty"] for m in matches)
+    cost = sum(m["qty"] * m["unit_cost"] for m in matches)
+    pnl = sum(m["pnl"] for m in matches)
+    avg_cost = cost / qty if qty else 0.0
+    roi = pnl / cost * 100 if cost > 0 else 0.0
+    return qty, avg_cost, pnl, roi
@@ -0,0 +1,213 @@
+import asyncio
+import threading
+
+import aiohttp
+
+import api_handler as ah
+import providers
+
+# --- 併發設定 ---
+ENGINE_MAX_CONCURRENCY = 64  # 全部 provider 合計同時進行的請求數
+PROVIDER_CONCURRENCY = {
+    "yahoo": 16,
+    "coingecko": 4,
+    "exchangerate": 2,
+}
+YAHOO_HEADERS = {"User-Agent": "Mozilla/5.0"}
+
+
+class _Limits:
+    """一次抓價過程共用的 semaphore (必須在事件迴圈內建立)"""
+
+    def __init__(self):
+        self.total = asyncio.Semaphore(ENGINE_MAX_CONCURRENCY)
+        self.providers = {name: asyncio.Semaphore(n) for name, n in PROVIDER_CONCURRENCY.items()}
+
+
+def _provider_failure(error):
+    """連線錯誤、逾時與重試用完仍是 5xx / 429 才算 provider 故障；4xx 與回應內容錯誤只是該代號沒有資料"""
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status >= 500 or error.status == 429
+    return isinstance(error, (aiohttp.ClientConnectionError, asyncio.TimeoutError))
+
+
+async def _get_json(session, limits, provider, url, params=None, headers=None):
+    """
+    帶併發上限與退避重試的 GET，重試與等待 rate limit token 期間不佔用 semaphore；斷路中直接丟出 CircuitOpenError
+    與 api_handler.http_get 相同，只有 provider 故障計入斷路器，下市代號的 404 不會讓整個 provider 斷路
+    """
+    breaker = ah.circuit_breaker(provider)
+    breaker.check()
+    try:
+        data = await _send_with_retries(session, limits, provider, url, params, headers)
+    except Exception as e:
+        if _provider_failure(e):
+            breaker.record_failure(e)
+        else:
+            breaker.record_success()
+        raise
+    breaker.record_success()
+    return data
+
+
+async def _send_with_retries(session, limits, provider, url, params, headers):
+    bucket = ah.rate_limiter(provider)
+    for attempt in range(ah.HTTP_MAX_RETRIES + 1):
+        wait = bucket.reserve()
+        if wait:
+            await asyncio.sleep(wait)
+        delay = None
+        async with limits.total, limits.providers[provider]:
+            try:
+                async with session.get(url, params=params, headers=headers) as response:
+                    if response.status in ah.HTTP_RETRY_STATUS and attempt < ah.HTTP_MAX_RETRIES:
+                        delay = ah.backoff_delay(attempt, response.headers.get("Retry-After"))
+                    else:
+                        response.raise_for_status()
+                        return await response.json(content_type=None)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if attempt >= ah.HTTP_MAX_RETRIES:
+                    raise
+                delay = ah.backoff_delay(attempt)
+        await asyncio.sleep(delay)
+
+
+async def _get_stock_price(session, limits, symbol):
+    try:
+        data = await _get_json(session, limits, "yahoo", f"{ah.YAHOO_CHART_API}/{symbol}",
+                               params={"range": "1d", "interval": "1d"}, headers=YAHOO_HEADERS)
+        price = data["chart"]["result"][0]["meta"].get("regularMarketPrice")
+        return float(price) if price else None
+    except Exception:
+        return None
+
+
+async def _get_crypto_chunk(session, limits, ids):
+    vs = ah.BASE_CURRENCY.lower()
+    try:
+        data = await _get_json(session, limits, "coingecko", f"{ah.COINGECKO_API}/simple/price",
+                               params={"ids": ",".join(ids), "vs_currencies": vs})
+    except Exception as e:
+        print(f"Crypto batch fetch failed: {e}")
+        return {}
+    return {i: float(data[i][vs]) for i in ids if data.get(i, {}).get(vs)}
+
+
+async def _get_fx_table(session, limits):
+    """只在記憶體/SQLite 匯率表過期時才發一次 USD 基準的請求"""
+    if ah.EXCHANGE_RATE_API_KEY == "YOUR_API_KEY":
+        return dict(ah.DEFAULT_USD_RATES)
+    cached = ah.get_cached_fx_table()
+    if cached:
+        return cached
+    try:
+        data = await _get_json(session, limits, "exchangerate",
+                               f"{ah.EXCHANGE_RATE_API}/{ah.EXCHANGE_RATE_API_KEY}/latest/USD")
+        if data.get("result") == "success":
+            rates = data.get("conversion_rates")
+            ah.store_fx_table(rates, data.get("time_next_update_unix"))
+            return rates
+    except Exception as e:
+        print(f"Fetch exchange rates failed: {e}")
+    return dict(ah.DEFAULT_USD_RATES)
+
+
+async def fetch_market_data_async(stock_symbols, crypto_ids):
+    """
+    asyncio 版抓價：單一事件迴圈、共用連線池，以 semaphore 限制總併發與各 provider 併發
+    回傳格式與 api_handler.fetch_market_data 相同
+    只實作 Yahoo / CoinGecko / exchangerate-api；provider 鏈有改過時改用執行緒版 (依鏈 failover)
+    """
+    if not providers.uses_builtin_chains():
+        return await asyncio.to_thread(ah.fetch_market_data, stock_symbols, crypto_ids)
+    stock_symbols = sorted(set(stock_symbols))
+    crypto_ids = sorted(set(crypto_ids))
+    limits = _Limits()
+
+    # 先取 SQLite 快取內仍新鮮的報價，只對缺少或過期的發請求
+    cached_stocks = ah.cache_get('stock', stock_symbols)
+    cached_cryptos = ah.cache_get('crypto', crypto_ids)
+    fetch_stocks = [s for s in stock_symbols if s not in cached_stocks]
+    fetch_cryptos = [c for c in crypto_ids if c not in cached_cryptos]
+
+    # 過期但有舊價的先用舊價並交給背景重抓 (stale-while-revalidate)
+    quote_report = ah.empty_quote_report()
+    quote_report['cached'] = sorted(cached_stocks)
+    stale_prices = {}
+    if ah.SWR_ENABLED:
+        ah.revalidate_in_background('stock', ah.fill_stale_prices('stock', stale_prices, fetch_stocks, quote_report))
+        ah.revalidate_in_background('crypto', ah.fill_stale_prices('crypto', stale_prices, fetch_cryptos,
+                                                                   quote_report))
+        quote_report['missing'].clear()
+        fetch_stocks = [s for s in fetch_stocks if s not in stale_prices]
+        fetch_cryptos = [c for c in fetch_cryptos if c not in stale_prices]
+
+    connect_timeout, read_timeout = ah.HTTP_TIMEOUT
+    timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+    connector = aiohttp.TCPConnector(limit=ENGINE_MAX_CONCURRENCY, limit_per_host=ah.HTTP_POOL_MAXSIZE)
+
+    async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+        fx_task = _get_fx_table(session, limits)
+        stock_tasks = asyncio.gather(*(_get_stock_price(session, limits, s) for s in fetch_stocks))
+        crypto_tasks = asyncio.gather(*(_get_crypto_chunk(session, limits, chunk)
+                                        for chunk in ah.chunk_crypto_ids(fetch_cryptos)))
+        fx_table, stock_results, crypto_results = await asyncio.gather(fx_task, stock_tasks, crypto_tasks)
+
+    asset_prices = {crypto_id: 0.0 for crypto_id in crypto_ids}
+    asset_prices.update(stale_prices)
+    asset_prices.update({c: price for c, (price, _) in cached_cryptos.items()})
+    fetched_cryptos = {}
+    for chunk_prices in crypto_results:
+        fetched_cryptos.update(chunk_prices)
+    asset_prices.update(fetched_cryptos)
+    ah.cache_put('crypto', fetched_cryptos)
+
+    asset_prices.update({s: price for s, (price, _) in cached_stocks.items()})
+    misses = []
+    for symbol, price in zip(fetch_stocks, stock_results):
+        if price:
+            asset_prices[symbol] = price
+            quote_report['batch'].append(symbol)
+        else:
+            misses.append(symbol)
+
+    # 拿不到的代號交給 yfinance 單檔補抓 (同步函式，丟到執行緒執行)
+    if misses:
+        fallback_prices = await asyncio.gather(*(asyncio.to_thread(ah.get_stock_price, s) for s in misses))
+        for symbol, price in zip(misses, fallback_prices):
+            asset_prices[symbol] = price
+            quote_report['fallback'].append(symbol)
+    ah.cache_put('stock', {s: asset_prices[s] for s in fetch_stocks if asset_prices[s] > 0})
+
+    # 這次仍抓不到的以舊價補上，真的沒有價格的記在 quote_report['missing']
+    ah.fill_stale_prices('stock', asset_prices, fetch_stocks, quote_report)
+    ah.fill_stale_prices('crypto', asset_prices, fetch_cryptos, quote_report)
+
+    if not fx_table.get("TWD"):
+        fx_table = dict(ah.DEFAULT_USD_RATES)
+    return ah.derive_rates(fx_table, "USD"), ah.derive_rates(fx_table, "TWD"), asset_prices, quote_report
+
+
+def fetch_market_data(stock_symbols, crypto_ids):
+    """同步包裝，讓 Streamlit 等非 async 程式直接呼叫"""
+    coro = fetch_market_data_async(stock_symbols, crypto_ids)
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+
+    # 目前執行緒已有事件迴圈在跑，改在獨立執行緒開新的迴圈
+    result = {}
+
+    def runner():
+        try:
+            result['value'] = asyncio.run(coro)
+        except BaseException as e:
+            result['error'] = e
+
+    t = threading.Thread(target=runner)
+    t.start()
+    t.join()
+    if 'error' in result:
+        raise result['error']
+    return result['value']
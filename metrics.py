@@ -0,0 +1,304 @@
+import functools
+import os
+import threading
+import time
+
+# --- 效能指標 ---
+# 各 provider 呼叫、data_manager 讀寫、圖表建立的耗時與成功 / 失敗 / 備援次數，以及各快取的命中率
+# 只用標準函式庫，data_manager / api_handler 都可以直接 import，不影響啟動時間
+# PYASSET_METRICS=0 關閉記錄；PYASSET_METRICS_FILE 指定 Prometheus 文字檔 (例如給 node_exporter textfile collector)；
+# PYASSET_METRICS_PORT 啟動 http://<host>:<port>/metrics
+METRICS_ENABLED = os.environ.get('PYASSET_METRICS', '1') != '0'
+METRICS_FILE = os.environ.get('PYASSET_METRICS_FILE')
+METRICS_PORT = os.environ.get('PYASSET_METRICS_PORT')
+METRICS_HOST = os.environ.get('PYASSET_METRICS_HOST', '127.0.0.1')
+METRICS_PREFIX = 'pyasset'
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+OUTCOMES = ('success', 'failure', 'fallback')
+
+HELP = {
+    'op_seconds': 'Duration of instrumented operations',
+    'op_total': 'Instrumented operations by outcome',
+    'cache_requests_total': 'Cache lookups by result',
+    'quote_symbols_total': 'Quoted symbols by provider and source (batch / fallback / stale / missing)',
+    'http_requests_total': 'HTTP requests sent, including retries',
+    'http_errors_total': 'HTTP connection errors and timeouts',
+    'http_retries_total': 'HTTP retries after a retryable status code',
+    'rerun_stage_seconds': 'Dashboard rerun duration by stage',
+    'ratelimit_requests_total': 'Requests that went through a provider rate limiter',
+    'ratelimit_throttled_total': 'Requests that had to wait for a rate-limit token',
+    'ratelimit_wait_seconds': 'Time spent waiting for a rate-limit token',
+    'ratelimit_rate': 'Configured tokens per second (0 = unlimited)',
+    'ratelimit_burst': 'Configured bucket size',
+    'ratelimit_tokens': 'Tokens left after the last request (negative = queued)',
+    'circuit_state': 'Circuit breaker state (0 = closed, 1 = open, 2 = half-open)',
+    'circuit_opened_total': 'Times a provider circuit breaker tripped open',
+    'circuit_rejected_total': 'Requests rejected while a circuit breaker was open',
+    'coalesced_requests_total': 'Requests that joined an identical in-flight request instead of sending their own',
+}
+
+_lock = threading.Lock()
+_counters = {}  # {(名稱, labels): 數值}
+_histograms = {}  # {(名稱, labels): [各 bucket 次數..., +Inf 次數, 合計秒數, 最大秒數]}
+_gauges = {}  # {(名稱, labels): 數值}
+_last_errors = {}  # {op: (時間, 訊息)}
+_server = None
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name, n=1, **labels):
+    if not METRICS_ENABLED or not n:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + n
+
+
+def set_gauge(name, value, **labels):
+    if not METRICS_ENABLED:
+        return
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+
+def observe(name, seconds, **labels):
+    if not METRICS_ENABLED:
+        return
+    key = _key(name, labels)
+    with _lock:
+        hist = _histograms.get(key)
+        if hist is None:
+            hist = _histograms[key] = [0] * (len(LATENCY_BUCKETS) + 1) + [0.0, 0.0]
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                hist[i] += 1
+                break
+        else:
+            hist[len(LATENCY_BUCKETS)] += 1
+        hist[-2] += seconds
+        hist[-1] = max(hist[-1], seconds)
+
+
+def record(op, seconds, outcome='success'):
+    observe('op_seconds', seconds, op=op)
+    inc('op_total', op=op, outcome=outcome)
+
+
+def record_error(op, error):
+    """記下最後一次失敗的原因 (原本被 except 吞掉的錯誤)，顯示在儀表板的除錯面板"""
+    if METRICS_ENABLED:
+        with _lock:
+            _last_errors[op] = (time.time(), f"{type(error).__name__}: {error}")
+
+
+def cache_lookup(cache, hits=0, misses=0):
+    inc('cache_requests_total', hits, cache=cache, result='hit')
+    inc('cache_requests_total', misses, cache=cache, result='miss')
+
+
+class _Timer:
+    """with metrics.timer(op) as t: ...；例外往外拋時記為 failure，也可手動 t.fail(e) / t.fallback()"""
+    __slots__ = ('op', 'outcome', 'start')
+
+    def __init__(self, op):
+        self.op = op
+        self.outcome = 'success'
+
+    def fail(self, error=None):
+        self.outcome = 'failure'
+        if error is not None:
+            record_error(self.op, error)
+
+    def fallback(self):
+        self.outcome = 'fallback'
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc is not None:
+            self.fail(exc)
+        record(self.op, time.perf_counter() - self.start, self.outcome)
+        return False
+
+
+def timer(op):
+    return _Timer(op)
+
+
+def timed(op):
+    """裝飾器版的 timer"""
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with _Timer(op):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+        _gauges.clear()
+        _last_errors.clear()
+
+
+# --- 摘要 (儀表板除錯面板用) ---
+def _quantile(hist, q):
+    """依 bucket 估計分位數 (回傳所在 bucket 的上界)"""
+    count = sum(hist[:len(LATENCY_BUCKETS) + 1])
+    if not count:
+        return 0.0
+    target, seen = q * count, 0
+    for i, bound in enumerate(LATENCY_BUCKETS):
+        seen += hist[i]
+        if seen >= target:
+            return bound
+    return hist[-1]
+
+
+def summary():
+    """
+    回傳 {"ops": [...], "caches": [...], "errors": [...]}
+    ops: 每個 op 的呼叫次數、成功 / 失敗 / 備援、平均 / p95 / 最大耗時 (毫秒)
+    """
+    with _lock:
+        counters = dict(_counters)
+        histograms = {k: list(v) for k, v in _histograms.items()}
+        errors = dict(_last_errors)
+
+    ops = {}
+    for (name, labels), value in counters.items():
+        if name == 'op_total':
+            labels = dict(labels)
+            row = ops.setdefault(labels['op'], dict.fromkeys(OUTCOMES, 0))
+            row[labels['outcome']] = row.get(labels['outcome'], 0) + value
+    op_rows = []
+    for (name, labels), hist in histograms.items():
+        if name != 'op_seconds':
+            continue
+        op = dict(labels)['op']
+        count = sum(hist[:len(LATENCY_BUCKETS) + 1])
+        op_rows.append({"op": op, "calls": count, **ops.get(op, dict.fromkeys(OUTCOMES, 0)),
+                        "avg_ms": hist[-2] / count * 1000 if count else 0.0,
+                        "p95_ms": _quantile(hist, 0.95) * 1000, "max_ms": hist[-1] * 1000})
+    op_rows.sort(key=lambda r: r["op"])
+
+    caches = {}
+    for (name, labels), value in counters.items():
+        if name == 'cache_requests_total':
+            labels = dict(labels)
+            caches.setdefault(labels['cache'], {"hit": 0, "miss": 0})[labels['result']] += value
+    cache_rows = [{"cache": c, **v, "hit_ratio": v["hit"] / (v["hit"] + v["miss"]) if v["hit"] + v["miss"] else 0.0}
+                  for c, v in sorted(caches.items())]
+
+    error_rows = [{"op": op, "time": t, "error": msg} for op, (t, msg) in sorted(errors.items())]
+    return {"ops": op_rows, "caches": cache_rows, "errors": error_rows}
+
+
+# --- Prometheus 文字格式 ---
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in items) + '}'
+
+
+def _fmt(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_prometheus():
+    with _lock:
+        counters = sorted(_counters.items())
+        gauges = sorted(_gauges.items())
+        histograms = sorted((k, list(v)) for k, v in _histograms.items())
+
+    lines, declared = [], set()
+
+    def declare(name, kind):
+        if name not in declared:
+            declared.add(name)
+            if name in HELP:
+                lines.append(f"# HELP {METRICS_PREFIX}_{name} {HELP[name]}")
+            lines.append(f"# TYPE {METRICS_PREFIX}_{name} {kind}")
+
+    for (name, labels), value in counters:
+        declare(name, 'counter')
+        lines.append(f"{METRICS_PREFIX}_{name}{_labels(labels)} {_fmt(value)}")
+    for (name, labels), value in gauges:
+        declare(name, 'gauge')
+        lines.append(f"{METRICS_PREFIX}_{name}{_labels(labels)} {_fmt(value)}")
+    for (name, labels), hist in histograms:
+        declare(name, 'histogram')
+        cumulative = 0
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            cumulative += hist[i]
+            lines.append(f"{METRICS_PREFIX}_{name}_bucket{_labels(labels, [('le', bound)])} {cumulative}")
+        cumulative += hist[len(LATENCY_BUCKETS)]
+        lines.append(f"{METRICS_PREFIX}_{name}_bucket{_labels(labels, [('le', '+Inf')])} {cumulative}")
+        lines.append(f"{METRICS_PREFIX}_{name}_sum{_labels(labels)} {_fmt(hist[-2])}")
+        lines.append(f"{METRICS_PREFIX}_{name}_count{_labels(labels)} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus_file(path=None):
+    """原子寫入 Prometheus 文字檔；未指定路徑也沒有設定 PYASSET_METRICS_FILE 時不做事"""
+    path = path or METRICS_FILE
+    if not path:
+        return None
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(render_prometheus())
+    os.replace(tmp_path, path)
+    return path
+
+
+def serve(port=None, host=None):
+    """在背景執行緒提供 /metrics；同一程序只會啟動一次，未設定埠號時回傳 None"""
+    global _server
+    port = port or METRICS_PORT
+    if not port:
+        return None
+    with _lock:
+        if _server is not None:
+            return _server
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                payload = render_prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        try:
+            server = ThreadingHTTPServer((host or METRICS_HOST, int(port)), Handler)
+        except OSError as e:
+            print(f"Metrics endpoint failed to start: {e}")
+            return None
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+        _server = server
+    return _server
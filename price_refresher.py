@@ -0,0 +1,368 @@
+import contextlib
+import datetime
+import json
+import os
+import sys
+import threading
+import time
+from zoneinfo import ZoneInfo
+
+import api_handler as ah
+import data_manager as dm
+import metrics
+import providers
+
+# --- 報價快照 ---
+# 背景更新把報價與匯率寫成帶版本號的快照 (price_snapshots/snapshot-000042.json)，
+# 再原子替換 latest.json；儀表板只讀 latest.json，不必等網路
+SNAPSHOT_DIR = 'price_snapshots'
+SNAPSHOT_LATEST = 'latest.json'
+SNAPSHOT_KEEP = 5  # 保留最近幾個版本
+# 多個程序 (儀表板、CLI、獨立的背景更新) 發布時以此鎖檔互斥；超過 SNAPSHOT_LOCK_TIMEOUT 秒的鎖檔視為持有者已當掉
+SNAPSHOT_LOCK = '.publish.lock'
+SNAPSHOT_LOCK_TIMEOUT = 10
+# 某類別距上次更新超過「更新頻率 x 此倍數」就視為過期 (背景更新停了)，不再當成新報價使用
+SNAPSHOT_STALE_FACTOR = float(os.environ.get('PYASSET_SNAPSHOT_STALE_FACTOR', '3'))
+
+# --- 更新頻率 (秒)：(開盤時間, 非開盤時間) ---
+# 可用環境變數覆寫，例如 PYASSET_REFRESH_CRYPTO=30 或 PYASSET_REFRESH_TW_STOCK=60,3600
+REFRESH_INTERVALS = {
+    'crypto': (60, 60),
+    'tw_stock': (120, 1800),
+    'us_stock': (120, 1800),
+    'fx': (3600, 3600),
+}
+MARKET_HOURS = {
+    'tw_stock': ('Asia/Taipei', (9, 0), (13, 30)),
+    'us_stock': ('America/New_York', (9, 30), (16, 0)),
+}
+REFRESH_TICK = 5  # 背景執行緒檢查是否到期的間隔 (秒)
+ASSET_CLASSES = tuple(REFRESH_INTERVALS)
+
+_snapshot_cache = {"mtime": None, "data": None}
+_publish_lock = threading.Lock()
+
+
+def _env_intervals():
+    intervals = dict(REFRESH_INTERVALS)
+    for asset_class in intervals:
+        value = os.environ.get(f"PYASSET_REFRESH_{asset_class.upper()}")
+        if value:
+            parts = [float(v) for v in value.split(',')]
+            intervals[asset_class] = (parts[0], parts[-1])
+    return intervals
+
+
+def is_market_open(asset_class, now=None):
+    """沒有交易時段設定的類別 (加密貨幣、匯率) 一律視為開盤"""
+    if asset_class not in MARKET_HOURS:
+        return True
+    tz, (open_h, open_m), (close_h, close_m) = MARKET_HOURS[asset_class]
+    local = datetime.datetime.fromtimestamp(now or time.time(), ZoneInfo(tz))
+    minutes = local.hour * 60 + local.minute
+    return local.weekday() < 5 and open_h * 60 + open_m <= minutes < close_h * 60 + close_m
+
+
+def classify_symbols(stock_symbols, crypto_ids):
+    """依資產類別分組: {'tw_stock': [...], 'us_stock': [...], 'crypto': [...]}"""
+    stock_symbols = sorted(set(stock_symbols))
+    return {
+        'tw_stock': [s for s in stock_symbols if s.upper().endswith(('.TW', '.TWO'))],
+        'us_stock': [s for s in stock_symbols if not s.upper().endswith(('.TW', '.TWO'))],
+        'crypto': sorted(set(crypto_ids)),
+    }
+
+
+def _portfolio_symbols():
+    portfolio = dm.load_portfolio()
+    return [s['symbol'] for s in portfolio['stocks']], [c['id'] for c in portfolio['crypto']]
+
+
+# --- 讀寫快照 ---
+def _snapshot_path(version):
+    return os.path.join(SNAPSHOT_DIR, f"snapshot-{version:06d}.json")
+
+
+def load_latest_snapshot(cached=True):
+    """讀取最新快照 (檔案沒變就直接回傳記憶體中的版本)；尚無快照時回傳 None"""
+    path = os.path.join(SNAPSHOT_DIR, SNAPSHOT_LATEST)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    if cached and _snapshot_cache["mtime"] == mtime:
+        return _snapshot_cache["data"]
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (IOError, json.JSONDecodeError):
+        return _snapshot_cache["data"]
+    _snapshot_cache.update(mtime=mtime, data=data)
+    return data
+
+
+def _write_json(path, data):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def _prune_versions(latest_version):
+    for name in os.listdir(SNAPSHOT_DIR):
+        if name.startswith('snapshot-') and name.endswith('.json'):
+            try:
+                version = int(name[len('snapshot-'):-len('.json')])
+            except ValueError:
+                continue
+            if version <= latest_version - SNAPSHOT_KEEP:
+                try:
+                    os.remove(os.path.join(SNAPSHOT_DIR, name))
+                except OSError:
+                    pass
+
+
+@contextlib.contextmanager
+def _publish_file_lock():
+    """跨程序的發布鎖：以 O_CREAT | O_EXCL 建立鎖檔 (Windows 也適用)，取不到就稍候重試"""
+    path = os.path.join(SNAPSHOT_DIR, SNAPSHOT_LOCK)
+    while True:
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(path) > SNAPSHOT_LOCK_TIMEOUT:
+                    os.remove(path)  # 前一個持有者當掉留下的鎖
+                    continue
+            except FileNotFoundError:
+                continue
+            time.sleep(0.01)
+    try:
+        os.write(fd, str(os.getpid()).encode())
+        os.close(fd)
+        yield
+    finally:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def publish(updates, fx_table=None, quote_report=None, keep_ids=None):
+    """
+    以最新快照為基礎合併新報價後發布下一個版本
+    updates: {資產類別: {代號: 價格}}；價格 <= 0 的不覆蓋舊值，並在 quote_report 標記為舊報價
+    keep_ids: 仍在持倉中的代號，其餘舊報價會被移除 (None 表示全部保留)
+    """
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    with _publish_lock, _publish_file_lock():
+        now = time.time()
+        # 持鎖後直接讀檔，其他程序剛發布的版本才不會被覆蓋
+        previous = load_latest_snapshot(cached=False) or {}
+        prices = dict(previous.get('prices', {}))
+        if keep_ids is not None:
+            prices = {k: v for k, v in prices.items() if k in keep_ids}
+        updated_at = dict(previous.get('updated_at', {}))
+        kept = []
+        for asset_class, class_prices in updates.items():
+            kept += [k for k, v in class_prices.items() if not (v and v > 0) and prices.get(k)]
+            prices.update({k: v for k, v in class_prices.items() if v and v > 0 or k not in prices})
+            updated_at[asset_class] = now
+        if quote_report is not None and kept:
+            quote_report = _merge_reports(quote_report, {'stale': kept})
+            quote_report['missing'] = [k for k in quote_report.get('missing', []) if k not in kept]
+        if fx_table:
+            updated_at['fx'] = now
+
+        snapshot = {
+            "version": previous.get('version', 0) + 1,
+            "created_at": now,
+            "updated_at": updated_at,
+            "prices": prices,
+            "usd_table": fx_table or previous.get('usd_table') or dict(ah.DEFAULT_USD_RATES),
+            "quote_report": quote_report or previous.get('quote_report') or ah.empty_quote_report(),
+        }
+        _write_json(_snapshot_path(snapshot['version']), snapshot)
+        _write_json(os.path.join(SNAPSHOT_DIR, SNAPSHOT_LATEST), snapshot)
+        _prune_versions(snapshot['version'])
+    return snapshot
+
+
+def publish_market_data(stock_symbols, crypto_ids, market_data):
+    """把一次完整抓價 (fetch_market_data 的回傳值) 寫成快照，供冷啟動時使用"""
+    usd_rates, _, asset_prices, quote_report = market_data
+    groups = classify_symbols(stock_symbols, crypto_ids)
+    updates = {cls: {k: asset_prices.get(k, 0.0) for k in ids} for cls, ids in groups.items()}
+    return publish(updates, fx_table=usd_rates, quote_report=quote_report)
+
+
+def market_data_from_snapshot(snapshot, stock_symbols, crypto_ids, now=None):
+    """
+    從快照組出與 fetch_market_data 相同的回傳值
+    快照缺少任何一個代號 (例如剛新增的資產) 時回傳 None；
+    過期類別 (stale_classes) 的代號記在 quote_report 的 'stale'，'as_of' 為該類別上次更新時間
+    """
+    if not snapshot:
+        return None
+    prices = snapshot.get('prices', {})
+    wanted = list(stock_symbols) + list(crypto_ids)
+    if any(k not in prices for k in wanted):
+        return None
+    fx_table = snapshot.get('usd_table') or dict(ah.DEFAULT_USD_RATES)
+    if not fx_table.get("TWD"):
+        fx_table = dict(ah.DEFAULT_USD_RATES)
+    asset_prices = {k: prices[k] for k in wanted}
+    report = snapshot['quote_report']
+    groups = classify_symbols(stock_symbols, crypto_ids)
+    updated_at = snapshot.get('updated_at', {})
+    stale = {k: updated_at.get(cls, 0.0) for cls in stale_classes(snapshot, stock_symbols, crypto_ids, now)
+             for k in groups.get(cls, ())}
+    if stale:
+        report = _merge_reports(report, {'stale': [k for k in stale if k not in report.get('stale', [])],
+                                         'as_of': stale})
+    return ah.derive_rates(fx_table, "USD"), ah.derive_rates(fx_table, "TWD"), asset_prices, report
+
+
+def snapshot_age(snapshot, now=None):
+    """回傳 (快照年齡, {資產類別: 距上次更新秒數})"""
+    now = now or time.time()
+    if not snapshot:
+        return None, {}
+    return now - snapshot['created_at'], {k: now - v for k, v in snapshot.get('updated_at', {}).items()}
+
+
+def stale_classes(snapshot, stock_symbols, crypto_ids, now=None, refresher=None):
+    """
+    持有資產所屬類別 (與匯率) 中，距上次更新超過 SNAPSHOT_STALE_FACTOR 倍更新頻率的類別
+    背景更新停擺時，呼叫端據此改為同步抓價或標示為舊報價
+    """
+    if not snapshot:
+        return []
+    now = now or time.time()
+    refresher = refresher or PriceRefresher()
+    groups = classify_symbols(stock_symbols, crypto_ids)
+    updated_at = snapshot.get('updated_at', {})
+    return [cls for cls in ASSET_CLASSES if (cls == 'fx' or groups[cls])
+            and now - updated_at.get(cls, 0.0) > SNAPSHOT_STALE_FACTOR * refresher.period(cls, groups, now)]
+
+
+# --- 背景更新 ---
+class PriceRefresher:
+    """
+    依各資產類別的頻率定期更新報價並發布快照
+    可在同一程序內以執行緒執行 (start)，或以 python price_refresher.py 作為獨立程序
+    """
+
+    def __init__(self, intervals=None, tick=REFRESH_TICK):
+        self.intervals = intervals or _env_intervals()
+        self.tick = tick
+        self.last_error = None
+        self._refresh_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def interval(self, asset_class, now=None):
+        open_interval, closed_interval = self.intervals[asset_class]
+        return open_interval if is_market_open(asset_class, now) else closed_interval
+
+    def min_interval(self, asset_class, groups):
+        """依 provider 宣告的批次大小與速率上限，抓完該類別至少需要的秒數 (更新不會排得比這更密)"""
+        if asset_class == 'crypto':
+            return providers.estimate_seconds('crypto', groups['crypto'])
+        if asset_class in MARKET_HOURS:
+            # 台股、美股共用同一個 provider 的速率
+            return providers.estimate_seconds('stock', groups['tw_stock'] + groups['us_stock'])
+        return 0.0
+
+    def period(self, asset_class, groups, now=None):
+        """實際的更新間隔：設定的頻率與 provider 速率允許的最短間隔取大者"""
+        return max(self.interval(asset_class, now), self.min_interval(asset_class, groups))
+
+    def due_classes(self, now=None):
+        now = now or time.time()
+        snapshot = load_latest_snapshot() or {}
+        updated_at = snapshot.get('updated_at', {})
+        groups = classify_symbols(*_portfolio_symbols())
+        return [cls for cls in ASSET_CLASSES if now - updated_at.get(cls, 0) >= self.period(cls, groups, now)]
+
+    @metrics.timed("refresher.refresh")
+    def refresh(self, classes=None):
+        """立即更新指定類別 (預設全部) 並發布快照，回傳新快照"""
+        classes = list(classes or ASSET_CLASSES)
+        with self._refresh_lock:
+            stock_symbols, crypto_ids = _portfolio_symbols()
+            groups = classify_symbols(stock_symbols, crypto_ids)
+            updates, fx_table, report = {}, None, None
+            for asset_class in classes:
+                if asset_class == 'fx':
+                    fx_table = ah.get_fx_table()
+                elif asset_class == 'crypto':
+                    class_report = ah.empty_quote_report()
+                    updates['crypto'] = ah.get_crypto_prices(groups['crypto'], use_cache=False, report=class_report)
+                    report = _merge_reports(report, class_report)
+                else:
+                    prices, class_report = ah.get_stock_prices(groups[asset_class], use_cache=False)
+                    updates[asset_class] = prices
+                    report = _merge_reports(report, class_report)
+            keep_ids = set(stock_symbols) | set(crypto_ids)
+            return publish(updates, fx_table=fx_table, quote_report=report, keep_ids=keep_ids)
+
+    def run_once(self):
+        due = self.due_classes()
+        if due:
+            self.refresh(due)
+        return due
+
+    def run_forever(self):
+        while not self._stop.is_set():
+            try:
+                if self.run_once():
+                    metrics.write_prometheus_file()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+                metrics.record_error("refresher.run", e)
+                print(f"背景報價更新失敗: {e}")
+            self._stop.wait(self.tick)
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self.run_forever, name="price-refresher", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+
+def _merge_reports(a, b):
+    """合併兩份 quote_report：清單相接，'as_of' 這類 dict 合併"""
+    if a is None:
+        return {k: dict(v) if isinstance(v, dict) else list(v) for k, v in b.items()}
+    merged = {}
+    for k in set(a) | set(b):
+        if isinstance(a.get(k, b.get(k)), dict):
+            merged[k] = {**a.get(k, {}), **b.get(k, {})}
+        else:
+            merged[k] = a.get(k, []) + b.get(k, [])
+    return merged
+
+
+if __name__ == "__main__":
+    metrics.serve()
+    refresher = PriceRefresher()
+    if "--once" in sys.argv:
+        snap = refresher.refresh()
+        print(f"已發布快照 v{snap['version']}: {len(snap['prices'])} 筆報價")
+    else:
+        print(f"背景報價更新中 (快照目錄: {SNAPSHOT_DIR})，Ctrl+C 結束")
+        try:
+            refresher.run_forever()
+        except KeyboardInterrupt:
+            pass
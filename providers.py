@@ -0,0 +1,365 @@
+import abc
+import concurrent.futures
+import json
+import os
+import sqlite3
+import threading
+
+import api_handler as ah
+import metrics
+
+# --- 行情 provider ---
+# 每個 provider 宣告支援的能力 (quotes / history / fx)、報價的資產類別、單次請求最多幾個代號、
+# 最多同時幾個請求，以及速率上限；抓價時依這些設定切批次、排程
+# 各用途依 PROVIDER_CHAINS 的順序嘗試，前一個拿不到的代號交給下一個，斷路中的 provider 直接跳過
+# 可用環境變數覆寫，例如 PYASSET_PROVIDERS_STOCK=local,yahoo 或 PYASSET_PROVIDERS_FX=local
+CAPABILITIES = ('quotes', 'history', 'fx')
+PROVIDER_CHAINS = {
+    'stock': ('yahoo',),
+    'crypto': ('coingecko',),
+    'fx': ('exchangerate',),
+    'history': ('yahoo',),
+}
+BUILTIN_CHAINS = dict(PROVIDER_CHAINS)
+# 本機 provider 讀取的檔案 (.json 或 .db / .sqlite)
+LOCAL_PROVIDER_FILE = os.environ.get('PYASSET_LOCAL_PROVIDER', 'local_prices.json')
+# yfinance period 換算成天數 (本機 provider 切 K 線區間用)
+PERIOD_DAYS = {'1d': 1, '5d': 5, '1mo': 31, '3mo': 92, '6mo': 183, '1y': 366, '2y': 731, '5y': 1827,
+               'max': None}
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+class Provider(abc.ABC):
+    """
+    子類別必須實作三種能力 (少實作任何一個，建立實例時就會丟出 TypeError，不會等到抓價才發現):
+    quotes(asset_class, keys, report) -> {代號: 價格}；整批失敗時丟出例外，交給鏈上的下一個 provider
+    history(symbol, interval, period=None, start=None) -> 與 yfinance Ticker.history 相同欄位的 DataFrame 或 None
+    fx_table() -> ({幣別: 1 USD 可換多少}, 下次更新的 unix 時間或 None)
+    不支援的能力不列在 capabilities，並回傳「沒有資料」({} / None / (None, None))
+    rate_limit 為 None 時沿用 api_handler.PROVIDER_RATE_LIMITS 的設定
+    """
+    name = None
+    capabilities = ()
+    asset_classes = ()
+    batch_size = 1
+    max_concurrency = 1
+    rate_limit = None
+
+    def supports(self, capability, asset_class=None):
+        return capability in self.capabilities and (asset_class is None or asset_class in self.asset_classes)
+
+    def plan(self, keys):
+        """把代號切成每次請求的批次"""
+        size = max(1, int(self.batch_size))
+        return [keys[i:i + size] for i in range(0, len(keys), size)]
+
+    @abc.abstractmethod
+    def quotes(self, asset_class, keys, report):
+        ...
+
+    @abc.abstractmethod
+    def history(self, symbol, interval, period=None, start=None):
+        ...
+
+    @abc.abstractmethod
+    def fx_table(self):
+        ...
+
+
+class YahooProvider(Provider):
+    """yfinance 批次下載，批次缺值的代號逐檔補抓 (記在 report['fallback'])"""
+    name = 'yahoo'
+    capabilities = ('quotes', 'history')
+    asset_classes = ('stock',)
+    batch_size = 500
+    max_concurrency = 2
+
+    def quotes(self, asset_class, keys, report):
+        return ah.yahoo_quotes(keys, report)
+
+    def history(self, symbol, interval, period=None, start=None):
+        return ah.download_bars(symbol, interval, period=period, start=start)
+
+    def fx_table(self):
+        return None, None
+
+
+class CoinGeckoProvider(Provider):
+    """simple/price 以逗號分隔 ids 一次查多個幣種，價格以 BASE_CURRENCY 計"""
+    name = 'coingecko'
+    capabilities = ('quotes',)
+    asset_classes = ('crypto',)
+    batch_size = ah.COINGECKO_MAX_IDS_PER_CALL
+    max_concurrency = ah.HTTP_POOL_MAXSIZE
+
+    def plan(self, keys):
+        # 除了數量上限，還要避免 URL 過長
+        return ah.chunk_crypto_ids(keys)
+
+    def quotes(self, asset_class, keys, report):
+        return ah.fetch_crypto_chunk(keys)
+
+    def history(self, symbol, interval, period=None, start=None):
+        return None
+
+    def fx_table(self):
+        return None, None
+
+
+class ExchangeRateProvider(Provider):
+    name = 'exchangerate'
+    capabilities = ('fx',)
+
+    def quotes(self, asset_class, keys, report):
+        return {}
+
+    def history(self, symbol, interval, period=None, start=None):
+        return None
+
+    def fx_table(self):
+        return ah.download_fx_table()
+
+
+class LocalProvider(Provider):
+    """
+    從本機檔案讀報價、匯率與 K 線，不連網、每次結果相同，供離線使用、測試與 benchmark
+    JSON (與 benchmarks/fixtures 相同格式):
+        {"quotes": {代號: 價格}, "fx": {幣別: 1 USD 可換多少}, "bars": {代號: {interval: [[ts, close, volume], ...]}}}
+    SQLite (.db / .sqlite): quotes(key, value) / fx(currency, rate) / bars(symbol, interval, ts, close, volume)
+    加密貨幣價格與 CoinGecko 相同以 BASE_CURRENCY 計；檔案更新時自動重新載入，檔案不存在時甚麼都不回傳
+    """
+    name = 'local'
+    capabilities = ('quotes', 'history', 'fx')
+    asset_classes = ('stock', 'crypto')
+    batch_size = 10000
+    rate_limit = (0, None)
+
+    def __init__(self, path=None, name=None):
+        self.path = path or LOCAL_PROVIDER_FILE
+        self.name = name or self.name
+        self._data = None
+        self._mtime = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return {"quotes": {}, "fx": {}, "bars": {}}
+        with self._lock:
+            if self._mtime != mtime:
+                if self.path.endswith(('.db', '.sqlite', '.sqlite3')):
+                    self._data = self._read_sqlite()
+                else:
+                    with open(self.path, 'r', encoding='utf-8') as f:
+                        data = json.load(f)
+                    self._data = {"quotes": data.get('quotes', {}), "fx": data.get('fx', {}),
+                                  "bars": data.get('bars', {})}
+                self._mtime = mtime
+            return self._data
+
+    def _read_sqlite(self):
+        conn = sqlite3.connect(self.path)
+        try:
+            tables = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+            quotes = dict(conn.execute("SELECT key, value FROM quotes")) if 'quotes' in tables else {}
+            fx = dict(conn.execute("SELECT currency, rate FROM fx")) if 'fx' in tables else {}
+            bars = {}
+            if 'bars' in tables:
+                for symbol, interval, ts, close, volume in conn.execute(
+                        "SELECT symbol, interval, ts, close, volume FROM bars ORDER BY symbol, interval, ts"):
+                    bars.setdefault(symbol, {}).setdefault(interval, []).append([ts, close, volume])
+        finally:
+            conn.close()
+        return {"quotes": quotes, "fx": fx, "bars": bars}
+
+    def quotes(self, asset_class, keys, report):
+        quotes = self._load()["quotes"]
+        return {k: float(quotes[k]) for k in keys if quotes.get(k)}
+
+    def history(self, symbol, interval, period=None, start=None):
+        import pandas as pd
+        rows = self._load()["bars"].get(symbol, {}).get(interval)
+        if not rows:
+            return None
+        if start is not None:
+            since = pd.Timestamp(start).timestamp()
+        else:
+            days = PERIOD_DAYS.get(period or '1mo', 31)
+            since = rows[-1][0] - days * 86400 if days else None
+        if since is not None:
+            rows = [r for r in rows if r[0] >= since]
+        if not rows:
+            return None
+        ts, close, volume = zip(*rows)
+        index = pd.to_datetime(list(ts), unit='s', utc=True)
+        return pd.DataFrame({'Close': close, 'Volume': [float('nan') if v is None else v for v in volume]},
+                            index=index)
+
+    def fx_table(self):
+        return dict(self._load()["fx"]) or None, None
+
+
+# --- 註冊與 failover 鏈 ---
+def register(provider):
+    """註冊 (或以同名取代) provider；有宣告 rate_limit 的同時設定共用的 token bucket"""
+    if not isinstance(provider, Provider):
+        raise TypeError(f"price provider must subclass providers.Provider: {provider!r}")
+    if not provider.name:
+        raise ValueError(f"price provider has no name: {provider!r}")
+    unknown = set(provider.capabilities) - set(CAPABILITIES)
+    if unknown:
+        raise ValueError(f"price provider {provider.name}: unknown capabilities {sorted(unknown)}")
+    with _registry_lock:
+        _registry[provider.name] = provider
+    if provider.rate_limit is not None and provider.name not in ah.PROVIDER_RATE_LIMITS:
+        ah.set_rate_limit(provider.name, *provider.rate_limit)
+    return provider
+
+
+def get_provider(name):
+    return _registry[name]
+
+
+def set_chain(purpose, names):
+    """執行中改變某個用途的 provider 順序 (例如 benchmark 改用本機 provider)"""
+    PROVIDER_CHAINS[purpose] = tuple(names)
+
+
+def chain(purpose):
+    """回傳該用途 ('stock' / 'crypto' / 'fx' / 'history') 依序嘗試的 provider，未註冊的名稱略過"""
+    value = os.environ.get(f"PYASSET_PROVIDERS_{purpose.upper()}")
+    names = [n.strip() for n in value.split(',') if n.strip()] if value else PROVIDER_CHAINS.get(purpose, ())
+    providers = []
+    for name in names:
+        if name in _registry:
+            providers.append(_registry[name])
+        else:
+            print(f"Unknown price provider for {purpose}: {name}")
+    return providers
+
+
+def uses_builtin_chains():
+    """是否都是預設的 Yahoo / CoinGecko / exchangerate-api (asyncio 抓價引擎只支援這組)"""
+    return all([p.name for p in chain(purpose)] == list(names) for purpose, names in BUILTIN_CHAINS.items())
+
+
+def _available(provider):
+    return not ah.circuit_open(provider.name)
+
+
+# --- 排程 ---
+def plan_requests(purpose, keys):
+    """回傳 [(provider, 批次)]：鏈上第一個可用的 provider 依其 batch_size 切出的請求"""
+    keys = list(keys)
+    for provider in chain(purpose):
+        if provider.supports('quotes', purpose) and _available(provider):
+            return [(provider, batch) for batch in provider.plan(keys)]
+    return []
+
+
+def estimate_seconds(purpose, keys):
+    """依 provider 的速率上限估計抓完 keys 至少要幾秒 (持續速率，不計桶內剩餘的 token)"""
+    requests_by_provider = {}
+    for provider, _ in plan_requests(purpose, keys):
+        requests_by_provider[provider.name] = requests_by_provider.get(provider.name, 0) + 1
+    seconds = 0.0
+    for name, requests in requests_by_provider.items():
+        rate = ah.rate_limiter(name).rate
+        if rate:
+            seconds = max(seconds, requests / rate)
+    return seconds
+
+
+def fetch_quotes(asset_class, keys, report=None):
+    """
+    依 failover 鏈抓報價，回傳 {代號: 價格} (只含拿到的)
+    每個 provider 依 plan() 切批次，最多 max_concurrency 個批次同時進行；整批失敗或缺值的代號交給下一個 provider
+    report 的 'batch' / 'fallback' 記下取得方式，'providers' 記下每個代號由哪個 provider 取得
+    """
+    report = ah.empty_quote_report() if report is None else report
+    remaining = sorted(set(keys))
+    prices = {}
+    for provider in chain(asset_class):
+        if not remaining:
+            break
+        if not provider.supports('quotes', asset_class) or not _available(provider):
+            continue
+        batches = provider.plan(remaining)
+        fallback_before = set(report['fallback'])
+        fetched = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(len(batches),
+                                                                          provider.max_concurrency))) as executor:
+            futures = [executor.submit(provider.quotes, asset_class, batch, report) for batch in batches]
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    fetched.update({k: v for k, v in future.result().items() if v and v > 0})
+                except Exception as e:
+                    metrics.record_error(f"{provider.name}.quotes", e)
+                    print(f"{provider.name} quote batch failed: {e}")
+
+        fallback = set(report['fallback']) - fallback_before
+        batch = [k for k in fetched if k not in fallback]
+        report['batch'].extend(batch)
+        if batch and fallback_before:
+            # 前一個 provider 逐檔補抓失敗、這次批次拿到的，不再算在 fallback
+            report['fallback'][:] = [k for k in report['fallback'] if k not in fetched or k in fallback]
+        report.setdefault('providers', {}).update(dict.fromkeys(fetched, provider.name))
+        metrics.inc('quote_symbols_total', len(batch), provider=provider.name, source='batch')
+        metrics.inc('quote_symbols_total', len(fetched) - len(batch), provider=provider.name, source='fallback')
+        prices.update(fetched)
+        remaining = [k for k in remaining if k not in fetched]
+    return prices
+
+
+def fetch_history(symbol, interval, period=None, start=None):
+    """依 'history' 鏈取得 K 線，第一個有資料的 provider 為準；全部失敗時丟出最後一個例外"""
+    error = None
+    for provider in chain('history'):
+        if not provider.supports('history') or not _available(provider):
+            continue
+        try:
+            history = provider.history(symbol, interval, period=period, start=start)
+        except Exception as e:
+            error = e
+            continue
+        if history is not None and not history.empty:
+            return history
+    if error is not None:
+        raise error
+    return None
+
+
+def fetch_fx_table():
+    """依 'fx' 鏈取得 USD 基準匯率表，回傳 (rates, next_update_unix)；都失敗時回傳 (None, None)"""
+    for provider in chain('fx'):
+        if not provider.supports('fx') or not _available(provider):
+            continue
+        try:
+            rates, next_update = provider.fx_table()
+        except Exception as e:
+            metrics.record_error(f"{provider.name}.fx", e)
+            continue
+        if rates:
+            return rates, next_update
+    return None, None
+
+
+def provider_status():
+    """各 provider 的能力、批次大小與目前的鏈 (儀表板顯示用)"""
+    rows = []
+    for name, provider in sorted(_registry.items()):
+        rate, burst = ah.PROVIDER_RATE_LIMITS.get(name, (0, None))
+        rows.append({"provider": name, "capabilities": ",".join(provider.capabilities),
+                     "asset_classes": ",".join(provider.asset_classes), "batch_size": provider.batch_size,
+                     "max_concurrency": provider.max_concurrency, "rate": rate, "burst": burst,
+                     "chains": ",".join(p for p in PROVIDER_CHAINS if name in [x.name for x in chain(p)])})
+    return rows
+
+
+register(YahooProvider())
+register(CoinGeckoProvider())
+register(ExchangeRateProvider())
+register(LocalProvider())
@@ -0,0 +1,194 @@
+import threading
+import time
+
+import metrics
+
+# --- 速率限制、請求合併與斷路器 ---
+# TokenBucket: 每個 provider 一個桶，同一程序內所有執行緒 / Streamlit session 共用
+# SingleFlight: 同時間相同的請求 (同網址 / 同代號) 只送一次，其餘等待者共用結果
+# CircuitBreaker: 連續失敗達門檻就暫停呼叫該 provider，不再等待已知故障的主機
+CIRCUIT_STATES = {'closed': 0, 'open': 1, 'half_open': 2}
+
+
+class TokenBucket:
+    """
+    rate: 每秒補充的 token 數 (0 或 None 表示不限制)；burst: 桶容量
+    token 可以預借成負值，等待者依預約順序排隊，不會同時醒來再一起搶
+    """
+
+    def __init__(self, name, rate, burst=None):
+        self.name = name
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.throttled = 0
+        self.waited = 0.0
+        self.configure(rate, burst)
+
+    def configure(self, rate, burst=None):
+        with self._lock:
+            self.rate = float(rate or 0)
+            self.burst = float(burst or max(1.0, self.rate))
+            self._tokens = self.burst
+            self._updated = time.monotonic()
+        metrics.set_gauge('ratelimit_rate', self.rate, provider=self.name)
+        metrics.set_gauge('ratelimit_burst', self.burst, provider=self.name)
+
+    def reserve(self, n=1):
+        """預約 n 個 token，回傳需要等待的秒數 (呼叫端自行 sleep，asyncio 版可 await)"""
+        with self._lock:
+            self.requests += 1
+            if not self.rate:
+                wait = 0.0
+            else:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate) - n
+                self._updated = now
+                wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+            if wait > 0:
+                self.throttled += 1
+                self.waited += wait
+            tokens = self._tokens
+        metrics.inc('ratelimit_requests_total', provider=self.name)
+        if self.rate:
+            metrics.set_gauge('ratelimit_tokens', tokens, provider=self.name)
+        if wait > 0:
+            metrics.inc('ratelimit_throttled_total', provider=self.name)
+            metrics.observe('ratelimit_wait_seconds', wait, provider=self.name)
+        return wait
+
+    def acquire(self, n=1):
+        wait = self.reserve(n)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def status(self):
+        with self._lock:
+            tokens = min(self.burst, self._tokens + (time.monotonic() - self._updated) * self.rate) \
+                if self.rate else None
+            return {"provider": self.name, "rate": self.rate, "burst": self.burst, "tokens": tokens,
+                    "requests": self.requests, "throttled": self.throttled, "waited_s": self.waited}
+
+
+class _Call:
+    __slots__ = ('event', 'result', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """do(key, func, ...): 相同 key 已有呼叫在執行時直接等它的結果 (或例外)，不再重送"""
+
+    def __init__(self, name):
+        self.name = name
+        self.coalesced = 0
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, func, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.coalesced += 1
+        if not leader:
+            metrics.inc('coalesced_requests_total', group=self.name)
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func(*args, **kwargs)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+
+
+class CircuitOpenError(ConnectionError):
+    """斷路器開啟中，請求沒有送出"""
+
+    def __init__(self, provider, retry_in=0.0):
+        super().__init__(f"{provider} circuit open, retry in {retry_in:.0f}s")
+        self.provider = provider
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """
+    closed: 正常呼叫；連續 failure_threshold 次失敗後轉為 open
+    open: reset_timeout 秒內直接拒絕；時間到轉為 half_open
+    half_open: 只放行一個試探請求，成功回到 closed，失敗重新 open
+    """
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=60.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self.rejected = 0
+        self.last_error = None
+        self._probing = False
+        self._lock = threading.Lock()
+        metrics.set_gauge('circuit_state', 0, provider=name)
+
+    def _set_state(self, state):
+        self.state = state
+        metrics.set_gauge('circuit_state', CIRCUIT_STATES[state], provider=self.name)
+
+    def retry_in(self):
+        return max(0.0, self.opened_at + self.reset_timeout - time.monotonic()) if self.state == 'open' else 0.0
+
+    def allow(self):
+        with self._lock:
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self._set_state('half_open')
+            if self.state == 'closed' or (self.state == 'half_open' and not self._probing):
+                self._probing = self.state == 'half_open'
+                return True
+            self.rejected += 1
+        metrics.inc('circuit_rejected_total', provider=self.name)
+        return False
+
+    def check(self):
+        """不允許呼叫時丟出 CircuitOpenError"""
+        if not self.allow():
+            raise CircuitOpenError(self.name, self.retry_in())
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._probing = False
+            if self.state != 'closed':
+                self._set_state('closed')
+
+    def record_failure(self, error=None):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            self.last_error = str(error) if error is not None else self.last_error
+            if self.state == 'half_open' or (self.state == 'closed' and self.failures >= self.failure_threshold):
+                self.opened_at = time.monotonic()
+                self._set_state('open')
+                opened = True
+            else:
+                opened = False
+        if opened:
+            metrics.inc('circuit_opened_total', provider=self.name)
+
+    def status(self):
+        with self._lock:
+            return {"provider": self.name, "state": self.state, "failures": self.failures,
+                    "retry_in_s": self.retry_in(), "rejected": self.rejected, "last_error": self.last_error}
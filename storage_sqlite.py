@@ -0,0 +1,377 @@
+import json
+import sqlite3
+import sys
+
+import data_manager as dm
+
+# 每張表除了索引用的欄位外，另存一份完整 JSON (data 欄)，讀回時與檔案版格式完全相同
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS stocks (
+    symbol TEXT PRIMARY KEY,
+    currency TEXT,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS crypto (
+    id TEXT PRIMARY KEY,
+    symbol TEXT,
+    data TEXT NOT NULL
+);
+-- 每個資產的買入批次狀態 (ref 即持倉的 lot_ref)，買賣時只改寫該資產的一列
+CREATE TABLE IF NOT EXISTS lots (
+    ref TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS transactions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    date TEXT,
+    month TEXT,
+    category TEXT,
+    currency TEXT,
+    amount REAL,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS realized_pnl (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    date TEXT,
+    asset_id TEXT,
+    type TEXT,
+    currency TEXT,
+    pnl REAL,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS history (
+    date TEXT PRIMARY KEY,
+    net_worth REAL NOT NULL
+);
+-- 支出彙總 (月份 x 類別 x 幣別)，由觸發器在新增 / 刪除交易時就地加減
+CREATE TABLE IF NOT EXISTS expense_rollup (
+    month TEXT,
+    category TEXT,
+    currency TEXT,
+    total REAL NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (month, category, currency)
+);
+CREATE TRIGGER IF NOT EXISTS trg_tx_rollup_add AFTER INSERT ON transactions BEGIN
+    INSERT INTO expense_rollup VALUES (NEW.month, NEW.category, NEW.currency, NEW.amount, 1)
+    ON CONFLICT (month, category, currency) DO UPDATE SET total = total + excluded.total, count = count + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_tx_rollup_del AFTER DELETE ON transactions BEGIN
+    UPDATE expense_rollup SET total = total - OLD.amount, count = count - 1
+    WHERE month = OLD.month AND category = OLD.category AND currency = OLD.currency;
+    DELETE FROM expense_rollup WHERE count <= 0;
+END;
+CREATE INDEX IF NOT EXISTS idx_stocks_currency ON stocks (currency);
+CREATE INDEX IF NOT EXISTS idx_tx_date ON transactions (date);
+CREATE INDEX IF NOT EXISTS idx_tx_month_category ON transactions (month, category);
+CREATE INDEX IF NOT EXISTS idx_tx_category ON transactions (category);
+CREATE INDEX IF NOT EXISTS idx_tx_currency ON transactions (currency);
+CREATE INDEX IF NOT EXISTS idx_pnl_date ON realized_pnl (date);
+CREATE INDEX IF NOT EXISTS idx_pnl_asset ON realized_pnl (asset_id);
+CREATE INDEX IF NOT EXISTS idx_pnl_currency ON realized_pnl (currency);
+"""
+
+GROUP_COLUMNS = {'month', 'category', 'currency', 'date'}
+
+_ready = set()
+
+
+def connect():
+    path = dm.STORAGE_DB_FILE
+    conn = sqlite3.connect(path, timeout=10)
+    if path not in _ready:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(SCHEMA)
+        _backfill_expense_rollup(conn)
+        _ready.add(path)
+    return conn
+
+
+def _backfill_expense_rollup(conn):
+    """舊資料庫在加入彙總表之前已有交易時，補算一次"""
+    with conn:
+        if conn.execute("SELECT 1 FROM expense_rollup LIMIT 1").fetchone() is None:
+            conn.execute("INSERT INTO expense_rollup SELECT month, category, currency, SUM(amount), COUNT(*) "
+                         "FROM transactions GROUP BY month, category, currency")
+
+
+def _dumps(record):
+    return json.dumps(record, ensure_ascii=False)
+
+
+def _tx_row(tx):
+    date = tx.get('date', '')
+    return (date, date[:7], tx.get('category', '其他'), tx.get('currency', 'TWD'),
+            float(tx.get('amount', 0) or 0), _dumps(tx))
+
+
+def _pnl_row(r):
+    return (r.get('date', ''), r.get('asset_id') or r.get('name'), r.get('type'), r.get('currency', 'USD'),
+            float(r.get('pnl', 0) or 0), _dumps(r))
+
+
+# --- 投資組合 ---
+def load_portfolio():
+    conn = connect()
+    try:
+        stocks = [json.loads(d) for (d,) in conn.execute("SELECT data FROM stocks ORDER BY rowid")]
+        crypto = [json.loads(d) for (d,) in conn.execute("SELECT data FROM crypto ORDER BY rowid")]
+    finally:
+        conn.close()
+    return {"stocks": stocks, "crypto": crypto}
+
+
+def save_portfolio(data):
+    conn = connect()
+    try:
+        with conn:
+            conn.execute("DELETE FROM stocks")
+            conn.execute("DELETE FROM crypto")
+            conn.executemany("INSERT OR REPLACE INTO stocks VALUES (?, ?, ?)",
+                             [(s['symbol'], s.get('currency'), _dumps(s)) for s in data.get('stocks', [])])
+            conn.executemany("INSERT OR REPLACE INTO crypto VALUES (?, ?, ?)",
+                             [(c['id'], c.get('symbol'), _dumps(c)) for c in data.get('crypto', [])])
+    finally:
+        conn.close()
+
+
+# --- 買入批次 ---
+def load_lots(ref):
+    conn = connect()
+    try:
+        row = conn.execute("SELECT data FROM lots WHERE ref = ?", (ref,)).fetchone()
+    finally:
+        conn.close()
+    return json.loads(row[0]) if row else None
+
+
+def save_lots(ref, state):
+    conn = connect()
+    try:
+        with conn:
+            if state and state.get('lots'):
+                conn.execute("INSERT OR REPLACE INTO lots VALUES (?, ?)", (ref, _dumps(state)))
+            else:
+                conn.execute("DELETE FROM lots WHERE ref = ?", (ref,))
+    finally:
+        conn.close()
+
+
+# --- 交易紀錄 / 已實現損益 (共用的列表操作) ---
+_LIST_TABLES = {
+    'transactions': ("date, month, category, currency, amount, data", _tx_row),
+    'realized_pnl': ("date, asset_id, type, currency, pnl, data", _pnl_row),
+}
+
+
+def _load_list(table):
+    conn = connect()
+    try:
+        return [json.loads(d) for (d,) in conn.execute(f"SELECT data FROM {table} ORDER BY id")]
+    finally:
+        conn.close()
+
+
+def _save_list(table, records):
+    columns, to_row = _LIST_TABLES[table]
+    conn = connect()
+    try:
+        with conn:
+            conn.execute(f"DELETE FROM {table}")
+            conn.executemany(f"INSERT INTO {table} ({columns}) VALUES (?, ?, ?, ?, ?, ?)",
+                             [to_row(r) for r in records])
+    finally:
+        conn.close()
+
+
+def _append(table, record):
+    columns, to_row = _LIST_TABLES[table]
+    conn = connect()
+    try:
+        with conn:
+            conn.execute(f"INSERT INTO {table} ({columns}) VALUES (?, ?, ?, ?, ?, ?)", to_row(record))
+    finally:
+        conn.close()
+
+
+def _delete_at(table, index):
+    """依列表位置刪除 (與檔案版的 list.pop(index) 相同語意)"""
+    conn = connect()
+    try:
+        with conn:
+            conn.execute(f"DELETE FROM {table} WHERE id = (SELECT id FROM {table} ORDER BY id LIMIT 1 OFFSET ?)",
+                         (int(index),))
+    finally:
+        conn.close()
+
+
+def load_transactions():
+    return _load_list('transactions')
+
+
+def save_transactions(data):
+    _save_list('transactions', data)
+
+
+def append_transaction(record):
+    _append('transactions', record)
+
+
+def delete_transaction(index):
+    _delete_at('transactions', index)
+
+
+def load_realized_pnl():
+    return _load_list('realized_pnl')
+
+
+def save_realized_pnl(data):
+    _save_list('realized_pnl', data)
+
+
+def append_realized_pnl(record):
+    _append('realized_pnl', record)
+
+
+def delete_realized_pnl(index):
+    _delete_at('realized_pnl', index)
+
+
+# --- 索引查詢 ---
+def _where(start=None, end=None, month=None, category=None, currency=None):
+    clauses, params = [], []
+    if start:
+        clauses.append("date >= ?")
+        params.append(str(start))
+    if end:
+        clauses.append("date <= ?")
+        params.append(str(end))
+    if month:
+        clauses.append("month = ?")
+        params.append(month)
+    if category:
+        clauses.append("category = ?")
+        params.append(category)
+    if currency:
+        clauses.append("currency = ?")
+        params.append(currency)
+    return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+
+def query_transactions(start=None, end=None, month=None, category=None, currency=None):
+    where, params = _where(start, end, month, category, currency)
+    conn = connect()
+    try:
+        rows = conn.execute(f"SELECT data FROM transactions{where} ORDER BY id", params)
+        return [json.loads(d) for (d,) in rows]
+    finally:
+        conn.close()
+
+
+def rollup_transactions(by=('month', 'category', 'currency'), start=None, end=None, month=None, category=None,
+                        currency=None):
+    by = [c for c in by if c in GROUP_COLUMNS]
+    where, params = _where(start, end, month, category, currency)
+    select = ", ".join(by + ["SUM(amount)", "COUNT(*)"])
+    group = f" GROUP BY {', '.join(by)}" if by else ""
+    conn = connect()
+    try:
+        rows = conn.execute(f"SELECT {select} FROM transactions{where}{group}", params).fetchall()
+    finally:
+        conn.close()
+    return [dict(zip(by + ['total', 'count'], row)) for row in rows]
+
+
+def load_expense_rollup(month=None):
+    where, params = ("WHERE month = ?", [month]) if month else ("", [])
+    conn = connect()
+    try:
+        rows = conn.execute(f"SELECT month, category, currency, total, count FROM expense_rollup {where}",
+                            params).fetchall()
+    finally:
+        conn.close()
+    return [dict(zip(('month', 'category', 'currency', 'total', 'count'), row)) for row in rows]
+
+
+def expense_months():
+    conn = connect()
+    try:
+        return [m for (m,) in conn.execute("SELECT DISTINCT month FROM expense_rollup ORDER BY month DESC")]
+    finally:
+        conn.close()
+
+
+def query_realized_pnl(start=None, end=None, asset_id=None, currency=None):
+    clauses, params = [], []
+    for column, op, value in (('date', '>=', start), ('date', '<=', end), ('asset_id', '=', asset_id),
+                              ('currency', '=', currency)):
+        if value:
+            clauses.append(f"{column} {op} ?")
+            params.append(str(value))
+    where = (" WHERE " + " AND ".join(clauses)) if clauses else ""
+    conn = connect()
+    try:
+        rows = conn.execute(f"SELECT data FROM realized_pnl{where} ORDER BY id", params)
+        return [json.loads(d) for (d,) in rows]
+    finally:
+        conn.close()
+
+
+# --- 歷史淨值 ---
+def update_history(date_str, total_net_worth):
+    conn = connect()
+    try:
+        with conn:
+            conn.execute("INSERT INTO history VALUES (?, ?) ON CONFLICT(date) DO UPDATE SET net_worth = excluded.net_worth "
+                         "WHERE net_worth != excluded.net_worth", (date_str, float(total_net_worth)))
+    finally:
+        conn.close()
+
+
+def load_history_rows(start=None, end=None):
+    clauses, params = [], []
+    if start:
+        clauses.append("date >= ?")
+        params.append(str(start)[:10])
+    if end:
+        clauses.append("date <= ?")
+        params.append(str(end)[:10])
+    where = (" WHERE " + " AND ".join(clauses)) if clauses else ""
+    conn = connect()
+    try:
+        return conn.execute(f"SELECT date, net_worth FROM history{where} ORDER BY date", params).fetchall()
+    finally:
+        conn.close()
+
+
+# --- 一次性遷移 ---
+def migrate_from_files():
+    """把目前 JSON / CSV 檔案中的資料全部匯入 SQLite (覆蓋資料庫內既有內容)"""
+    data = dm.export_file_data()
+    save_portfolio(data['portfolio'])
+    save_transactions(data['transactions'])
+    save_realized_pnl(data['realized_pnl'])
+    conn = connect()
+    try:
+        with conn:
+            conn.execute("DELETE FROM history")
+            conn.executemany("INSERT OR REPLACE INTO history VALUES (?, ?)", data['history'])
+            conn.execute("DELETE FROM lots")
+            conn.executemany("INSERT OR REPLACE INTO lots VALUES (?, ?)",
+                             [(ref, _dumps(state)) for ref, state in data['lots'].items()])
+    finally:
+        conn.close()
+    return {name: len(rows) for name, rows in (('stocks', data['portfolio']['stocks']),
+                                                ('crypto', data['portfolio']['crypto']),
+                                                ('transactions', data['transactions']),
+                                                ('realized_pnl', data['realized_pnl']),
+                                                ('history', data['history']),
+                                                ('lots', data['lots']))}
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "migrate":
+        counts = migrate_from_files()
+        print(f"已匯入 {dm.STORAGE_DB_FILE}: " + ", ".join(f"{k} {v} 筆" for k, v in counts.items()))
+    else:
+        print("用法: python storage_sqlite.py migrate")
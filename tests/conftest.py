@@ -0,0 +1,33 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (ROOT, os.path.join(ROOT, 'benchmarks')):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """在暫存目錄執行：資料檔、日誌與 SQLite 快取都寫在 tmp_path，並清掉 data_manager 的記憶體狀態"""
+    import data_manager as dm
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(dm, 'STORAGE_BACKEND', 'file')
+    monkeypatch.setattr(dm, 'JOURNAL_FSYNC', False)
+    dm._journal_state.clear()
+    dm._expense_rollup.clear()
+    dm._compacting.clear()
+    yield tmp_path
+    dm._journal_state.clear()
+    dm._expense_rollup.clear()
+    dm._compacting.clear()
+
+
+@pytest.fixture
+def fresh_breakers(monkeypatch):
+    """每個測試使用新的斷路器，不受其他測試留下的失敗次數影響"""
+    import api_handler as ah
+    monkeypatch.setattr(ah, '_breakers', {})
+    return ah
@@ -0,0 +1,217 @@
+import pytest
+import requests
+
+import ratelimit as rl
+
+
+class _FakeSession:
+    def __init__(self, status):
+        self.status = status
+        self.calls = 0
+
+    def get(self, url, params=None, timeout=None):
+        self.calls += 1
+        response = requests.Response()
+        response.status_code = self.status
+        response._content = b'{"bitcoin": {"twd": 1.0}}'
+        response._content_consumed = True
+        response.url = url
+        return response
+
+
+@pytest.fixture
+def fake_session(fresh_breakers, monkeypatch):
+    ah = fresh_breakers
+    session = _FakeSession(503)
+    monkeypatch.setattr(ah, 'get_session', lambda: session)
+    monkeypatch.setattr(ah, 'HTTP_BACKOFF_BASE', 0)
+    monkeypatch.setattr(ah, 'rate_limiter', lambda provider: rl.TokenBucket(provider, 0))
+    return ah, session
+
+
+def test_repeated_5xx_opens_the_breaker(fake_session):
+    ah, session = fake_session
+    for _ in range(ah.CIRCUIT_FAILURE_THRESHOLD):
+        with pytest.raises(requests.HTTPError):
+            ah.fetch_crypto_chunk(['bitcoin'])
+    assert ah.circuit_breaker('coingecko').state == 'open'
+    assert ah.circuit_breaker('coingecko').failures == ah.CIRCUIT_FAILURE_THRESHOLD
+    # 每次呼叫都用完重試
+    assert session.calls == ah.CIRCUIT_FAILURE_THRESHOLD * (ah.HTTP_MAX_RETRIES + 1)
+
+    with pytest.raises(rl.CircuitOpenError):
+        ah.fetch_crypto_chunk(['bitcoin'])
+    assert session.calls == ah.CIRCUIT_FAILURE_THRESHOLD * (ah.HTTP_MAX_RETRIES + 1)
+    assert ah.circuit_open('coingecko')
+
+
+def test_success_after_failures_closes_the_breaker(fake_session):
+    ah, session = fake_session
+    with pytest.raises(requests.HTTPError):
+        ah.fetch_crypto_chunk(['bitcoin'])
+    session.status = 200
+    assert ah.fetch_crypto_chunk(['bitcoin']) == {'bitcoin': 1.0}
+    assert ah.circuit_breaker('coingecko').failures == 0
+
+
+def test_client_errors_do_not_trip_the_breaker(fake_session):
+    ah, session = fake_session
+    session.status = 404
+    for _ in range(ah.CIRCUIT_FAILURE_THRESHOLD + 1):
+        with pytest.raises(requests.HTTPError):
+            ah.fetch_crypto_chunk(['bitcoin'])
+    assert ah.circuit_breaker('coingecko').state == 'closed'
+    assert session.calls == ah.CIRCUIT_FAILURE_THRESHOLD + 1
+
+
+class _FakeTicker:
+    def __init__(self, yf, symbol, session=None):
+        self.yf, self.symbol, self.session = yf, symbol, session
+
+    @property
+    def info(self):
+        self.yf.calls.append('info')
+        if self.yf.failures:
+            self.yf.failures -= 1
+            raise ConnectionError('reset by peer')
+        return {}
+
+    @property
+    def fast_info(self):
+        return _FastInfo(self.yf)
+
+
+class _FastInfo:
+    """與 yfinance 相同，讀 last_price 時才發出請求"""
+
+    def __init__(self, yf):
+        self.yf = yf
+
+    @property
+    def last_price(self):
+        self.yf.calls.append('fast_info')
+        return 12.5
+
+
+class _FakeYFinance:
+    def __init__(self):
+        self.calls, self.sessions, self.failures = [], [], 0
+
+    def Ticker(self, symbol, session=None):  # noqa: N802
+        self.sessions.append(session)
+        return _FakeTicker(self, symbol, session)
+
+
+@pytest.fixture
+def fake_yf(fresh_breakers, monkeypatch):
+    ah = fresh_breakers
+    yf = _FakeYFinance()
+    bucket = rl.TokenBucket('yahoo', 0)
+    monkeypatch.setitem(__import__('sys').modules, 'yfinance', yf)
+    monkeypatch.setattr(ah, 'rate_limiter', lambda provider: bucket)
+    monkeypatch.setattr(ah, 'HTTP_BACKOFF_BASE', 0)
+    return ah, yf, bucket
+
+
+def test_yahoo_calls_share_session_and_take_a_token_each(fake_yf):
+    ah, yf, bucket = fake_yf
+    assert ah._yahoo_quote('AAPL') == (12.5, True)
+    assert yf.calls == ['info', 'fast_info']
+    assert bucket.requests == 2
+    assert yf.sessions == [ah.get_session()]
+
+
+def test_yahoo_calls_retry_connection_errors(fake_yf):
+    ah, yf, bucket = fake_yf
+    yf.failures = 2
+    assert ah._yahoo_quote('AAPL') == (12.5, True)
+    assert yf.calls == ['info'] * 3 + ['fast_info']
+    assert bucket.requests == 4
+
+    yf.calls.clear()
+    yf.failures = ah.HTTP_MAX_RETRIES + 1
+    with pytest.raises(ConnectionError):
+        ah._yahoo_quote('AAPL')
+    assert yf.calls == ['info'] * (ah.HTTP_MAX_RETRIES + 1)
+
+
+# --- 匯率表 ---
+USD_TABLE = {"USD": 1.0, "TWD": 32.0, "JPY": 160.0, "EUR": 0.8}
+
+
+@pytest.fixture
+def fx(workdir, monkeypatch):
+    """以假的 USD 基準表取代 fx provider 鏈，時間由 clock 控制"""
+    import api_handler as ah
+    import providers
+    clock = [1_000_000.0]
+    calls = []
+
+    def fetch_fx_table():
+        calls.append(clock[0])
+        return dict(USD_TABLE), clock[0] + 3600
+
+    monkeypatch.setattr(ah, '_fx_table', {"rates": None, "expires_at": 0.0})
+    monkeypatch.setattr(ah.time, 'time', lambda: clock[0])
+    monkeypatch.setattr(providers, 'fetch_fx_table', fetch_fx_table)
+    return ah, clock, calls
+
+
+def test_cross_rates_are_derived_from_the_usd_table(fx):
+    ah, clock, calls = fx
+    assert ah.get_fx_table() == USD_TABLE
+    twd = ah.derive_rates(ah.get_fx_table(), "TWD")
+    assert twd["JPY"] == pytest.approx(5.0)
+    assert twd["EUR"] == pytest.approx(0.025)
+    assert twd["USD"] == pytest.approx(1 / 32)
+    assert ah.get_conversion_rates_to("TWD") == pytest.approx({"USD": 32.0, "TWD": 1.0, "JPY": 0.2, "EUR": 40.0})
+    assert ah.get_fx_rate("EUR", "JPY") == pytest.approx(200.0)
+    assert ah.derive_rates(USD_TABLE, "KRW") is None
+    assert len(calls) == 1
+
+
+def test_fx_table_is_refetched_only_after_next_update(fx):
+    ah, clock, calls = fx
+    ah.get_fx_table()
+    next_update = calls[0] + 3600
+    clock[0] = next_update - 1
+    ah.get_fx_table()
+    # 記憶體清掉後 (例如新的程序) 由 SQLite 取得，仍不發請求
+    ah._fx_table["rates"] = None
+    assert ah.get_fx_table() == USD_TABLE
+    assert len(calls) == 1
+    clock[0] = next_update
+    ah.get_fx_table()
+    assert calls == [calls[0], next_update]
+
+
+# --- SQLite 報價快取 ---
+def test_quote_cache_round_trip_and_expiry(workdir, monkeypatch):
+    import api_handler as ah
+    clock = [1_000_000.0]
+    monkeypatch.setattr(ah.time, 'time', lambda: clock[0])
+    monkeypatch.setattr(ah, '_fx_table', {"rates": None, "expires_at": 0.0})
+
+    ah.cache_put('stock', {'AAPL': 190.5, '2330.TW': 600})
+    ah.cache_put('crypto', {'bitcoin': 3_000_000}, ttl=10)
+    assert (workdir / ah.QUOTE_CACHE_FILE).exists()
+    assert ah.cache_get('stock', ['AAPL', '2330.TW', 'MSFT']) == {'AAPL': (190.5, clock[0]),
+                                                                 '2330.TW': (600.0, clock[0])}
+    assert ah.cache_get('crypto', ['AAPL']) == {}
+
+    # 過期後一般讀取拿不到，include_expired 仍回傳最後一次的價格 (舊報價)
+    clock[0] += 11
+    assert ah.cache_get('crypto', ['bitcoin']) == {}
+    assert ah.cache_get('crypto', ['bitcoin'], include_expired=True) == {'bitcoin': (3_000_000.0, clock[0] - 11)}
+    clock[0] += ah.CACHE_TTL['stock']
+    assert ah.cache_get('stock', ['AAPL']) == {}
+
+    # 覆寫同一個 key 會更新價格與到期時間
+    ah.cache_put('stock', {'AAPL': 200})
+    assert ah.cache_get('stock', ['AAPL']) == {'AAPL': (200.0, clock[0])}
+
+    ah.clear_quote_cache('crypto')
+    assert ah.cache_get('crypto', ['bitcoin'], include_expired=True) == {}
+    assert ah.cache_get('stock', ['AAPL']) == {'AAPL': (200.0, clock[0])}
+    ah.clear_quote_cache()
+    assert ah.cache_get('stock', ['AAPL'], include_expired=True) == {}
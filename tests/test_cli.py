@@ -0,0 +1,32 @@
+import json
+
+import cli
+import data_manager as dm
+
+EMPTY = {"stocks": [], "crypto": []}
+HOLDING = {"stocks": [{"symbol": "AAPL", "name": "Apple", "currency": "USD", "shares": 2, "avg_cost": 100.0}],
+           "crypto": []}
+
+
+def _prices(portfolios, use_snapshot=False):
+    return {"USD": 1.0, "TWD": 32.0}, {}, {"AAPL": 150.0}, {}
+
+
+def test_default_portfolio_history_goes_through_backend(workdir, monkeypatch):
+    (workdir / dm.PORTFOLIO_FILE).write_text(json.dumps(HOLDING), encoding='utf-8')
+    (workdir / 'other.json').write_text(json.dumps(EMPTY), encoding='utf-8')
+    calls = []
+    monkeypatch.setattr(cli, 'fetch_prices', _prices)
+    monkeypatch.setattr(dm, 'update_history', lambda total, history_file=None: calls.append((total, history_file)))
+
+    cli.value_portfolios([None, dm.PORTFOLIO_FILE, str(workdir / dm.PORTFOLIO_FILE), 'other.json'])
+    assert calls == [(9600.0, None), (9600.0, None), (9600.0, None), (0.0, 'other.history.csv')]
+
+
+def test_missing_prices_skip_history(workdir, monkeypatch):
+    (workdir / 'p.json').write_text(json.dumps(HOLDING), encoding='utf-8')
+    calls = []
+    monkeypatch.setattr(cli, 'fetch_prices', lambda portfolios, use_snapshot=False: ({"TWD": 32.0}, {}, {}, {}))
+    monkeypatch.setattr(dm, 'update_history', lambda *args, **kwargs: calls.append(args))
+    [result] = cli.value_portfolios(['p.json'])
+    assert result["missing_prices"] == ['AAPL'] and calls == []
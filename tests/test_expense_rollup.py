@@ -0,0 +1,54 @@
+import json
+
+import data_manager as dm
+
+
+def _tx(date, amount, category='餐飲', currency='TWD'):
+    return {'date': date, 'amount': amount, 'category': category, 'currency': currency}
+
+
+def _buckets(rows):
+    return {(r['month'], r['category'], r['currency']): (r['total'], r['count']) for r in rows}
+
+
+def test_rollup_tracks_appends_and_deletes(workdir):
+    records = [_tx('2024-01-05', 100), _tx('2024-01-20', 50), _tx('2024-02-01', 30, '交通', 'USD')]
+    for tx in records:
+        dm.append_transaction(tx)
+    assert _buckets(dm.load_expense_rollup()) == {('2024-01', '餐飲', 'TWD'): (150, 2),
+                                                 ('2024-02', '交通', 'USD'): (30, 1)}
+    dm.delete_transaction(2, records[2])
+    assert _buckets(dm.load_expense_rollup()) == {('2024-01', '餐飲', 'TWD'): (150, 2)}
+    assert _buckets(dm.load_expense_rollup('2024-02')) == {}
+    assert _buckets(dm.load_expense_rollup()) == _buckets(dm.rollup_transactions())
+
+
+def test_rollup_rebuilds_when_out_of_sync(workdir):
+    dm.append_transaction(_tx('2024-01-05', 100))
+    dm.append_transaction(_tx('2024-03-05', 7))
+    data = json.loads((workdir / dm.EXPENSE_ROLLUP_FILE).read_text(encoding='utf-8'))
+    data['journal_seq'] = 0
+    data['buckets'] = []
+    (workdir / dm.EXPENSE_ROLLUP_FILE).write_text(json.dumps(data), encoding='utf-8')
+    dm._expense_rollup.clear()
+    assert _buckets(dm.load_expense_rollup()) == {('2024-01', '餐飲', 'TWD'): (100, 1),
+                                                 ('2024-03', '餐飲', 'TWD'): (7, 1)}
+
+
+def test_expense_months_follow_rollup(workdir):
+    for tx in (_tx('2024-01-05', 100), _tx('2024-03-01', 30), _tx('2024-01-20', 50, '交通')):
+        dm.append_transaction(tx)
+    assert dm.expense_months() == ['2024-03', '2024-01']
+    dm.delete_transaction(1, _tx('2024-03-01', 30))
+    assert dm.expense_months() == ['2024-01']
+
+
+def test_sqlite_backend_month_queries(workdir, monkeypatch):
+    import storage_sqlite
+    monkeypatch.setattr(dm, 'STORAGE_BACKEND', 'sqlite')
+    monkeypatch.setattr(storage_sqlite, '_ready', set())
+    dm.save_transactions([_tx('2024-01-05', 100), _tx('2024-02-01', 30, '交通'), _tx('2024-02-10', 5)])
+    assert dm.expense_months() == ['2024-02', '2024-01']
+    assert _buckets(dm.load_expense_rollup('2024-02')) == {('2024-02', '交通', 'TWD'): (30, 1),
+                                                          ('2024-02', '餐飲', 'TWD'): (5, 1)}
+    assert dm.query_transactions(month='2024-01') == [_tx('2024-01-05', 100)]
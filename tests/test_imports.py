@@ -0,0 +1,18 @@
+import os
+
+import pytest
+
+import bench_imports as bi
+
+# 共用 CI 機器較慢時可放寬，例如 PYASSET_IMPORT_BUDGET_SCALE=2
+BUDGET_SCALE = float(os.environ.get('PYASSET_IMPORT_BUDGET_SCALE', '1'))
+
+
+@pytest.mark.parametrize("name", sorted(bi.TARGETS))
+def test_import_budget(name):
+    if name == 'dashboard':
+        pytest.importorskip('streamlit')
+    result = bi.check(name, repeat=3, budget_scale=BUDGET_SCALE)
+    assert not result["early_imports"], f"{name} 提前載入: {result['early_imports']}"
+    assert result["median_ms"] <= result["budget_ms"], \
+        f"{name} import 花了 {result['median_ms']:.1f} ms，預算 {result['budget_ms']:.0f} ms"
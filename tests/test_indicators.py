@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import indicators as ind
+
+NAMES = ['SMA5', 'SMA20', 'EMA12', 'BB20', 'RSI14', 'MACD', 'VWAP']
+
+
+def _bars(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'Datetime': pd.date_range('2024-01-01', periods=n, freq='D'),
+        'Close': 100 + rng.normal(0, 1, n).cumsum(),
+        'Volume': rng.integers(1_000, 10_000, n).astype(float),
+    })
+
+
+@pytest.fixture(autouse=True)
+def _clear_cache():
+    ind.clear_cache()
+    yield
+    ind.clear_cache()
+
+
+def test_sma_matches_rolling_mean():
+    df = _bars(60)
+    out = ind.compute_indicators(df, ['SMA5', 'SMA20'])
+    expected = df['Close'].rolling(5).mean()
+    np.testing.assert_allclose(out.iloc[:, 0], expected, equal_nan=True)
+    assert out.iloc[:, 1].isna().sum() == 19
+
+
+def test_rsi_stays_in_range():
+    out = ind.compute_indicators(_bars(200), ['RSI14'])
+    values = out.iloc[:, 0].dropna()
+    assert len(values) and values.between(0, 100).all()
+
+
+def test_incremental_update_matches_full_compute():
+    df = _bars(120)
+    ind.get_indicators(df.iloc[:100], 'X', '1d', NAMES)
+    # 新增 K 線
+    out = ind.get_indicators(df, 'X', '1d', NAMES)
+    pd.testing.assert_frame_equal(out, ind.compute_indicators(df, NAMES), check_exact=False, rtol=1e-9)
+    # 最後一根更新
+    changed = df.copy()
+    changed.loc[changed.index[-1], 'Close'] += 3
+    out = ind.get_indicators(changed, 'X', '1d', NAMES)
+    pd.testing.assert_frame_equal(out, ind.compute_indicators(changed, NAMES), check_exact=False, rtol=1e-9)
+
+
+def test_cached_prefix_is_sliced():
+    df = _bars(80)
+    ind.get_indicators(df, 'X', '1d', NAMES)
+    out = ind.get_indicators(df.iloc[:50], 'X', '1d', ['SMA5'])
+    pd.testing.assert_frame_equal(out, ind.compute_indicators(df.iloc[:50], ['SMA5']))
+
+
+def test_parse_names():
+    assert ind.parse_names(['sma5', 'MACD']) == {('SMA', 5), ('MACD', 0)}
+    with pytest.raises(ValueError):
+        ind.parse_names(['FOO'])
+
+
+def test_result_does_not_depend_on_cache_contents():
+    df = _bars(150)
+    window = df.iloc[40:].reset_index(drop=True)
+    expected = ind.compute_indicators(window, NAMES)
+    # 先快取較早開始的整段，再要較晚開始的區間：遞迴指標不能沿用整段的狀態
+    ind.get_indicators(df, 'X', '1d', NAMES)
+    pd.testing.assert_frame_equal(ind.get_indicators(window, 'X', '1d', NAMES), expected)
+    # 兩個起點的快取並存，交替讀取結果不變
+    pd.testing.assert_frame_equal(ind.get_indicators(df, 'X', '1d', NAMES), ind.compute_indicators(df, NAMES))
+    pd.testing.assert_frame_equal(ind.get_indicators(window, 'X', '1d', NAMES), expected)
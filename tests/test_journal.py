@@ -0,0 +1,36 @@
+import json
+
+import data_manager as dm
+
+
+def _tx(date, amount, category='餐飲', currency='TWD'):
+    return {'date': date, 'amount': amount, 'category': category, 'currency': currency}
+
+
+def test_append_and_delete_are_replayed(workdir):
+    for tx in (_tx('2024-01-05', 100), _tx('2024-01-20', 50, '交通'), _tx('2024-02-01', 30)):
+        dm.append_transaction(tx)
+    dm.delete_transaction(1, _tx('2024-01-20', 50, '交通'))
+    assert dm.load_transactions() == [_tx('2024-01-05', 100), _tx('2024-02-01', 30)]
+    # 快照檔尚未寫入，紀錄都在日誌裡
+    assert len((workdir / 'transactions.journal.jsonl').read_text(encoding='utf-8').splitlines()) == 4
+
+
+def test_compaction_preserves_records(workdir):
+    for i in range(10):
+        dm.append_transaction(_tx(f'2024-01-{i + 1:02d}', i))
+    dm.delete_transaction(0, _tx('2024-01-01', 0))
+    before = dm.load_transactions()
+    dm.compact_journal(dm.TRANSACTIONS_FILE)
+    assert (workdir / 'transactions.journal.jsonl').read_text(encoding='utf-8') == ''
+    assert dm.load_transactions() == before
+    dm.append_transaction(_tx('2024-02-01', 99))
+    assert dm.load_transactions() == before + [_tx('2024-02-01', 99)]
+    assert json.loads((workdir / dm.TRANSACTIONS_FILE).read_text(encoding='utf-8'))['journal_seq'] == 11
+
+
+def test_torn_last_journal_line_is_ignored(workdir):
+    dm.append_transaction(_tx('2024-01-05', 100))
+    with open(workdir / 'transactions.journal.jsonl', 'a', encoding='utf-8') as f:
+        f.write('{"op": "add", "rec')
+    assert dm.load_transactions() == [_tx('2024-01-05', 100)]
@@ -0,0 +1,182 @@
+import json
+
+import pytest
+
+import data_manager as dm
+import lot_ledger as ll
+
+
+def _ledger(method):
+    ledger = ll.LotLedger(method)
+    ledger.buy('A', 10, 100, '2024-01-01')
+    ledger.buy('A', 10, 200, '2024-02-01')
+    return ledger
+
+
+def test_fifo_consumes_oldest_lots_first():
+    ledger = _ledger(ll.FIFO)
+    matches = ledger.sell('A', 15, 250, '2024-03-01')
+    assert [(m["buy_date"], m["qty"], m["unit_cost"]) for m in matches] == [
+        ('2024-01-01', 10, 100), ('2024-02-01', 5, 200)]
+    assert sum(m["pnl"] for m in matches) == pytest.approx(10 * 150 + 5 * 50)
+    assert ledger.position('A') == (5, 200)
+
+
+def test_lifo_consumes_newest_lots_first():
+    ledger = _ledger(ll.LIFO)
+    matches = ledger.sell('A', 15, 250)
+    assert [(m["qty"], m["unit_cost"]) for m in matches] == [(10, 200), (5, 100)]
+    assert ledger.position('A') == (5, 100)
+
+
+def test_average_keeps_remaining_average_cost():
+    ledger = _ledger(ll.AVERAGE)
+    matches = ledger.sell('A', 5, 250)
+    assert all(m["unit_cost"] == pytest.approx(150) for m in matches)
+    qty, avg = ledger.position('A')
+    assert qty == 15 and avg == pytest.approx(150)
+    # 之後的買入照實際價格加入，平均成本重新加權
+    ledger.buy('A', 5, 50)
+    assert ledger.position('A')[1] == pytest.approx((15 * 150 + 5 * 50) / 20)
+    assert sum(lot["qty"] * lot["price"] for lot in ledger.lots('A')) == pytest.approx(15 * 150 + 5 * 50)
+
+
+def test_oversell_and_bad_input_raise():
+    ledger = _ledger(ll.FIFO)
+    with pytest.raises(ValueError):
+        ledger.sell('A', 21, 100)
+    with pytest.raises(ValueError):
+        ledger.sell('B', 1, 100)
+    with pytest.raises(ValueError):
+        ledger.buy('A', 0, 100)
+    with pytest.raises(ValueError):
+        ll.LotLedger('HIFO')
+
+
+def test_holding_round_trip_and_legacy_holding():
+    holding = {'shares': 4, 'avg_cost': 25.0}
+    ledger = ll.LotLedger.from_holding('A', holding, 'shares')
+    assert ledger.lots('A') == [{"date": None, "qty": 4, "price": 25.0}]
+    ledger.buy('A', 4, 35.0, '2024-01-02')
+    state = ledger.write_holding('A', holding, 'shares')
+    assert holding == {'shares': 8, 'avg_cost': pytest.approx(30.0)}
+    again = ll.LotLedger.from_holding('A', holding, 'shares', state=state)
+    assert again.lots('A') == ledger.lots('A')
+
+
+def test_summarize_matches():
+    ledger = _ledger(ll.FIFO)
+    qty, avg, pnl, roi = ll.summarize_matches(ledger.sell('A', 20, 300))
+    assert qty == 20
+    assert avg == pytest.approx(150)
+    assert pnl == pytest.approx(3000)
+    assert roi == pytest.approx(100)
+    assert ll.summarize_matches([]) == (0, 0.0, 0, 0.0)
+
+
+@pytest.mark.parametrize("method", ll.METHODS)
+def test_sell_all_then_buy(method):
+    holding = {'shares': 0}
+    ledger = ll.LotLedger.from_holding('A', holding, 'shares')
+    ledger.buy('A', 10, 100, '2024-01-01')
+    ledger.buy('A', 10, 0, '2024-01-02')
+    ledger.sell('A', 20, 120, method=method)
+    state = ledger.write_holding('A', holding, 'shares')
+    assert holding['shares'] == 0 and state['lots'] == []
+    assert state['scale'] == 1.0
+
+    ledger = ll.LotLedger.from_holding('A', holding, 'shares', state=state)
+    ledger.buy('A', 5, 80, '2024-02-01')
+    assert ledger.position('A') == (5, 80)
+    assert ledger.lots('A') == [{"date": '2024-02-01', "qty": 5, "price": 80}]
+
+
+def test_average_sale_leaving_zero_raw_cost_keeps_cost():
+    ledger = ll.LotLedger(ll.AVERAGE)
+    ledger.buy('A', 10, 100)
+    ledger.buy('A', 10, 0)
+    # 先賣掉有成本的那批，剩下原始成本為 0 的批次仍要保有平均成本 50
+    ledger.sell('A', 10, 60)
+    assert ledger.position('A') == (10, 50)
+    ledger.buy('A', 10, 150)
+    assert ledger.position('A')[1] == pytest.approx(100)
+
+
+def test_state_is_persisted_instead_of_replayed():
+    holding = {'amount': 0}
+    ledger = ll.LotLedger.from_holding('A', holding, 'amount', ll.AVERAGE)
+    for day in range(1, 11):
+        ledger.buy('A', 1, 100 + day, f'2024-01-{day:02d}')
+    ledger.sell('A', 3, 200)
+    state = ledger.write_holding('A', holding, 'amount')
+    assert state['head'] == 3
+    assert ll.open_lot_count(state) == 7
+
+    # 重新讀入沿用同一個 list 與 scale，不逐批重播
+    again = ll.LotLedger.from_holding('A', holding, 'amount', ll.AVERAGE, state)
+    assert again._positions['A'].lots is state['lots']
+    assert again.position('A') == pytest.approx(ledger.position('A'))
+    matches = again.sell('A', 4, 200, method=ll.FIFO)
+    assert [m["buy_date"] for m in matches] == ['2024-01-04', '2024-01-05', '2024-01-06', '2024-01-07']
+    state = again.write_holding('A', holding, 'amount')
+    # 已賣完的批次過半後才刪除
+    assert state['head'] == 0 and len(state['lots']) == 3
+    assert holding['amount'] == 3 and ll.open_lot_count(state) == 3
+
+
+def test_lots_are_stored_per_asset_outside_the_portfolio(workdir):
+    holding = {'symbol': '2330.TW', 'shares': 0, 'avg_cost': 0.0}
+    ledger = ll.LotLedger.from_holding('2330.TW', holding, 'shares')
+    ledger.buy('2330.TW', 1000, 500.0, '2024-01-01')
+    ref = dm.lot_ref('stocks', '2330.TW')
+    dm.save_lots(ref, ledger.write_holding('2330.TW', holding, 'shares'))
+    holding['lot_ref'] = ref
+    dm.save_portfolio({'stocks': [holding], 'crypto': []})
+
+    with open(dm.PORTFOLIO_FILE, encoding='utf-8') as f:
+        assert json.load(f)['stocks'] == [{'symbol': '2330.TW', 'shares': 1000, 'avg_cost': 500.0,
+                                           'lot_ref': 'stocks/2330.TW'}]
+    state = dm.load_lots(holding['lot_ref'])
+    again = ll.LotLedger.from_holding('2330.TW', holding, 'shares', state=state)
+    assert again.lots('2330.TW') == [{"date": '2024-01-01', "qty": 1000, "price": 500.0}]
+
+    # 全部賣出後批次檔一併移除
+    again.sell('2330.TW', 1000, 600.0)
+    dm.save_lots(ref, again.write_holding('2330.TW', holding, 'shares'))
+    assert dm.load_lots(ref) is None
+
+
+def test_legacy_lots_move_out_of_the_portfolio(workdir):
+    legacy = {
+        'stocks': [{'symbol': 'AAPL', 'shares': 5, 'avg_cost': 120.0,
+                    'lots': [{'date': '2024-01-01', 'qty': 5, 'price': 120.0},
+                             {'date': '2024-01-02', 'qty': 0, 'price': 90.0}]}],
+        'crypto': [{'id': 'bitcoin', 'amount': 1.0, 'avg_cost': 50.0,
+                    'lots': [{'date': None, 'qty': 2.0, 'price': 10.0}, {'date': None, 'qty': 1.0, 'price': 25.0}],
+                    'lot_state': {'head': 1, 'scale': 2.0, 'raw_cost': 25.0}}],
+    }
+    with open(dm.PORTFOLIO_FILE, 'w', encoding='utf-8') as f:
+        json.dump(legacy, f)
+
+    portfolio = dm.load_portfolio()
+    assert portfolio['stocks'][0] == {'symbol': 'AAPL', 'shares': 5, 'avg_cost': 120.0, 'lot_ref': 'stocks/AAPL'}
+    assert dm.load_lots('stocks/AAPL') == {'lots': [{'date': '2024-01-01', 'qty': 5, 'price': 120.0}],
+                                           'head': 0, 'scale': 1.0, 'raw_cost': 600.0}
+    state = dm.load_lots(portfolio['crypto'][0]['lot_ref'])
+    ledger = ll.LotLedger.from_holding('bitcoin', portfolio['crypto'][0], 'amount', state=state)
+    assert ledger.position('bitcoin') == (1.0, 50.0)
+    # 搬移後的 portfolio.json 已不含批次
+    with open(dm.PORTFOLIO_FILE, encoding='utf-8') as f:
+        assert 'lots' not in f.read()
+
+
+def test_sqlite_backend_stores_lots_in_a_table(workdir, monkeypatch):
+    import storage_sqlite
+    monkeypatch.setattr(storage_sqlite, '_ready', set())
+    dm.save_lots('crypto/bitcoin', {'lots': [{'date': None, 'qty': 1.0, 'price': 10.0}], 'head': 0, 'scale': 1.0,
+                                    'raw_cost': 10.0})
+    monkeypatch.setattr(dm, 'STORAGE_BACKEND', 'sqlite')
+    assert storage_sqlite.migrate_from_files()['lots'] == 1
+    assert dm.load_lots('crypto/bitcoin')['raw_cost'] == 10.0
+    dm.save_lots('crypto/bitcoin', {'lots': [], 'head': 0, 'scale': 1.0, 'raw_cost': 0.0})
+    assert dm.load_lots('crypto/bitcoin') is None
@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+
+import chart_plotter as cp
+from chart_plotter import lttb_indices
+
+
+def test_keeps_endpoints_and_threshold_count():
+    x = np.arange(1000, dtype=float)
+    y = np.sin(x / 30)
+    idx = lttb_indices(x, y, 100)
+    assert len(idx) == 100
+    assert idx[0] == 0 and idx[-1] == 999
+    assert np.all(np.diff(idx) > 0)
+
+
+def test_small_series_and_thresholds_are_untouched():
+    x = np.arange(10)
+    assert list(lttb_indices(x, x, 10)) == list(range(10))
+    assert list(lttb_indices(x, x, 50)) == list(range(10))
+    assert list(lttb_indices(x, x, 2)) == list(range(10))
+
+
+def test_keeps_spikes():
+    x = np.arange(2000, dtype=float)
+    y = np.zeros(2000)
+    y[1234] = 50
+    y[567] = -50
+    idx = set(lttb_indices(x, y, 50))
+    assert {567, 1234} <= idx
+
+
+def test_tolerates_nan():
+    x = np.arange(500, dtype=float)
+    y = np.full(500, np.nan)
+    y[::7] = 1.0
+    idx = lttb_indices(x, y, 40)
+    assert len(idx) == 40 and idx[-1] == 499
+
+
+def _price_df(n):
+    return pd.DataFrame({'Datetime': pd.date_range('2024-01-01', periods=n, freq='min'),
+                         'Close': 100 + np.sin(np.arange(n) / 50)})
+
+
+def test_long_series_uses_webgl_even_after_downsampling():
+    fig = cp.plot_price_history(_price_df(cp.WEBGL_THRESHOLD + 1000), 'T', show_ma5=True)
+    assert len(fig.data[0].x) <= cp.point_budget(None)
+    assert all(isinstance(trace, go.Scattergl) for trace in fig.data)
+    assert isinstance(cp.plot_price_history(_price_df(500), 'T').data[0], go.Scatter)
@@ -0,0 +1,87 @@
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import aiohttp
+import pytest
+
+import market_engine as me
+import ratelimit as rl
+
+
+class _Handler(BaseHTTPRequestHandler):
+    status = 503
+    body = b'{"bitcoin": {"twd": 1.0}}'
+    calls = 0
+
+    def do_GET(self):
+        type(self).calls += 1
+        self.send_response(self.status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server(fresh_breakers, monkeypatch):
+    ah = fresh_breakers
+    handler = type('Handler', (_Handler,), {})
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    monkeypatch.setattr(ah, 'HTTP_BACKOFF_BASE', 0)
+    monkeypatch.setattr(ah, 'rate_limiter', lambda provider: rl.TokenBucket(provider, 0))
+    yield ah, handler, f"http://127.0.0.1:{httpd.server_address[1]}/simple/price"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def _get(url, provider='coingecko'):
+    async def run():
+        async with aiohttp.ClientSession() as session:
+            return await me._get_json(session, me._Limits(), provider, url)
+    return asyncio.run(run())
+
+
+def test_repeated_5xx_opens_the_breaker(server):
+    ah, handler, url = server
+    for _ in range(ah.CIRCUIT_FAILURE_THRESHOLD):
+        with pytest.raises(aiohttp.ClientResponseError):
+            _get(url)
+    assert ah.circuit_breaker('coingecko').state == 'open'
+    assert handler.calls == ah.CIRCUIT_FAILURE_THRESHOLD * (ah.HTTP_MAX_RETRIES + 1)
+    with pytest.raises(rl.CircuitOpenError):
+        _get(url)
+    assert handler.calls == ah.CIRCUIT_FAILURE_THRESHOLD * (ah.HTTP_MAX_RETRIES + 1)
+
+
+def test_success_after_failures_closes_the_breaker(server):
+    ah, handler, url = server
+    with pytest.raises(aiohttp.ClientResponseError):
+        _get(url)
+    handler.status = 200
+    assert _get(url) == {'bitcoin': {'twd': 1.0}}
+    assert ah.circuit_breaker('coingecko').failures == 0
+
+
+def test_client_errors_do_not_trip_the_breaker(server):
+    ah, handler, url = server
+    handler.status = 404
+    for _ in range(ah.CIRCUIT_FAILURE_THRESHOLD + 1):
+        with pytest.raises(aiohttp.ClientResponseError):
+            _get(url)
+    assert ah.circuit_breaker('coingecko').state == 'closed'
+    assert handler.calls == ah.CIRCUIT_FAILURE_THRESHOLD + 1
+
+
+def test_bad_json_does_not_trip_the_breaker(server):
+    ah, handler, url = server
+    handler.status, handler.body = 200, b'<html>maintenance</html>'
+    for _ in range(ah.CIRCUIT_FAILURE_THRESHOLD + 1):
+        with pytest.raises(json.JSONDecodeError):
+            _get(url)
+    assert ah.circuit_breaker('coingecko').state == 'closed'
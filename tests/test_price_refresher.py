@@ -0,0 +1,58 @@
+import os
+import subprocess
+import sys
+import time
+
+import price_refresher as pr
+
+INTERVALS = {'crypto': (60, 60), 'tw_stock': (120, 120), 'us_stock': (120, 120), 'fx': (3600, 3600)}
+
+
+def _snapshot(now, ages):
+    return {"version": 1, "created_at": now - max(ages.values()),
+            "updated_at": {cls: now - age for cls, age in ages.items()},
+            "prices": {"AAPL": 190.0, "2330.TW": 900.0, "bitcoin": 2_000_000.0},
+            "usd_table": {"USD": 1.0, "TWD": 32.0},
+            "quote_report": {"batch": [], "fallback": [], "cached": [], "stale": [], "missing": [], "as_of": {}}}
+
+
+def test_stale_classes_use_interval_multiple(fresh_breakers):
+    now = time.time()
+    refresher = pr.PriceRefresher(INTERVALS)
+    snap = _snapshot(now, {'crypto': 60 * pr.SNAPSHOT_STALE_FACTOR + 1, 'us_stock': 100, 'tw_stock': 5,
+                           'fx': 10})
+    assert pr.stale_classes(snap, ['AAPL', '2330.TW'], ['bitcoin'], now, refresher) == ['crypto']
+    # 沒有持有的類別不算
+    assert pr.stale_classes(snap, ['AAPL'], [], now, refresher) == []
+    assert pr.stale_classes(None, ['AAPL'], [], now, refresher) == []
+
+
+def test_snapshot_marks_stale_ids(fresh_breakers, monkeypatch):
+    monkeypatch.setattr(pr, 'REFRESH_INTERVALS', INTERVALS)
+    now = time.time()
+    snap = _snapshot(now, {'crypto': 10_000, 'us_stock': 10, 'tw_stock': 10, 'fx': 10})
+    _, _, prices, report = pr.market_data_from_snapshot(snap, ['AAPL'], ['bitcoin'], now)
+    assert prices == {'AAPL': 190.0, 'bitcoin': 2_000_000.0}
+    assert report['stale'] == ['bitcoin']
+    assert report['as_of'] == {'bitcoin': now - 10_000}
+    assert snap['quote_report']['stale'] == []
+
+
+_PUBLISHER = """
+import sys
+import price_refresher as pr
+worker = sys.argv[1]
+for i in range(5):
+    pr.publish({'crypto': {f'{worker}-{i}': 1.0}})
+"""
+
+
+def test_concurrent_processes_do_not_lose_versions(workdir):
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.abspath(pr.__file__)))
+    workers = [subprocess.Popen([sys.executable, '-c', _PUBLISHER, str(w)], cwd=workdir, env=env)
+               for w in range(4)]
+    assert all(p.wait(60) == 0 for p in workers)
+    latest = pr.load_latest_snapshot(cached=False)
+    assert latest['version'] == 20
+    assert set(latest['prices']) == {f'{w}-{i}' for w in range(4) for i in range(5)}
+    assert not (workdir / pr.SNAPSHOT_DIR / pr.SNAPSHOT_LOCK).exists()
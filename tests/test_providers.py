@@ -0,0 +1,112 @@
+import json
+
+import pytest
+
+import providers as pv
+
+
+@pytest.fixture
+def local_file(workdir):
+    path = workdir / 'prices.json'
+    path.write_text(json.dumps({
+        "quotes": {"AAPL": 190.5, "bitcoin": 65000, "DEAD": 0},
+        "fx": {"TWD": 32.1, "USD": 1.0},
+        "bars": {"AAPL": {"1d": [[1_700_000_000 + i * 86400, 100.0 + i, 1000] for i in range(60)]}},
+    }), encoding='utf-8')
+    return str(path)
+
+
+def test_local_provider_quotes_fx_history(local_file):
+    local = pv.LocalProvider(local_file, 'local-test')
+    assert local.quotes('stock', ['AAPL', 'MSFT', 'DEAD'], {}) == {'AAPL': 190.5}
+    assert local.fx_table() == ({"TWD": 32.1, "USD": 1.0}, None)
+    bars = local.history('AAPL', '1d', period='5d')
+    assert list(bars['Close']) == [154.0, 155.0, 156.0, 157.0, 158.0, 159.0]
+    assert local.history('AAPL', '1h') is None
+    assert len(local.history('AAPL', '1d', period='max')) == 60
+
+
+def test_local_provider_reloads_and_handles_missing_file(local_file, workdir):
+    local = pv.LocalProvider(local_file)
+    assert local.quotes('stock', ['AAPL'], {}) == {'AAPL': 190.5}
+    missing = pv.LocalProvider(str(workdir / 'nope.json'))
+    assert missing.quotes('stock', ['AAPL'], {}) == {}
+    assert missing.fx_table() == (None, None)
+
+
+def test_plan_splits_by_batch_size(fresh_breakers, monkeypatch):
+    monkeypatch.setitem(pv.PROVIDER_CHAINS, 'stock', ('yahoo',))
+    monkeypatch.setattr(pv.get_provider('yahoo'), 'batch_size', 2)
+    plan = pv.plan_requests('stock', ['A', 'B', 'C', 'D', 'E'])
+    assert [(p.name, batch) for p, batch in plan] == [('yahoo', ['A', 'B']), ('yahoo', ['C', 'D']),
+                                                     ('yahoo', ['E'])]
+
+
+def test_chain_env_override(monkeypatch):
+    monkeypatch.setenv('PYASSET_PROVIDERS_STOCK', 'local, nope ,yahoo')
+    assert [p.name for p in pv.chain('stock')] == ['local', 'yahoo']
+    assert not pv.uses_builtin_chains()
+
+
+def test_fetch_quotes_from_local_chain(local_file, fresh_breakers, monkeypatch):
+    monkeypatch.setitem(pv._registry, 'local-test', pv.LocalProvider(local_file, 'local-test'))
+    monkeypatch.setitem(pv.PROVIDER_CHAINS, 'crypto', ('local-test',))
+    report = fresh_breakers.empty_quote_report()
+    assert pv.fetch_quotes('crypto', ['bitcoin', 'nothing'], report) == {'bitcoin': 65000.0}
+    assert report['batch'] == ['bitcoin']
+    assert report['providers'] == {'bitcoin': 'local-test'}
+
+
+class _Down(pv.Provider):
+    name = 'down'
+    capabilities = ('quotes', 'history', 'fx')
+    asset_classes = ('stock', 'crypto')
+
+    def quotes(self, asset_class, keys, report):
+        raise ConnectionError('provider down')
+
+    def history(self, symbol, interval, period=None, start=None):
+        raise ConnectionError('provider down')
+
+    def fx_table(self):
+        raise ConnectionError('provider down')
+
+
+@pytest.fixture
+def down_then_local(local_file, fresh_breakers, monkeypatch):
+    monkeypatch.setitem(pv._registry, 'down', _Down())
+    monkeypatch.setitem(pv._registry, 'local-test', pv.LocalProvider(local_file, 'local-test'))
+    for purpose in ('stock', 'crypto', 'fx', 'history'):
+        monkeypatch.setitem(pv.PROVIDER_CHAINS, purpose, ('down', 'local-test'))
+    return fresh_breakers
+
+
+def test_failover_from_raising_provider_to_local(down_then_local):
+    report = down_then_local.empty_quote_report()
+    assert pv.fetch_quotes('stock', ['AAPL', 'MSFT'], report) == {'AAPL': 190.5}
+    assert report['providers'] == {'AAPL': 'local-test'}
+    assert report['batch'] == ['AAPL']
+    assert pv.fetch_fx_table() == ({"TWD": 32.1, "USD": 1.0}, None)
+    assert len(pv.fetch_history('AAPL', '1d', period='5d')) == 6
+
+
+def test_incomplete_provider_is_rejected():
+    class QuotesOnly(pv.Provider):
+        name = 'quotes-only'
+        capabilities = ('quotes',)
+
+        def quotes(self, asset_class, keys, report):
+            return {}
+
+    with pytest.raises(TypeError):
+        pv.register(QuotesOnly())
+    with pytest.raises(TypeError):
+        pv.register(object())
+
+    class Misdeclared(_Down):
+        name = 'misdeclared'
+        capabilities = ('quotes', 'news')
+
+    with pytest.raises(ValueError):
+        pv.register(Misdeclared())
+    assert 'quotes-only' not in pv._registry and 'misdeclared' not in pv._registry
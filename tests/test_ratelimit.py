@@ -0,0 +1,113 @@
+import threading
+import time
+
+import pytest
+
+import ratelimit as rl
+
+
+# --- TokenBucket ---
+def test_bucket_burst_then_waits_at_rate():
+    bucket = rl.TokenBucket('test', rate=10, burst=2)
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == pytest.approx(0.1, abs=0.02)
+    # 預約排隊：第二個等待者排在第一個之後
+    assert bucket.reserve() == pytest.approx(0.2, abs=0.02)
+    assert bucket.status()["throttled"] == 2
+
+
+def test_bucket_reserves_multiple_tokens():
+    bucket = rl.TokenBucket('test', rate=4, burst=4)
+    assert bucket.reserve(4) == 0
+    assert bucket.reserve(2) == pytest.approx(0.5, abs=0.02)
+
+
+def test_unlimited_bucket_never_waits():
+    bucket = rl.TokenBucket('test', rate=0)
+    assert all(bucket.reserve() == 0 for _ in range(100))
+    assert bucket.status()["tokens"] is None
+
+
+# --- SingleFlight ---
+def test_single_flight_coalesces_concurrent_calls():
+    flight = rl.SingleFlight('test')
+    calls = []
+    started = threading.Event()
+    release = threading.Event()
+
+    def fetch():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return 42
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flight.do('k', fetch)))
+    leader.start()
+    started.wait(5)
+    followers = [threading.Thread(target=lambda: results.append(flight.do('k', fetch))) for _ in range(3)]
+    for t in followers:
+        t.start()
+    while flight.coalesced < 3:
+        time.sleep(0.001)
+    release.set()
+    for t in [leader] + followers:
+        t.join(5)
+    assert results == [42] * 4
+    assert len(calls) == 1
+
+
+def test_single_flight_shares_errors_and_forgets_key():
+    flight = rl.SingleFlight('test')
+
+    def boom():
+        raise ValueError('bad')
+
+    with pytest.raises(ValueError):
+        flight.do('k', boom)
+    assert flight.do('k', lambda: 'ok') == 'ok'
+
+
+# --- CircuitBreaker ---
+def test_breaker_opens_after_threshold():
+    breaker = rl.CircuitBreaker('test', failure_threshold=3, reset_timeout=60)
+    for _ in range(2):
+        breaker.record_failure('x')
+        assert breaker.allow()
+    breaker.record_failure('x')
+    assert breaker.state == 'open'
+    assert not breaker.allow()
+    with pytest.raises(rl.CircuitOpenError):
+        breaker.check()
+    assert breaker.status()["rejected"] == 2
+
+
+def test_breaker_success_resets_failures():
+    breaker = rl.CircuitBreaker('test', failure_threshold=2)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == 'closed'
+
+
+def test_breaker_half_open_allows_single_probe():
+    breaker = rl.CircuitBreaker('test', failure_threshold=1, reset_timeout=0.01)
+    breaker.record_failure()
+    time.sleep(0.02)
+    assert breaker.allow()
+    assert breaker.state == 'half_open'
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == 'closed'
+    assert breaker.allow()
+
+
+def test_breaker_failed_probe_reopens():
+    breaker = rl.CircuitBreaker('test', failure_threshold=1, reset_timeout=0.01)
+    breaker.record_failure()
+    time.sleep(0.02)
+    assert breaker.allow()
+    breaker.record_failure('still down')
+    assert breaker.state == 'open'
+    assert breaker.status()["last_error"] == 'still down'
@@ -0,0 +1,100 @@
+import sqlite3
+
+import pytest
+
+import data_manager as dm
+import storage_sqlite
+
+
+def _tx(date, amount, category='餐飲', currency='TWD'):
+    return {'date': date, 'amount': amount, 'category': category, 'currency': currency}
+
+
+def _rollup_table():
+    conn = sqlite3.connect(dm.STORAGE_DB_FILE)
+    try:
+        return {(m, c, cur): (total, count) for m, c, cur, total, count in conn.execute("SELECT * FROM expense_rollup")}
+    finally:
+        conn.close()
+
+
+@pytest.fixture
+def sqlite_backend(workdir, monkeypatch):
+    monkeypatch.setattr(storage_sqlite, '_ready', set())
+    monkeypatch.setattr(dm, 'STORAGE_BACKEND', 'sqlite')
+    return workdir
+
+
+def test_migrate_from_files_keeps_every_record(workdir, monkeypatch):
+    monkeypatch.setattr(storage_sqlite, '_ready', set())
+    portfolio = {'stocks': [{'symbol': '2330.TW', 'currency': 'TWD', 'shares': 1000, 'avg_cost': 500.0},
+                            {'symbol': 'AAPL', 'currency': 'USD', 'shares': 2, 'avg_cost': 150.0}],
+                 'crypto': [{'id': 'bitcoin', 'symbol': 'btc', 'amount': 0.5, 'avg_cost': 30000.0}]}
+    transactions = [_tx('2024-01-05', 100), _tx('2024-02-01', 30, '交通', 'USD'), {'date': '2024-02-03', 'amount': 5}]
+    pnl = [{'date': '2024-03-01', 'asset_id': 'AAPL', 'type': 'Stock', 'currency': 'USD', 'pnl': 12.5}]
+    dm.save_portfolio(portfolio)
+    dm.save_transactions(transactions)
+    dm.save_realized_pnl(pnl)
+    (workdir / dm.HISTORY_FILE).write_text("2024-01-01,100.0\n2024-01-02,110.5\n", encoding='utf-8')
+
+    counts = storage_sqlite.migrate_from_files()
+    assert counts == {'stocks': 2, 'crypto': 1, 'transactions': 3, 'realized_pnl': 1, 'history': 2, 'lots': 0}
+
+    monkeypatch.setattr(dm, 'STORAGE_BACKEND', 'sqlite')
+    assert dm.load_portfolio() == portfolio
+    assert dm.load_transactions() == transactions
+    assert dm.load_realized_pnl() == pnl
+    assert storage_sqlite.load_history_rows() == [('2024-01-01', 100.0), ('2024-01-02', 110.5)]
+    # 缺少類別 / 幣別的舊紀錄以預設值建立索引欄位
+    assert dm.query_transactions(category='其他', currency='TWD') == [{'date': '2024-02-03', 'amount': 5}]
+
+    # 再次遷移會覆蓋，而不是重複匯入
+    assert storage_sqlite.migrate_from_files() == counts
+    assert dm.load_transactions() == transactions
+
+
+def test_triggers_keep_rollup_in_sync(sqlite_backend):
+    dm.save_transactions([_tx('2024-01-05', 100), _tx('2024-01-20', 50)])
+    dm.append_transaction(_tx('2024-02-01', 30, '交通', 'USD'))
+    assert _rollup_table() == {('2024-01', '餐飲', 'TWD'): (150, 2), ('2024-02', '交通', 'USD'): (30, 1)}
+    dm.delete_transaction(0)
+    assert _rollup_table() == {('2024-01', '餐飲', 'TWD'): (50, 1), ('2024-02', '交通', 'USD'): (30, 1)}
+    # 該組合最後一筆刪除後整列移除
+    dm.delete_transaction(1)
+    assert _rollup_table() == {('2024-01', '餐飲', 'TWD'): (50, 1)}
+    dm.save_transactions([])
+    assert _rollup_table() == {}
+
+
+def test_delete_at_removes_the_row_at_that_position(sqlite_backend):
+    records = [_tx(f'2024-01-0{day}', day) for day in range(1, 6)]
+    dm.save_transactions(records)
+    # 先刪掉開頭，讓 id 與列表位置錯開，確認是依位置而不是 id 刪除
+    dm.delete_transaction(0)
+    dm.delete_transaction(2)
+    assert dm.load_transactions() == [records[1], records[2], records[4]]
+    dm.delete_transaction(10)
+    assert len(dm.load_transactions()) == 3
+
+    dm.append_realized_pnl({'date': '2024-01-01', 'asset_id': 'A', 'pnl': 1})
+    dm.append_realized_pnl({'date': '2024-01-02', 'asset_id': 'B', 'pnl': 2})
+    dm.delete_realized_pnl(1)
+    assert [r['asset_id'] for r in dm.load_realized_pnl()] == ['A']
+
+
+def test_update_history_upserts_one_row_per_day(sqlite_backend):
+    storage_sqlite.update_history('2024-01-01', 100)
+    storage_sqlite.update_history('2024-01-02', 200)
+    storage_sqlite.update_history('2024-01-01', 150)
+    assert storage_sqlite.load_history_rows() == [('2024-01-01', 150.0), ('2024-01-02', 200.0)]
+    assert storage_sqlite.load_history_rows(start='2024-01-02') == [('2024-01-02', 200.0)]
+    assert storage_sqlite.load_history_rows(end='2024-01-01T23:59') == [('2024-01-01', 150.0)]
+
+
+@pytest.mark.parametrize("backend", ['file', 'sqlite'])
+def test_query_transactions_filters(workdir, monkeypatch, backend):
+    monkeypatch.setattr(storage_sqlite, '_ready', set())
+    monkeypatch.setattr(dm, 'STORAGE_BACKEND', backend)
+    dm.save_transactions([_tx('2024-01-05', 100), _tx('2024-02-01', 30, '交通'), _tx('2024-02-10', 5)])
+    assert dm.query_transactions(month='2024-02') == [_tx('2024-02-01', 30, '交通'), _tx('2024-02-10', 5)]
+    assert dm.query_transactions(start='2024-02-05', category='餐飲') == [_tx('2024-02-10', 5)]
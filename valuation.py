@@ -0,0 +1,115 @@
+import numpy as np
+import pandas as pd
+
+ASSET_COLUMNS = ["Type", "ID", "Name", "Qty", "Currency", "Price_Native", "Cost_Unit", "Cost_Total",
+                 "Market_Val_Native", "PnL_Val", "PnL_Pct", "Market_Val_TWD", "Chart_Ticker"]
+
+
+def _fx_array(currency, fx_to_twd):
+    """把幣別陣列轉成對應的台幣匯率陣列 (每種幣別只查一次)"""
+    inverse, codes = pd.factorize(np.asarray(currency, dtype=object))
+    rates = np.array([fx_to_twd.get(c, 1.0) for c in codes], dtype=float)
+    return rates[inverse]
+
+
+def value_holdings(qty, avg_cost, price, currency, fx_to_twd):
+    """
+    一次算出所有持倉的市值、成本、未實現損益與報酬率
+    qty / avg_cost / price: 原幣別的數值陣列
+    currency: 幣別陣列；fx_to_twd: {幣別: 1 單位折合多少台幣}
+    """
+    qty = np.asarray(qty, dtype=float)
+    avg_cost = np.asarray(avg_cost, dtype=float)
+    price = np.asarray(price, dtype=float)
+    fx = _fx_array(currency, fx_to_twd) if len(qty) else np.zeros(0)
+
+    market_val = price * qty
+    cost_total = avg_cost * qty
+    pnl = market_val - cost_total
+    pnl_pct = np.divide(pnl, cost_total, out=np.zeros_like(pnl), where=cost_total > 0) * 100
+
+    return {
+        "market_val": market_val,
+        "cost_total": cost_total,
+        "pnl": pnl,
+        "pnl_pct": pnl_pct,
+        "market_val_twd": market_val * fx,
+        "cost_total_twd": cost_total * fx,
+    }
+
+
+def _holding_arrays(portfolio, asset_prices, usd_to_twd):
+    """把 portfolio dict 攤平成欄位陣列 (股票在前、加密貨幣在後，順序與原列表相同)"""
+    stocks = portfolio.get('stocks', [])
+    cryptos = portfolio.get('crypto', [])
+
+    stock_ids = [s['symbol'] for s in stocks]
+    crypto_ids = [c['id'] for c in cryptos]
+    stock_curr = ["TWD" if ".TW" in s['symbol'] or s.get('currency') == 'TWD' else "USD" for s in stocks]
+
+    # CoinGecko 報的是台幣價，換回美元作為加密貨幣的原幣價格
+    stock_price = np.array([asset_prices.get(i, 0.0) for i in stock_ids], dtype=float)
+    crypto_price = np.array([asset_prices.get(i, 0.0) for i in crypto_ids], dtype=float) / usd_to_twd
+
+    return {
+        "Type": ["Stock"] * len(stocks) + ["Crypto"] * len(cryptos),
+        "ID": stock_ids + crypto_ids,
+        "Name": [s.get('name', s['symbol']) for s in stocks] + [c.get('name', c['id']).title() for c in cryptos],
+        "Qty": np.array([s['shares'] for s in stocks] + [c['amount'] for c in cryptos], dtype=float),
+        "Currency": stock_curr + ["USD"] * len(cryptos),
+        "Price_Native": np.concatenate([stock_price, crypto_price]),
+        "Cost_Unit": np.array([h.get('avg_cost', 0.0) for h in stocks + cryptos], dtype=float),
+        "Chart_Ticker": stock_ids + [f"{c.get('symbol', '').upper()}-USD" if c.get('symbol') else None
+                                     for c in cryptos],
+    }
+
+
+def value_portfolio(portfolio, asset_prices, usd_to_twd):
+    """
+    回傳 (assets_df, totals)
+    assets_df 欄位同儀表板的持倉列表；totals 為各項台幣合計
+    """
+    cols = _holding_arrays(portfolio, asset_prices, usd_to_twd)
+    result = value_holdings(cols["Qty"], cols["Cost_Unit"], cols["Price_Native"], cols["Currency"],
+                            {"TWD": 1.0, "USD": usd_to_twd})
+
+    assets_df = pd.DataFrame({
+        **cols,
+        "Cost_Total": result["cost_total"],
+        "Market_Val_Native": result["market_val"],
+        "PnL_Val": result["pnl"],
+        "PnL_Pct": result["pnl_pct"],
+        "Market_Val_TWD": result["market_val_twd"],
+    }, columns=ASSET_COLUMNS)
+
+    is_stock = assets_df["Type"].to_numpy() == "Stock"
+    stock_value = float(result["market_val_twd"][is_stock].sum())
+    crypto_value = float(result["market_val_twd"][~is_stock].sum())
+    invested = float(result["cost_total_twd"].sum())
+    net_worth = stock_value + crypto_value
+    unrealized = net_worth - invested
+
+    totals = {
+        "stock_value_twd": stock_value,
+        "crypto_value_twd": crypto_value,
+        "invested_twd": invested,
+        "net_worth_twd": net_worth,
+        "unrealized_pnl_twd": unrealized,
+        "roi_pct": unrealized / invested * 100 if invested > 0 else 0.0,
+    }
+    return assets_df, totals
+
+
+def missing_prices(portfolio, asset_prices):
+    """回傳有持倉但沒有報價 (缺值或 <= 0) 的代號；這時算出的淨值偏低，不應寫入淨值歷史"""
+    ids = [s['symbol'] for s in portfolio.get('stocks', [])] + [c['id'] for c in portfolio.get('crypto', [])]
+    return [i for i in ids if not asset_prices.get(i, 0.0) > 0]
+
+
+def realized_pnl_total_twd(realized_records, usd_to_twd):
+    """已實現損益合計 (非台幣一律以美元計)"""
+    if not realized_records:
+        return 0.0
+    pnl = np.array([r.get('pnl', 0.0) for r in realized_records], dtype=float)
+    is_twd = np.array([r.get('currency', 'USD') == 'TWD' for r in realized_records])
+    return float(np.where(is_twd, pnl, pnl * usd_to_twd).sum())